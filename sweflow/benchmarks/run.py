@@ -0,0 +1,278 @@
+"""
+Time the hot paths of the pipeline on synthetic projects of several scales, and compare them with the stored
+baseline (`baseline.json`, recorded on the machine described by its `environment`) or the results of an earlier run.
+"""
+from typing import Callable, Dict, List
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+
+from sweflow.benchmarks.synthetic import SCALES, generate_project
+from sweflow.extensions.python.schedule import create_development_schedule
+from sweflow.extensions.python.helper import (
+    CodeParser,
+    reinit_codebase,
+    update_codebase_on_schedule,
+    skeletonize_codebase_on_schedule,
+    generate_patch,
+    generate_patch_from_commits,
+    convert_patch_to_replace,
+)
+from sweflow.extensions.python.helper.code_utils import skeletonize_file
+from sweflow.utils.merge import merge_to_jsonl
+from sweflow.utils.profiling import add_profile_arguments, start_profiling
+from sweflow.utils.test_ids import PassToPassTestIds
+
+# the results of a run on the reference machine, see the `environment` they record
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the pipeline on synthetic projects")
+
+    parser.add_argument("--output-file", type=str, required=True, help="Path to the JSON results, which can serve as a later baseline")
+    parser.add_argument("--scales", type=str, nargs="+", default=["small", "medium"], choices=list(SCALES), help="Scales of the synthetic projects")
+    parser.add_argument("--benchmarks", type=str, nargs="+", default=None, help="Benchmarks to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each benchmark")
+    parser.add_argument("--max-steps", type=int, default=100, help="Maximum number of steps of the codebase benchmarks")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic projects")
+    parser.add_argument("--work-dir", type=str, default=None, help="Path to the directory of the synthetic projects, a temporary directory by default")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_FILE), help="Path to the results of an earlier run to compare with, the stored baseline by default")
+    parser.add_argument("--no-baseline", action="store_true", help="Do not compare with a baseline")
+    parser.add_argument("--max-regression", type=float, default=1.25, help="Slowdown over the baseline, as a ratio of the fastest runs, from which a benchmark fails")
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+def prepare_context(work_dir: str, scale: str, seed: int = 0, max_steps: int = 100) -> Dict:
+    """
+    Generate the synthetic project of a scale and the inputs shared by the benchmarks, outside of any timing.
+    """
+    project_root, trace_file = generate_project(Path(work_dir) / scale, SCALES[scale], seed)
+    development_schedule, _, _ = create_development_schedule(str(trace_file))
+    steps = development_schedule[:max_steps]
+
+    files = []
+    for schedule in steps:
+        skeleton_files, reference_files = skeletonize_codebase_on_schedule(str(project_root), schedule, {})
+        files.append((skeleton_files, reference_files))
+    patches = [generate_patch(skeleton_files, reference_files) for skeleton_files, reference_files in files]
+
+    sources = {str(path.relative_to(project_root)): path.read_text() for path in sorted((project_root / "pkg").glob("mod_*.py"))}
+    nodes = sorted({node for schedule in development_schedule for node in schedule['nodes-to-develop']})
+
+    return {
+        "work-dir": str(Path(work_dir) / scale),
+        "project-root": str(project_root),
+        "trace-file": str(trace_file),
+        "development-schedule": development_schedule,
+        "steps": steps,
+        "files": files,
+        "patches": patches,
+        "sources": sources,
+        "nodes": nodes,
+    }
+
+
+def bench_schedule(context: Dict) -> float:
+    start_time = time.perf_counter()
+    create_development_schedule(context['trace-file'])
+    return time.perf_counter() - start_time
+
+
+def bench_code_parser(context: Dict) -> float:
+    start_time = time.perf_counter()
+    for node in context['nodes']:
+        filepath, lineno, function_name = node.split(':')
+        CodeParser.get_function_content(context['sources'][filepath], function_name, lineno)
+    return time.perf_counter() - start_time
+
+
+def bench_skeletonizer(context: Dict) -> float:
+    # skeletonize every module with all of its functions to develop
+    nodes_by_file = {}
+    for node in context['nodes']:
+        nodes_by_file.setdefault(node.split(':', 1)[0], []).append(node)
+    start_time = time.perf_counter()
+    for filepath, nodes in nodes_by_file.items():
+        skeletonize_file({"filepath": filepath, "content": context['sources'][filepath]}, nodes, [], {})
+    return time.perf_counter() - start_time
+
+
+def bench_update_codebase(context: Dict) -> float:
+    with TemporaryDirectory(dir=context['work-dir']) as codebase_dir:
+        repo = reinit_codebase(context['project-root'], codebase_dir)
+        start_time = time.perf_counter()
+        for schedule, (skeleton_files, reference_files) in zip(context['steps'], context['files']):
+            update_codebase_on_schedule(repo, schedule, skeleton_files, reference_files)
+        return time.perf_counter() - start_time
+
+
+def bench_generate_patch(context: Dict) -> float:
+    start_time = time.perf_counter()
+    for skeleton_files, reference_files in context['files']:
+        generate_patch(skeleton_files, reference_files)
+    return time.perf_counter() - start_time
+
+
+def bench_generate_patch_git(context: Dict) -> float:
+    # the step branches are committed once, outside of any timing
+    if 'codebase-dir' not in context:
+        context['codebase-dir'] = str(Path(context['work-dir']) / "codebase")
+        repo = reinit_codebase(context['project-root'], context['codebase-dir'])
+        for schedule, (skeleton_files, reference_files) in zip(context['steps'], context['files']):
+            update_codebase_on_schedule(repo, schedule, skeleton_files, reference_files)
+    start_time = time.perf_counter()
+    for schedule in context['steps']:
+        generate_patch_from_commits(context['codebase-dir'], f"step-{schedule['step']}-skeleton", f"step-{schedule['step']}-reference")
+    return time.perf_counter() - start_time
+
+
+def bench_convert_patch(context: Dict) -> float:
+    start_time = time.perf_counter()
+    for patch in context['patches']:
+        convert_patch_to_replace(patch)
+    return time.perf_counter() - start_time
+
+
+def bench_merge(context: Dict) -> float:
+    with TemporaryDirectory(dir=context['work-dir']) as input_dir:
+        # the outputs of a codebase with every step flagged in
+        development_schedule = context['development-schedule']
+        pass_to_pass_test_ids = PassToPassTestIds()
+        for schedule in development_schedule:
+            pass_to_pass_test_ids.add_step(schedule['step'], schedule['test-ids'])
+        pass_to_pass_test_ids.dump(Path(input_dir) / "pass-to-pass-test-ids.json")
+        outputs = {
+            "step-flags": ("flag", True),
+            "specifications": ("specification", "Implement the functions."),
+            "base-commits": ("base-commit", "0" * 40),
+            "reference-commits": ("reference-commit", "1" * 40),
+            "reference-patches": ("reference-patch", context['patches'][0] if context['patches'] else ""),
+        }
+        for name, (key, value) in outputs.items():
+            with open(Path(input_dir) / f"{name}.json", "w") as f:
+                json.dump([{"step": schedule['step'], key: value} for schedule in development_schedule], f)
+        with open(Path(input_dir) / "fail-to-pass-test-ids.json", "w") as f:
+            json.dump([{"step": schedule['step'], "fail-to-pass-test-ids": schedule['test-ids']} for schedule in development_schedule], f)
+
+        start_time = time.perf_counter()
+        merge_to_jsonl("synthetic/project", input_dir, str(Path(input_dir) / "dataset.jsonl"))
+        return time.perf_counter() - start_time
+
+
+BENCHMARKS: Dict[str, Callable[[Dict], float]] = {
+    "schedule": bench_schedule,
+    "code-parser": bench_code_parser,
+    "skeletonizer": bench_skeletonizer,
+    "update-codebase": bench_update_codebase,
+    "generate-patch": bench_generate_patch,
+    "generate-patch-git": bench_generate_patch_git,
+    "convert-patch": bench_convert_patch,
+    "merge": bench_merge,
+}
+
+
+def run_benchmarks(work_dir: str, scales: List[str], benchmarks: List[str], repeat: int = 3, max_steps: int = 100, seed: int = 0) -> List[Dict]:
+    """
+    Run every benchmark `repeat` times at every scale.
+
+    Returns:
+        The timings of each benchmark and scale, in seconds.
+    """
+    results = []
+    for scale in scales:
+        context = prepare_context(work_dir, scale, seed, max_steps)
+        for name in benchmarks:
+            times = [BENCHMARKS[name](context) for _ in range(repeat)]
+            results.append({
+                "benchmark": name,
+                "scale": scale,
+                "size": SCALES[scale],
+                "steps": len(context['steps']) if name in ("update-codebase", "generate-patch", "generate-patch-git", "convert-patch") else len(context['development-schedule']),
+                "repeat": repeat,
+                "min": round(min(times), 6),
+                "median": round(statistics.median(times), 6),
+                "max": round(max(times), 6),
+            })
+    return results
+
+
+def compare_with_baseline(results: List[Dict], baseline: List[Dict], max_regression: float = 1.25) -> List[Dict]:
+    """
+    Compare the fastest run of each benchmark with the baseline, benchmarks missing from the baseline are skipped.
+
+    Returns:
+        The ratio of each benchmark to its baseline, and whether it regressed beyond `max_regression`.
+    """
+    baseline = {(item['benchmark'], item['scale']): item for item in baseline}
+    comparison = []
+    for item in results:
+        reference = baseline.get((item['benchmark'], item['scale']))
+        if reference is None or reference['min'] <= 0:
+            continue
+        ratio = item['min'] / reference['min']
+        comparison.append({
+            "benchmark": item['benchmark'],
+            "scale": item['scale'],
+            "baseline": reference['min'],
+            "current": item['min'],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > max_regression,
+        })
+    return comparison
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-benchmark")
+
+    benchmarks = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {unknown}, expected some of {list(BENCHMARKS)}")
+
+    if args.work_dir is not None:
+        Path(args.work_dir).mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(dir=args.work_dir) as work_dir:
+        results = run_benchmarks(work_dir, args.scales, benchmarks, args.repeat, args.max_steps, args.seed)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if not args.no_baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        report["comparison"] = compare_with_baseline(results, baseline, args.max_regression)
+
+    Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output_file, "w") as f:
+        json.dump(report, f, indent=4)
+
+    for item in results:
+        print(f"{item['benchmark']:>18} {item['scale']:>8}: min {item['min']:.4f}s, median {item['median']:.4f}s")
+    regressions = [item for item in report.get("comparison", []) if item['regressed']]
+    for item in regressions:
+        print(f"Regression of `{item['benchmark']}` at scale `{item['scale']}`: {item['ratio']:.2f}x the baseline.")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,120 @@
+"""
+Time the startup of the entry points: the import time of their module and the wall time of `--help`.
+
+Entry points run thousands of times over a fleet of repositories, so their modules must import heavy dependencies
+(the LLM clients, networkx, tiktoken, GitPython, numpy, rich, ...) on first use rather than at import time.
+"""
+from typing import Dict, List
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ENTRY_POINT_MODULES = (
+    "sweflow.extensions.python.tracer",
+    "sweflow.extensions.python.select_tests",
+    "sweflow.extensions.python.schedule",
+    "sweflow.extensions.python.create_docstring",
+    "sweflow.extensions.python.create_specification",
+    "sweflow.extensions.python.create_codebase",
+    "sweflow.extensions.python.create_codebase_dev",
+    "sweflow.extensions.python.evaluate",
+    "sweflow.extensions.python.run",
+    "sweflow.utils.fleet",
+    "sweflow.utils.merge",
+    "sweflow.utils.dedup",
+    "sweflow.utils.make_bench",
+)
+
+HEAVY_MODULES = ("fluxllm", "openai", "networkx", "tiktoken", "git", "numpy", "rich", "tqdm", "pyarrow", "pytest")
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the entry points")
+
+    parser.add_argument("--output-file", type=str, default=None, help="Path to the JSON results")
+    parser.add_argument("--modules", type=str, nargs="+", default=list(ENTRY_POINT_MODULES), help="Modules of the entry points, all by default")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs of each entry point")
+    parser.add_argument("--max-import-time", type=float, default=0.1, help="Import time in seconds from which an entry point fails")
+
+    return parser.parse_args()
+
+
+def measure_import(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        Its cumulative import time in seconds, as reported by `-X importtime`, and the heavy modules it imported.
+    """
+    code = f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    import_time = None
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            import_time = int(fields[1]) / 1e6
+    modules = json.loads(process.stdout)
+    return {"import-time": import_time, "heavy-imports": [name for name in HEAVY_MODULES if name in modules]}
+
+
+def measure_command(command: List[str]) -> float:
+    start_time = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start_time
+
+
+def run_startup_benchmarks(modules: List[str], repeat: int = 5) -> Dict:
+    """
+    Time the import and the `--help` of every entry point `repeat` times, along with a bare interpreter.
+
+    Returns:
+        The fastest startup of the bare interpreter, and the fastest import time, `--help` wall time and heavy
+        imports of each entry point, in seconds.
+    """
+    interpreter = min(measure_command([sys.executable, "-c", "pass"]) for _ in range(repeat))
+    results = []
+    for module in modules:
+        imports = [measure_import(module) for _ in range(repeat)]
+        help_time = min(measure_command([sys.executable, "-m", module, "--help"]) for _ in range(repeat))
+        results.append({
+            "module": module,
+            "import-time": round(min(item['import-time'] for item in imports), 6),
+            "help-time": round(help_time, 6),
+            "heavy-imports": imports[0]['heavy-imports'],
+        })
+    return {"interpreter-startup": round(interpreter, 6), "results": results}
+
+
+def main():
+
+    args = parse_args()
+
+    report = run_startup_benchmarks(args.modules, args.repeat)
+    if args.output_file is not None:
+        Path(args.output_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output_file, "w") as f:
+            json.dump(report, f, indent=4)
+
+    print(f"{'interpreter':>46}: {report['interpreter-startup']:.4f}s")
+    failures = []
+    for item in report["results"]:
+        print(f"{item['module']:>46}: import {item['import-time']:.4f}s, --help {item['help-time']:.4f}s")
+        if item['import-time'] > args.max_import_time:
+            failures.append(f"`{item['module']}` imports in {item['import-time']:.4f}s, over {args.max_import_time}s")
+        if item['heavy-imports']:
+            failures.append(f"`{item['module']}` imports {', '.join(item['heavy-imports'])} at import time")
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main()
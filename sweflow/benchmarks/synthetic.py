@@ -0,0 +1,170 @@
+"""
+Generate synthetic Python projects and their `traces.json`, as written by the tracer for the real project.
+"""
+from typing import Dict, List, Tuple
+from pathlib import Path
+
+import json
+import random
+import argparse
+
+
+# the number of modules, of functions per module, of tests, and of functions called by each function and test
+SCALES = {
+    "small": {"files": 10, "functions": 10, "tests": 50, "fan-out": 3},
+    "medium": {"files": 50, "functions": 20, "tests": 250, "fan-out": 3},
+    "large": {"files": 200, "functions": 20, "tests": 1000, "fan-out": 4},
+}
+
+TESTS_PER_FILE = 50
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic Python project and its traces")
+
+    parser.add_argument("--output-dir", type=str, required=True, help="Path to the output directory, the project goes to `project/` and the traces to `traces.json`")
+    parser.add_argument("--scale", type=str, default="small", choices=list(SCALES), help="Preset size of the project")
+    parser.add_argument("--files", type=int, default=None, help="Number of modules, overrides the scale")
+    parser.add_argument("--functions", type=int, default=None, help="Number of functions per module, overrides the scale")
+    parser.add_argument("--tests", type=int, default=None, help="Number of tests, overrides the scale")
+    parser.add_argument("--fan-out", type=int, default=None, help="Number of functions called by each function and test, overrides the scale")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the call graph")
+
+    return parser.parse_args()
+
+
+def _function_name(module: int, index: int) -> str:
+    return f"func_{module}_{index}"
+
+
+def generate_call_graph(size: Dict[str, int], seed: int = 0) -> Tuple[Dict[Tuple[int, int], List[Tuple[int, int]]], List[List[Tuple[int, int]]]]:
+    """
+    Draw an acyclic call graph: every function calls functions of lower modules, and every test calls any function.
+
+    Returns:
+        The callees of each function `(module, index)`, and the callees of each test.
+    """
+    rng = random.Random(seed)
+    calls = {}
+    for module in range(size['files']):
+        lower = [(callee_module, index) for callee_module in range(module) for index in range(size['functions'])]
+        for index in range(size['functions']):
+            calls[(module, index)] = sorted(rng.sample(lower, min(size['fan-out'], len(lower))))
+    functions = list(calls)
+    test_calls = [sorted(rng.sample(functions, min(size['fan-out'], len(functions)))) for _ in range(size['tests'])]
+    return calls, test_calls
+
+
+def _write_module(path: Path, module: int, size: Dict[str, int], calls: Dict) -> Dict[Tuple[int, int], int]:
+    """
+    Write a module of the package, and return the first line of each of its functions.
+    """
+    imported = sorted({callee_module for index in range(size['functions']) for callee_module, _ in calls[(module, index)]})
+    lines = [f"from pkg import mod_{callee_module}" for callee_module in imported]
+    linenos = {}
+    for index in range(size['functions']):
+        lines += ["", ""]
+        linenos[(module, index)] = len(lines) + 1
+        lines += [
+            f"def {_function_name(module, index)}(x):",
+            f"    \"\"\"Function {index} of module {module}.\"\"\"",
+            f"    y = x + {index}",
+        ]
+        for callee_module, callee_index in calls[(module, index)]:
+            lines.append(f"    y = mod_{callee_module}.{_function_name(callee_module, callee_index)}(y) % 1000003")
+        lines += [
+            "    if y % 2:",
+            "        y = y * 3 + 1",
+            "    return y",
+        ]
+    path.write_text("\n".join(lines) + "\n")
+    return linenos
+
+
+def _write_test_module(path: Path, tests: List[int], test_calls: List[List[Tuple[int, int]]]) -> Dict[int, int]:
+    """
+    Write a test module, and return the first line of each of its tests.
+    """
+    imported = sorted({module for test in tests for module, _ in test_calls[test]})
+    lines = [f"from pkg import mod_{module}" for module in imported]
+    linenos = {}
+    for test in tests:
+        lines += ["", ""]
+        linenos[test] = len(lines) + 1
+        lines.append(f"def test_{test}():")
+        for module, index in test_calls[test]:
+            lines.append(f"    assert isinstance(mod_{module}.{_function_name(module, index)}({test}), int)")
+    path.write_text("\n".join(lines) + "\n")
+    return linenos
+
+
+def generate_project(output_dir: str, size: Dict[str, int], seed: int = 0) -> Tuple[Path, Path]:
+    """
+    Generate a synthetic project and the traces of its tests.
+
+    The traces hold, for every test, the call relations of every function reachable from it, in the format of
+    `sweflow.extensions.python.tracer` (paths relative to the project root, first lines of the functions).
+
+    Returns:
+        The path to the project root, and the path to `traces.json`.
+    """
+    project_root = Path(output_dir) / "project"
+    (project_root / "pkg").mkdir(parents=True, exist_ok=True)
+    (project_root / "tests").mkdir(parents=True, exist_ok=True)
+    (project_root / "pkg" / "__init__.py").write_text("")
+
+    calls, test_calls = generate_call_graph(size, seed)
+    linenos = {}
+    for module in range(size['files']):
+        linenos.update(_write_module(project_root / "pkg" / f"mod_{module}.py", module, size, calls))
+
+    def node(module: int, index: int) -> Dict:
+        return {"filepath": f"pkg/mod_{module}.py", "lineno": linenos[(module, index)], "func_name": _function_name(module, index)}
+
+    traces = []
+    for start in range(0, size['tests'], TESTS_PER_FILE):
+        tests = list(range(start, min(start + TESTS_PER_FILE, size['tests'])))
+        test_file = f"tests/test_{start // TESTS_PER_FILE}.py"
+        test_linenos = _write_test_module(project_root / test_file, tests, test_calls)
+        for test in tests:
+            test_node = {"filepath": test_file, "lineno": test_linenos[test], "func_name": f"test_{test}"}
+            call_relations = [{"caller": test_node, "callee": node(*callee)} for callee in test_calls[test]]
+            # walk the functions reachable from the test
+            stack, seen = list(test_calls[test]), set(test_calls[test])
+            while stack:
+                caller = stack.pop()
+                for callee in calls[caller]:
+                    call_relations.append({"caller": node(*caller), "callee": node(*callee)})
+                    if callee not in seen:
+                        seen.add(callee)
+                        stack.append(callee)
+            traces.append({
+                "test-id": f"{test_file}::test_{test}",
+                "test-func-id": f"{test_file}:{test_linenos[test]}:test_{test}",
+                "call-relations": call_relations,
+            })
+
+    trace_file = Path(output_dir) / "traces.json"
+    with open(trace_file, "w") as f:
+        json.dump(traces, f)
+
+    return project_root, trace_file
+
+
+def main():
+
+    args = parse_args()
+
+    size = dict(SCALES[args.scale])
+    for key, value in (("files", args.files), ("functions", args.functions), ("tests", args.tests), ("fan-out", args.fan_out)):
+        if value is not None:
+            size[key] = value
+    project_root, trace_file = generate_project(args.output_dir, size, args.seed)
+
+    print(f"Generated a project of {size['files']} modules and {size['tests']} tests in `{project_root}`, traces in `{trace_file}`.")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -1,21 +1,55 @@
+from typing import Callable, Dict, List, Tuple, TYPE_CHECKING
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from contextlib import nullcontext
 
 import argparse
 import shutil
-import json
-from copy import deepcopy
 
+from sweflow.utils import json_io
+from sweflow.utils.archive import ARCHIVE_FORMATS, archive_directory
+from sweflow.utils.blob_store import BlobStoreWriter
+from sweflow.utils.checkpoint import StepCheckpoint
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled, count
 from sweflow.utils.progress import create_progress
+from sweflow.utils.stage_manifest import hash_tree, hash_value, project_fingerprint
+from sweflow.utils.test_ids import PASS_TO_PASS_FORMATS, PassToPassTestIds
+from sweflow.utils.test_impact import TestImpactIndex
 from sweflow.utils.token_utils import TokenCounter
 from sweflow.extensions.python.helper import (
     clean_codebase,
     reinit_codebase,
+    is_worktree_committed,
+    rollback_codebase,
     update_codebase_on_schedule,
     skeletonize_codebase_on_schedule,
     generate_patch,
+    generate_patch_from_commits,
+    list_ignored_files,
 )
 
+if TYPE_CHECKING:
+    from git import Repo
+
+
+def add_codebase_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the options of the codebase stage, shared with `sweflow-run`.
+    """
+    parser.add_argument("--temp-dir", type=str, default=None, help="Path to the temporary directory")
+    parser.add_argument("--work-dir", type=str, default=None, help="Path to a persistent work directory, steps are checkpointed there instead of using a temporary directory")
+    parser.add_argument("--resume", action="store_true", help="Resume from the last completed step checkpointed in `--work-dir`")
+    parser.add_argument("--pass-to-pass-format", type=str, default="expanded", choices=PASS_TO_PASS_FORMATS, help="Write pass-to-pass test ids expanded for every step or as one shared list with per-step prefix lengths")
+    parser.add_argument("--exclude", type=str, action="append", default=[], help="Gitignore-style pattern of paths to leave out of the codebase (repeatable)")
+    parser.add_argument("--exclude-from", type=str, default=None, help="Path to a gitignore-style file of patterns to leave out of the codebase")
+    parser.add_argument("--archive-format", type=str, default="zip", choices=ARCHIVE_FORMATS, help="Format of the codebase archives, `bundle` writes a git bundle of all step branches")
+    parser.add_argument("--archive-threads", type=int, default=None, help="Number of compression threads for tar archives (defaults to the number of CPUs)")
+    parser.add_argument("--origin-archive", type=str, default="always", choices=["always", "auto", "never"], help="Whether to archive the original codebase, `auto` skips it when it equals the main branch")
+    parser.add_argument("--files-format", type=str, default="json", choices=["json", "blobs"], help="Write skeleton and reference files as full JSON or as a deduplicated blob store")
+    parser.add_argument("--diff-backend", type=str, default="git", choices=["git", "difflib"], help="Generate reference patches with `git diff` between the step branches or with difflib")
+    parser.add_argument("--diff-algorithm", type=str, default="histogram", choices=["histogram", "patience", "minimal", "myers"], help="Diff algorithm of the `git` backend")
+    parser.add_argument("--link-mode", type=str, default="auto", choices=["auto", "reflink", "hardlink", "copy"], help="How to snapshot project files into the codebase")
+
 
 def parse_args():
 
@@ -25,106 +59,287 @@ def parse_args():
     parser.add_argument("--development-schedule", type=str, required=True, help="Path to the development schedule")
     parser.add_argument("--docstrings", type=str, required=True, help="Path to the docstrings")
     parser.add_argument("--output-codebase-dir", type=str, required=True, help="Path to the output codebase directory")
-    parser.add_argument("--temp-dir", type=str, default=None, help="Path to the temporary directory")
     parser.add_argument("--output-dir", type=str, default=None, help="Path to the output directory")
+    parser.add_argument("--test-impact-index", type=str, default=None, help="Path to the test impact index of the schedule, to also save the pass-to-pass test ids impacted by each step")
+    add_codebase_arguments(parser)
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.resume and args.work_dir is None:
+        parser.error("`--resume` requires `--work-dir`")
 
+    return args
 
-def main():
 
-    args = parse_args()
+def open_codebase(args: argparse.Namespace, work_dir: str, excludes: List[str]) -> Tuple[str, StepCheckpoint, Dict[int, Dict]]:
+    """
+    Prepare the codebase in the work directory, or recover it from the checkpoint when resuming.
+
+    Returns:
+        The codebase directory, the checkpoint (`None` without `--work-dir`) and the outputs of the completed steps.
+    """
+    from git import Repo
+
+    codebase_dir = str(Path(work_dir) / "codebase") if args.work_dir is not None else work_dir
+    if args.work_dir is None:
+        clean_codebase(args.project_root)
+        reinit_codebase(args.project_root, codebase_dir, excludes=excludes, link_mode=args.link_mode)
+        return codebase_dir, None, {}
+
+    # the checkpoint is created only once the initial commit exists
+    checkpoint = StepCheckpoint(Path(work_dir) / "checkpoint.jsonl")
+    if args.resume and checkpoint.exists():
+        # cleaned as in a fresh run, so that the project fingerprints the same
+        clean_codebase(args.project_root)
+        completed_steps = checkpoint.load()
+        rollback_codebase(Repo(codebase_dir), list(completed_steps))
+        print(f"Resuming from `{work_dir}` with {len(completed_steps)} completed steps.")
+        return codebase_dir, checkpoint, completed_steps
+
+    shutil.rmtree(codebase_dir, ignore_errors=True)
+    clean_codebase(args.project_root)
+    reinit_codebase(args.project_root, codebase_dir, excludes=excludes, link_mode=args.link_mode)
+    checkpoint.reset()
+    return codebase_dir, checkpoint, {}
+
+
+def fingerprint_step(project: Dict, options: Dict, schedule: Dict, docstrings: Dict[str, Dict[str, str]]) -> str:
+    """
+    Hash the inputs of a step, so that a checkpointed step is only reused when resuming with the same ones.
+    """
+    return hash_value({
+        "project": project,
+        "options": options,
+        "schedule": schedule,
+        "docstrings": {node: docstrings.get(node) for node in schedule['nodes-to-develop']},
+    })
+
+
+def prepare_step(
+    project_root: str,
+    repo: "Repo",
+    schedule: Dict,
+    docstrings: Dict[str, Dict[str, str]],
+    diff_backend: str = "git",
+    diff_algorithm: str = "histogram",
+) -> Dict:
+    """
+    Skeletonize the codebase for a step, commit its skeleton and reference branches and flag its reference patch.
 
-    with open(args.development_schedule, "r") as f:
-        development_schedule = json.load(f)
+    Returns:
+        The outputs of the step.
+    """
+    # skeletonize the codebase
+    schedule_skeleton_files, schedule_reference_files = skeletonize_codebase_on_schedule(project_root, schedule, docstrings)
+    # update the codebase
+    commit_info = update_codebase_on_schedule(repo, schedule, schedule_skeleton_files, schedule_reference_files)
+    # generate the reference patch
+    if diff_backend == "git":
+        # files ignored by the project are left out of the commits, so the steps touching them fall back to difflib
+        filepaths = [file['filepath'] for file in schedule_reference_files]
+        if list_ignored_files(repo.working_dir, filepaths):
+            count("difflib-fallbacks")
+            diff_backend = "difflib"
+    if diff_backend == "git":
+        step = schedule['step']
+        reference_patch = generate_patch_from_commits(repo.working_dir, f"step-{step}-skeleton", f"step-{step}-reference", diff_algorithm)
+    else:
+        reference_patch = generate_patch(schedule_skeleton_files, schedule_reference_files)
+    # flag the step, the steps predicted to be trivial are flagged out as their specification was not generated
+    flag = TokenCounter.at_least(reference_patch, 10)
+    if schedule.get('predicted-trivial', False):
+        if flag:
+            count("trivial-mispredictions")
+        flag = False
 
-    with open(args.docstrings, "r") as f:
-        docstrings = json.load(f)
+    return {
+        "step": schedule['step'],
+        "skeleton-files": schedule_skeleton_files,
+        "reference-files": schedule_reference_files,
+        "base-commit": commit_info['base-commit'],
+        "reference-commit": commit_info['reference-commit'],
+        "reference-patch": reference_patch,
+        "flag": flag,
+    }
+
+
+def create_codebase(
+    args: argparse.Namespace,
+    development_schedule: List[Dict],
+    docstrings: Dict[str, Dict[str, str]],
+    test_impact_index: TestImpactIndex = None,
+    wait_for_step: Callable[[Dict], None] = None,
+) -> Dict:
+    """
+    Build the codebase of every step of the development schedule and archive it.
+
+    Args:
+        args: The options of the codebase stage (see `add_codebase_arguments`), with `project_root`,
+            `output_codebase_dir` and `output_dir`.
+        development_schedule: The development schedule.
+        docstrings: The docstrings of the nodes to develop.
+        test_impact_index: If given, the pass-to-pass test ids impacted by each step are also collected.
+        wait_for_step: If given, called with each step before it is built, e.g. to wait until the docstrings of
+            its nodes are added to `docstrings`.
+
+    Returns:
+        The outputs of all steps, keyed by the name of their file (without `.json`).
+    """
+    from git import Repo
+
+    excludes = list(args.exclude)
+    if args.exclude_from is not None:
+        with open(args.exclude_from, "r") as f:
+            excludes.extend(f.read().splitlines())
 
     (
         skeleton_files,
         reference_files,
         reference_patches,
         fail_to_pass_test_ids,
-        pass_to_pass_test_ids,
         base_commits,
         reference_commits,
         step_flags,
-    ) = ([], [], [], [], [], [], [], [])
+    ) = ([], [], [], [], [], [], [])
 
-    _pass_to_pass_test_ids = []
-    # create a temporary directory for operations
-    Path(args.temp_dir).mkdir(parents=True, exist_ok=True)
-    with TemporaryDirectory(dir=args.temp_dir) as codebase_dir:
-        clean_codebase(args.project_root)
-        repo = reinit_codebase(args.project_root, codebase_dir)
+    pass_to_pass_test_ids = PassToPassTestIds()
+    # store each unique file content once instead of the full files of every step
+    blob_store = BlobStoreWriter(args.output_dir) if args.files_format == "blobs" else None
+    # work in a persistent directory when checkpointing, otherwise in a temporary one
+    if args.work_dir is not None:
+        work_dir = nullcontext(args.work_dir)
+    else:
+        if args.temp_dir is not None:
+            Path(args.temp_dir).mkdir(parents=True, exist_ok=True)
+        work_dir = TemporaryDirectory(dir=args.temp_dir)
+    with work_dir as work_dir:
+        codebase_dir, checkpoint, completed_steps = open_codebase(args, work_dir, excludes)
+        repo = Repo(codebase_dir)
+        if checkpoint is not None:
+            project = {"root": str(Path(args.project_root).resolve()), "commit": project_fingerprint(args.project_root)}
+            if project["commit"] is None:
+                # a project which is not a clean git repository is recognized by the content of its files
+                project["files"] = hash_tree(args.project_root)
+            options = {"excludes": excludes, "diff-backend": args.diff_backend, "diff-algorithm": args.diff_algorithm}
         with create_progress() as progress:
             task = progress.add_task("[cyan]Preparing codebase...", total=len(development_schedule))
             for schedule in development_schedule:
-                # skeletonize the codebase
-                schedule_skeleton_files, schedule_reference_files = skeletonize_codebase_on_schedule(args.project_root, schedule, docstrings)
-                skeleton_files.append({"step": schedule['step'], "skeleton-files": schedule_skeleton_files})
-                reference_files.append({"step": schedule['step'], "reference-files": schedule_reference_files})
-                # update the codebase
-                commit_info = update_codebase_on_schedule(repo, schedule, schedule_skeleton_files, schedule_reference_files)
-                # commit_info.update({"step": schedule['step']})
-                base_commits.append({"step": schedule['step'], "base-commit": commit_info['base-commit']})
-                reference_commits.append({"step": schedule['step'], "reference-commit": commit_info['reference-commit']})
-                # generate the reference patch
-                reference_patch = generate_patch(schedule_skeleton_files, schedule_reference_files)
-                reference_patches.append({"step": schedule['step'], "reference-patch": reference_patch})
+                if wait_for_step is not None:
+                    wait_for_step(schedule)
+                fingerprint = fingerprint_step(project, options, schedule, docstrings) if checkpoint is not None else None
+                if schedule['step'] in completed_steps:
+                    if completed_steps[schedule['step']].get('fingerprint') != fingerprint:
+                        raise ValueError(
+                            f"Step {schedule['step']} was checkpointed in `{work_dir}` from other inputs "
+                            "(project, schedule, docstrings or options), run again without `--resume` to start over"
+                        )
+                    # reuse the outputs of a step completed before the interruption
+                    step_outputs = checkpoint.restore(completed_steps.pop(schedule['step']))
+                    count("steps-resumed")
+                else:
+                    step_outputs = prepare_step(args.project_root, repo, schedule, docstrings, args.diff_backend, args.diff_algorithm)
+                    if checkpoint is not None:
+                        checkpoint.append({**step_outputs, "fingerprint": fingerprint})
+                if blob_store is not None:
+                    blob_store.add_step("skeleton-files", schedule['step'], step_outputs['skeleton-files'])
+                    blob_store.add_step("reference-files", schedule['step'], step_outputs['reference-files'])
+                else:
+                    skeleton_files.append({"step": schedule['step'], "skeleton-files": step_outputs['skeleton-files']})
+                    reference_files.append({"step": schedule['step'], "reference-files": step_outputs['reference-files']})
+                base_commits.append({"step": schedule['step'], "base-commit": step_outputs['base-commit']})
+                reference_commits.append({"step": schedule['step'], "reference-commit": step_outputs['reference-commit']})
+                reference_patches.append({"step": schedule['step'], "reference-patch": step_outputs['reference-patch']})
                 # generate the fail-to-pass test ids
                 fail_to_pass_test_ids.append({"step": schedule['step'], "fail-to-pass-test-ids": schedule['test-ids']})
                 # generate the pass-to-pass test ids (accumulate)
-                pass_to_pass_test_ids.append({"step": schedule['step'], "pass-to-pass-test-ids": deepcopy(_pass_to_pass_test_ids)})
-                _pass_to_pass_test_ids.extend(schedule['test-ids'])
-                # flag the step
-                flag = False if TokenCounter.count_tokens(reference_patch) < 10 else True
-                step_flags.append({"step": schedule['step'], "flag": flag})
+                pass_to_pass_test_ids.add_step(schedule['step'], schedule['test-ids'])
+                step_flags.append({"step": schedule['step'], "flag": step_outputs['flag']})
                 # update the progress
                 progress.update(task, advance=1)
+        if checkpoint is not None:
+            checkpoint.close()
 
         Path(args.output_codebase_dir).mkdir(parents=True, exist_ok=True)
-        # zip the codebase
-        output_codebase = Path(args.output_codebase_dir) / "codebase.zip"
-        shutil.make_archive(output_codebase.with_suffix(""), "zip", codebase_dir)
+        # archive the codebase
+        archive_directory(codebase_dir, Path(args.output_codebase_dir) / "codebase", args.archive_format, args.archive_threads)
 
-        # zip the original codebase
-        output_original_codebase = Path(args.output_codebase_dir) / "codebase.origin.zip"
-        shutil.make_archive(output_original_codebase.with_suffix(""), "zip", args.project_root)
+        # archive the original codebase, unless the initial commit of the main branch already holds all of it
+        if args.origin_archive == "auto":
+            # only checked when needed, as it walks the whole working tree
+            archive_origin = bool(excludes) or not is_worktree_committed(repo)
+        else:
+            archive_origin = args.origin_archive == "always"
+        if archive_origin:
+            # the original codebase need not be a git repository, so it cannot be bundled
+            origin_format = "zip" if args.archive_format == "bundle" else args.archive_format
+            archive_directory(args.project_root, Path(args.output_codebase_dir) / "codebase.origin", origin_format, args.archive_threads)
 
-    # save skeleton files
-    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
-    with open(Path(args.output_dir) / "skeleton-files.json", "w") as f:
-        json.dump(skeleton_files, f)
+    if blob_store is not None:
+        # save the blob store with the skeleton and reference manifests
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+        blob_store.close()
 
-    # save reference files
-    with open(Path(args.output_dir) / "reference-files.json", "w") as f:
-        json.dump(reference_files, f)
+    # collect the pass-to-pass test ids covering the files changed by each step
+    impacted_test_ids = None
+    if test_impact_index is not None:
+        impacted_test_ids = PassToPassTestIds(expanded={})
+        for schedule in development_schedule:
+            changed_files = {node.split(':', 1)[0] for node in schedule['nodes-to-develop']}
+            changed_nodes = test_impact_index.nodes_in_files(changed_files)
+            impacted_test_ids.expanded[schedule['step']] = test_impact_index.select(pass_to_pass_test_ids.get(schedule['step']), changed_nodes)
 
-    # save reference patches
-    with open(Path(args.output_dir) / "reference-patches.json", "w") as f:
-        json.dump(reference_patches, f)
+    return {
+        "skeleton-files": skeleton_files if blob_store is None else None,
+        "reference-files": reference_files if blob_store is None else None,
+        "reference-patches": reference_patches,
+        "fail-to-pass-test-ids": fail_to_pass_test_ids,
+        "pass-to-pass-test-ids": pass_to_pass_test_ids,
+        "impacted-pass-to-pass-test-ids": impacted_test_ids,
+        "base-commits": base_commits,
+        "reference-commits": reference_commits,
+        "step-flags": step_flags,
+    }
 
-    # save fail-to-pass test ids
-    with open(Path(args.output_dir) / "fail-to-pass-test-ids.json", "w") as f:
-        json.dump(fail_to_pass_test_ids, f)
+
+@profiled("saving")
+def save_codebase_outputs(output_dir: str, outputs: Dict, pass_to_pass_format: str = "expanded"):
+    """
+    Save the outputs of `create_codebase` to JSON files in the output directory.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    for name in ("skeleton-files", "reference-files", "reference-patches", "fail-to-pass-test-ids"):
+        # skeleton and reference files are None when saved in the blob store
+        if outputs[name] is not None:
+            # written step by step, as the files of all steps serialize to far more than they take in memory
+            json_io.dump_array(outputs[name], Path(output_dir) / f"{name}.json")
 
     # save pass-to-pass test ids
-    with open(Path(args.output_dir) / "pass-to-pass-test-ids.json", "w") as f:
-        json.dump(pass_to_pass_test_ids, f)
+    outputs["pass-to-pass-test-ids"].dump(Path(output_dir) / "pass-to-pass-test-ids.json", pass_to_pass_format)
+
+    # save the pass-to-pass test ids impacted by each step
+    if outputs["impacted-pass-to-pass-test-ids"] is not None:
+        outputs["impacted-pass-to-pass-test-ids"].dump(Path(output_dir) / "impacted-pass-to-pass-test-ids.json", "expanded")
+
+    for name in ("base-commits", "reference-commits", "step-flags"):
+        json_io.dump(outputs[name], Path(output_dir) / f"{name}.json")
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-create-codebase")
+    json_io.configure_json(args)
+
+    development_schedule = json_io.load(args.development_schedule)
+
+    docstrings = json_io.load(args.docstrings)
 
-    # save base commits
-    with open(Path(args.output_dir) / "base-commits.json", "w") as f:
-        json.dump(base_commits, f)
+    test_impact_index = TestImpactIndex.load(args.test_impact_index) if args.test_impact_index is not None else None
 
-    # save reference commits
-    with open(Path(args.output_dir) / "reference-commits.json", "w") as f:
-        json.dump(reference_commits, f)
+    outputs = create_codebase(args, development_schedule, docstrings, test_impact_index)
 
-    # save step flags
-    with open(Path(args.output_dir) / "step-flags.json", "w") as f:
-        json.dump(step_flags, f)
+    save_codebase_outputs(args.output_dir, outputs, args.pass_to_pass_format)
 
 
 if __name__ == "__main__":
@@ -1,31 +1,53 @@
+from typing import Dict
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import argparse
-import json
 import subprocess
-from copy import deepcopy
 
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling
 from sweflow.utils.progress import create_progress
+from sweflow.utils.test_ids import PASS_TO_PASS_FORMATS, PassToPassTestIds
 from sweflow.utils.token_utils import TokenCounter
 
 
 def get_commit_hash(branch: str, cwd: str = "/workspace") -> str:
-    # get the commit hash of the branch
-    subprocess.run(["git", "checkout", branch], cwd=cwd, check=True)
-    commit_hash = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True).stdout.strip()
+    # get the commit hash of the branch, without checking it out
+    commit_hash = subprocess.run(["git", "rev-parse", "--verify", f"{branch}^{{commit}}"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
     return commit_hash
 
 
+def get_step_commit_hashes(cwd: str = "/workspace") -> Dict[str, str]:
+    """
+    Resolve the commit hashes of all step branches with a single `git for-each-ref`.
+
+    Returns:
+        A mapping of branch name (e.g. `step-0-skeleton`) to commit hash.
+    """
+    output = subprocess.run(
+        ["git", "for-each-ref", "--format=%(refname:lstrip=2) %(objectname)", "refs/heads/step-*"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return dict(line.split(" ", 1) for line in output.splitlines())
+
+
 def parse_args():
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--project-root", type=str, required=True, help="Path to the repository")
+    parser.add_argument("--repository", type=str, default="/workspace", help="Path to the git repository holding the step branches")
     parser.add_argument("--development-schedule", type=str, required=True, help="Path to the development schedule")
     parser.add_argument("--reference-patches", type=str, required=True, help="Path to the reference patches")
     parser.add_argument("--temp-dir", type=str, default=None, help="Path to the temporary directory")
     parser.add_argument("--output-dir", type=str, default=None, help="Path to the output directory")
+    parser.add_argument("--pass-to-pass-format", type=str, default="expanded", choices=PASS_TO_PASS_FORMATS, help="Write pass-to-pass test ids expanded for every step or as one shared list with per-step prefix lengths")
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
 
     return parser.parse_args()
 
@@ -33,59 +55,58 @@ def parse_args():
 def main():
 
     args = parse_args()
+    start_profiling(args, "sweflow-create-codebase-dev")
+    json_io.configure_json(args)
 
-    with open(args.development_schedule, "r") as f:
-        development_schedule = json.load(f)
+    development_schedule = json_io.load(args.development_schedule)
 
-    with open(args.reference_patches, "r") as f:
-        reference_patches = json.load(f)
+    reference_patches = json_io.load(args.reference_patches)
 
     (
         fail_to_pass_test_ids,
-        pass_to_pass_test_ids,
         base_commits,
         reference_commits,
         step_flags,
-    ) = ([], [], [], [], [])
+    ) = ([], [], [], [])
 
-    _pass_to_pass_test_ids = []
+    pass_to_pass_test_ids = PassToPassTestIds()
     # create a temporary directory for operations
     Path(args.temp_dir).mkdir(parents=True, exist_ok=True)
     with TemporaryDirectory(dir=args.temp_dir) as codebase_dir:
+        # resolve all step branches at once, without touching the working tree
+        step_commits = get_step_commit_hashes(args.repository)
         with create_progress() as progress:
             task = progress.add_task("[cyan]Preparing codebase...", total=len(development_schedule))
             assert len(development_schedule) == len(reference_patches), f"Development schedule and reference patches must have the same length"
             for schedule, reference_patch in zip(development_schedule, reference_patches):
                 assert schedule['step'] == reference_patch['step'], f"Step {schedule['step']} is not equal to patch step {reference_patch['step']}"
                 # get the commit hash of the base and reference branches
-                base_commits.append({"step": schedule['step'], "base-commit": get_commit_hash(f"step-{schedule['step']}-skeleton")})
-                reference_commits.append({"step": schedule['step'], "reference-commit": get_commit_hash(f"step-{schedule['step']}-reference")})
+                base_branch, reference_branch = f"step-{schedule['step']}-skeleton", f"step-{schedule['step']}-reference"
+                base_commit = step_commits.get(base_branch) or get_commit_hash(base_branch, args.repository)
+                reference_commit = step_commits.get(reference_branch) or get_commit_hash(reference_branch, args.repository)
+                base_commits.append({"step": schedule['step'], "base-commit": base_commit})
+                reference_commits.append({"step": schedule['step'], "reference-commit": reference_commit})
                 # get the fail-to-pass test ids
                 fail_to_pass_test_ids.append({"step": schedule['step'], "fail-to-pass-test-ids": schedule['test-ids']})
                 # get the pass-to-pass test ids (accumulate)
-                pass_to_pass_test_ids.append({"step": schedule['step'], "pass-to-pass-test-ids": deepcopy(_pass_to_pass_test_ids)})
-                _pass_to_pass_test_ids.extend(schedule['test-ids'])
+                pass_to_pass_test_ids.add_step(schedule['step'], schedule['test-ids'])
                 # get the flag of the step
-                flag = False if TokenCounter.count_tokens(reference_patch['reference-patch']) < 10 else True
+                flag = TokenCounter.at_least(reference_patch['reference-patch'], 10)
                 step_flags.append({"step": schedule['step'], "flag": flag})
                 # update the progress
                 progress.update(task, advance=1)
 
     # save fail-to-pass test ids
-    with open(Path(args.output_dir) / "fail-to-pass-test-ids.json", "w") as f:
-        json.dump(fail_to_pass_test_ids, f)
+    json_io.dump(fail_to_pass_test_ids, Path(args.output_dir) / "fail-to-pass-test-ids.json")
 
     # save pass-to-pass test ids
-    with open(Path(args.output_dir) / "pass-to-pass-test-ids.json", "w") as f:
-        json.dump(pass_to_pass_test_ids, f)
+    pass_to_pass_test_ids.dump(Path(args.output_dir) / "pass-to-pass-test-ids.json", args.pass_to_pass_format)
 
     # save base commits
-    with open(Path(args.output_dir) / "base-commits.json", "w") as f:
-        json.dump(base_commits, f)
+    json_io.dump(base_commits, Path(args.output_dir) / "base-commits.json")
 
     # save reference commits
-    with open(Path(args.output_dir) / "reference-commits.json", "w") as f:
-        json.dump(reference_commits, f)
+    json_io.dump(reference_commits, Path(args.output_dir) / "reference-commits.json")
 
 
 if __name__ == "__main__":
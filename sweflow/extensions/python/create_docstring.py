@@ -1,9 +1,11 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from pathlib import Path
-from fluxllm import FluxOpenAIChat
+from functools import lru_cache
 
 import argparse
-import json
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled, count, instrument_llm_client
 
 from sweflow.extensions.python.helper import (
     collect_nodes,
@@ -14,12 +16,17 @@ from sweflow.extensions.python.helper import (
 DATA_DIR = Path(__file__).parent / "data" / "docstring"
 
 DEMONSTRATIONS_FILE = DATA_DIR / "demonstations.json"
-with open(DEMONSTRATIONS_FILE, "r") as f:
-    DEMONSTRATIONS = json.load(f)
-
 SYSTEM_PROMPT_FILE = DATA_DIR / "system-prompt.md"
-with open(SYSTEM_PROMPT_FILE, "r") as f:
-    SYSTEM_PROMPT = f.read()
+
+
+@lru_cache(maxsize=None)
+def load_prompt() -> Tuple[str, List[Dict]]:
+    """
+    Load the system prompt and the demonstrations on first use, not when the module is imported.
+    """
+    with open(SYSTEM_PROMPT_FILE, "r") as f:
+        system_prompt = f.read()
+    return system_prompt, json_io.load(DEMONSTRATIONS_FILE)
 
 
 def request_collate(
@@ -30,8 +37,9 @@ def request_collate(
     """
     Collate the messages for the OpenAI API.
     """
-    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
-    for demonstration in DEMONSTRATIONS[:n_shots]:
+    system_prompt, demonstrations = load_prompt()
+    messages = [{'role': 'system', 'content': system_prompt}]
+    for demonstration in demonstrations[:n_shots]:
         messages.append({'role': 'user', 'content': demonstration['user']['content']})
         messages.append({'role': 'assistant', 'content': demonstration['assistant']['content']})
 
@@ -56,6 +64,8 @@ def parse_args():
     parser.add_argument("--max-retries", type=int, default=3, help="Max retries for the OpenAI API.")
     parser.add_argument("--cache-file", type=str, help="Path to the cache file.")
     parser.add_argument("--output-file", type=str, help="Path to the output file.")
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
 
     return parser.parse_args()
 
@@ -65,18 +75,26 @@ def load_development_schedule(development_schedule_file: str) -> Dict[str, List[
     Load the development schedule from a JSON file.
     """
     print(f"Loading development schedule from `{development_schedule_file}`.")
-    with open(development_schedule_file, "r") as f:
-        return json.load(f)
+    return json_io.load(development_schedule_file)
 
 
+@profiled("sample-preparation")
 def prepare_samples(project_root: str, development_schedule: Dict[str, List[str]]) -> List[Dict[str, str]]:
     """
-    Prepare the samples for the OpenAI API.
+    Prepare the samples for the OpenAI API in step order, leaving out the nodes of the steps predicted to be trivial.
     """
-    nodes_to_develop = collect_nodes(development_schedule, key='nodes-to-develop')
+    # the trivial steps are flagged out by `create_codebase`, so their docstrings would go unused
+    trivial_schedule = [schedule for schedule in development_schedule if schedule.get('predicted-trivial', False)]
+    if trivial_schedule:
+        num_avoided = len(collect_nodes(trivial_schedule, key='nodes-to-develop'))
+        print(f"Skipping {len(trivial_schedule)} predicted-trivial steps, avoiding {num_avoided} docstring requests.")
+        count('llm-requests-avoided', num_avoided)
+        development_schedule = [schedule for schedule in development_schedule if not schedule.get('predicted-trivial', False)]
+    # the nodes of the first steps are requested first, so that their codebase can be built first
+    nodes_to_develop = [node for schedule in development_schedule for node in sorted(schedule['nodes-to-develop'])]
 
     samples = []
-    for node in nodes_to_develop:
+    for node in dict.fromkeys(nodes_to_develop):
         filepath, lineno, func_name = node.split(':')
         node_id = f"{filepath}:{lineno}:{func_name}"
         content = read_file_from_project(project_root=project_root, filepath=filepath)
@@ -89,43 +107,90 @@ def prepare_samples(project_root: str, development_schedule: Dict[str, List[str]
     return samples
 
 
+def create_client(base_url: str = None, api_key: str = None, max_qpm: int = 256, max_retries: int = 3, cache_file: str = None):
+    """
+    Create the fluxllm client of the docstring requests.
+    """
+    # fluxllm pulls in the whole OpenAI SDK, which takes longer to import than most runs of the CLI take
+    from fluxllm import FluxOpenAIChat
+
+    client = FluxOpenAIChat(
+        cache_file=cache_file,
+        base_url=base_url,
+        api_key=api_key,
+        max_qpm=max_qpm,
+        max_retries=max_retries,
+    )
+    return instrument_llm_client(client)
+
+
+def collect_docstrings(samples: List[Dict[str, str]], responses: List) -> Dict[str, Dict[str, str]]:
+    """
+    Collect the docstrings from the responses to the samples, leaving out the failed requests.
+    """
+    docstrings = {}
+    for sample, response in zip(samples, responses):
+        if response is None:
+            continue
+        docstrings[sample['node-id']] = {'docstring': response.choices[0].message.content, 'function-content': sample['function-content']}
+    return docstrings
+
+
+def generate_docstrings(
+    project_root: str,
+    development_schedule: List[Dict],
+    base_url: str = None,
+    api_key: str = None,
+    model: str = None,
+    max_qpm: int = 256,
+    max_retries: int = 3,
+    cache_file: str = None,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Generate the docstrings of the nodes to develop.
+
+    Returns:
+        A mapping of node id to its docstring and function content.
+    """
+    # prepare the samples
+    samples = prepare_samples(project_root=project_root, development_schedule=development_schedule)
+
+    # generate docstrings for the nodes
+    client = create_client(base_url, api_key, max_qpm, max_retries, cache_file)
+
+    # collate the requests
+    requests = [request_collate(sample, n_shots=2, model=model) for sample in samples]
+
+    # collect the responses
+    responses = client.request(requests)
+
+    return collect_docstrings(samples, responses)
+
+
 def main():
 
     args = parse_args()
+    start_profiling(args, "sweflow-create-docstring")
+    json_io.configure_json(args)
 
     print(f"Preparing docstrings for `{args.project_root}`.")
 
     # load the development plans
     development_schedule = load_development_schedule(args.development_schedule)
 
-    # prepare the samples
-    samples = prepare_samples(project_root=args.project_root, development_schedule=development_schedule)
-
-    # generate docstrings for the nodes
-    client = FluxOpenAIChat(
-        cache_file=args.cache_file,
+    docstrings = generate_docstrings(
+        args.project_root,
+        development_schedule,
         base_url=args.base_url,
         api_key=args.api_key,
+        model=args.model,
         max_qpm=args.max_qpm,
         max_retries=args.max_retries,
+        cache_file=args.cache_file,
     )
 
-    # collate the requests
-    requests = [request_collate(sample, n_shots=2, model=args.model) for sample in samples]
-
-    # collect the responses
-    responses = client.request(requests)
-    contents = [response.choices[0].message.content if response is not None else None for response in responses]
-
-    docstrings = {}
-    for sample, content in zip(samples, contents):
-        if content is None:
-            continue
-        docstrings[sample['node-id']] = {'docstring': content, 'function-content': sample['function-content']}
-
     # save the docstrings
-    with open(args.output_file, "w") as f:
-        json.dump(docstrings, f, indent=4)
+    json_io.dump(docstrings, args.output_file)
 
     print(f"Docstrings saved to `{args.output_file}`.")
 
@@ -1,9 +1,11 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from pathlib import Path
-from fluxllm import FluxOpenAIChat
+from functools import lru_cache
 
 import argparse
-import json
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled, count, instrument_llm_client
 
 from sweflow.extensions.python.helper import (
     read_file_from_project,
@@ -13,20 +15,26 @@ from sweflow.extensions.python.helper import (
 DATA_DIR = Path(__file__).parent / "data" / "specification"
 
 DEMONSTRATIONS_FILE = DATA_DIR / "demonstations.json"
-with open(DEMONSTRATIONS_FILE, "r") as f:
-    DEMONSTRATIONS = json.load(f)
-
 SYSTEM_PROMPT_FILE = DATA_DIR / "system-prompt.md"
-with open(SYSTEM_PROMPT_FILE, "r") as f:
-    SYSTEM_PROMPT = f.read()
+
+
+@lru_cache(maxsize=None)
+def load_prompt() -> Tuple[str, List[Dict]]:
+    """
+    Load the system prompt and the demonstrations on first use, not when the module is imported.
+    """
+    with open(SYSTEM_PROMPT_FILE, "r") as f:
+        system_prompt = f.read()
+    return system_prompt, json_io.load(DEMONSTRATIONS_FILE)
 
 
 def request_collate(sample: Dict[str, Any], n_shots: int = 2, model: str = "Qwen2.5-Coder-32B-Instruct") -> Dict[str, Any]:
     """
     Collate the request for the OpenAI API.
     """
-    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
-    for demonstration in DEMONSTRATIONS[:n_shots]:
+    system_prompt, demonstrations = load_prompt()
+    messages = [{'role': 'system', 'content': system_prompt}]
+    for demonstration in demonstrations[:n_shots]:
         messages.append({'role': 'user', 'content': demonstration['user']['content']})
         messages.append({'role': 'assistant', 'content': demonstration['assistant']['content']})
 
@@ -46,8 +54,7 @@ def load_development_schedule(development_schedule_file: str) -> Dict[str, List[
     """
     Load the development schedule from a JSON file.
     """
-    with open(development_schedule_file, "r") as f:
-        return json.load(f)
+    return json_io.load(development_schedule_file)
 
 
 def parse_args():
@@ -63,16 +70,25 @@ def parse_args():
     parser.add_argument("--max-retries", type=int, default=3, help="Max retries for the OpenAI API.")
     parser.add_argument("--cache-file", type=str, help="Path to the cache file.")
     parser.add_argument("--output-file", type=str, help="Path to the output file.")
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
 
     return parser.parse_args()
 
 
+@profiled("sample-preparation")
 def prepare_samples(project_root: str, development_schedule: Dict[str, List[str]]) -> List[Dict[str, Any]]:
     """
-    Prepare the samples for the OpenAI API.
+    Prepare the samples for the OpenAI API, leaving out the steps predicted to be trivial.
     """
     samples = []
+    num_trivial_steps, num_avoided = 0, 0
     for step, dev_plan in enumerate(development_schedule):
+        # the trivial steps are flagged out by `create_codebase`, so their specifications would go unused
+        if dev_plan.get('predicted-trivial', False):
+            num_trivial_steps += 1
+            num_avoided += bool(dev_plan['target-test-nodes'])
+            continue
         target_test_nodes_info = []
         for node in dev_plan['target-test-nodes']:
             filepath, lineno, func_name = node.split(':')
@@ -85,46 +101,97 @@ def prepare_samples(project_root: str, development_schedule: Dict[str, List[str]
         if target_test_nodes_info:
             samples.append({'step': step, 'target-test-nodes-info': target_test_nodes_info})
 
+    if num_trivial_steps:
+        print(f"Skipping {num_trivial_steps} predicted-trivial steps, avoiding {num_avoided} specification requests.")
+        count('llm-requests-avoided', num_avoided)
+
     return samples
 
 
+def create_client(base_url: str = None, api_key: str = None, max_qpm: int = 128, max_retries: int = 3, cache_file: str = None):
+    """
+    Create the fluxllm client of the specification requests.
+    """
+    # fluxllm pulls in the whole OpenAI SDK, which takes longer to import than most runs of the CLI take
+    from fluxllm import FluxOpenAIChat
+
+    client = FluxOpenAIChat(
+        cache_file=cache_file,
+        base_url=base_url,
+        api_key=api_key,
+        max_qpm=max_qpm,
+        max_retries=max_retries,
+    )
+    return instrument_llm_client(client)
+
+
+def collect_specifications(samples: List[Dict[str, Any]], responses: List) -> List[Dict[str, Any]]:
+    """
+    Collect the specifications from the responses to the samples, leaving out the failed requests.
+    """
+    specifications = []
+    for sample, response in zip(samples, responses):
+        if response is None:
+            continue
+        specifications.append({'step': sample['step'], 'specification': response.choices[0].message.content})
+    return specifications
+
+
+def generate_specifications(
+    project_root: str,
+    development_schedule: List[Dict],
+    base_url: str = None,
+    api_key: str = None,
+    model: str = None,
+    max_qpm: int = 128,
+    max_retries: int = 3,
+    cache_file: str = None,
+) -> List[Dict[str, Any]]:
+    """
+    Generate the specification of each step from its target tests.
+
+    Returns:
+        The specification of each step, `[{"step": 0, "specification": ...}, ...]`.
+    """
+    # prepare the samples
+    samples = prepare_samples(project_root=project_root, development_schedule=development_schedule)
+
+    # generate specifications for the steps
+    client = create_client(base_url, api_key, max_qpm, max_retries, cache_file)
+
+    # collate the requests
+    requests = [request_collate(sample, n_shots=2, model=model) for sample in samples]
+
+    # collect the responses
+    responses = client.request(requests)
+
+    return collect_specifications(samples, responses)
+
+
 def main():
 
     args = parse_args()
+    start_profiling(args, "sweflow-create-specification")
+    json_io.configure_json(args)
 
     print(f"Generating specifications for `{args.project_root}`.")
 
     # load the development plans
     development_schedule = load_development_schedule(args.development_schedule)
 
-    # prepare the samples
-    samples = prepare_samples(project_root=args.project_root, development_schedule=development_schedule)
-
-    # generate specifications for the nodes
-    client = FluxOpenAIChat(
-        cache_file=args.cache_file,
+    specifications = generate_specifications(
+        args.project_root,
+        development_schedule,
         base_url=args.base_url,
         api_key=args.api_key,
+        model=args.model,
         max_qpm=args.max_qpm,
         max_retries=args.max_retries,
+        cache_file=args.cache_file,
     )
 
-    # collate the requests
-    requests = [request_collate(sample, n_shots=2, model=args.model) for sample in samples]
-
-    # collect the responses
-    responses = client.request(requests)
-    contents = [response.choices[0].message.content if response is not None else None for response in responses]
-
-    specifications = []
-    for sample, content in zip(samples, contents):
-        if content is None:
-            continue
-        specifications.append({'step': sample['step'], 'specification': content})
-
     # save the specifications
-    with open(args.output_file, "w") as f:
-        json.dump(specifications, f, indent=4)
+    json_io.dump(specifications, args.output_file)
 
     print(f"Specifications saved to `{args.output_file}`.")
 
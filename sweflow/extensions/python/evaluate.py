@@ -0,0 +1,363 @@
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import re
+import os
+import time
+import shlex
+import shutil
+import signal
+import argparse
+import threading
+import subprocess
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled, count
+from sweflow.utils.progress import create_progress
+from sweflow.extensions.python.helper import (
+    get_patch_filepaths,
+    apply_patch_to_files,
+    generate_test_script,
+)
+
+PASSING_OUTCOMES = ("PASSED", "XFAIL")
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Apply predicted patches to their base commits and run the fail-to-pass and pass-to-pass tests")
+
+    parser.add_argument("--dataset", type=str, required=True, help="Path to the merged JSONL dataset")
+    parser.add_argument("--predictions", type=str, default=None, help="Path to a JSONL file of `instance_id` and `model_patch` (replace format or unified diff), defaults to the reference patches")
+    parser.add_argument("--codebase-dir", type=str, default=None, help="Path to the git repository of the codebase holding the base commits")
+    parser.add_argument("--codebase-root", type=str, default=None, help="Path to a directory of codebase repositories named `<owner>__--__<name>`")
+    parser.add_argument("--instance-ids", type=str, nargs="*", default=None, help="Only evaluate these instances")
+    parser.add_argument("--max-workers", type=int, default=8, help="Number of instances evaluated in parallel")
+    parser.add_argument("--timeout", type=float, default=1800, help="Timeout of the test run of an instance, in seconds")
+    parser.add_argument("--full-pass-to-pass", action="store_true", help="Always run all pass-to-pass tests, instead of only the impacted ones when the dataset has them")
+    parser.add_argument("--temp-dir", type=str, default=None, help="Path to the temporary directory of the worktrees")
+    parser.add_argument("--output-dir", type=str, required=True, help="Path to the output directory")
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    if (args.codebase_dir is None) == (args.codebase_root is None):
+        parser.error("exactly one of `--codebase-dir` and `--codebase-root` is required")
+
+    return args
+
+
+def load_predictions(predictions_file: str) -> Dict[str, str]:
+    """
+    Load the predicted patches, keyed by instance id.
+    """
+    predictions = {}
+    with open(predictions_file, "r") as f:
+        for line in f:
+            item = json_io.loads(line)
+            predictions[item['instance_id']] = item['model_patch'] if 'model_patch' in item else item['patch']
+    return predictions
+
+
+@profiled("patch-application")
+def apply_patch_to_worktree(worktree: Path, patch: str):
+    """
+    Apply a patch to a worktree, reading and writing only the touched files.
+
+    Raises:
+        ValueError: If the patch does not apply.
+    """
+    files = {}
+    for filepath in get_patch_filepaths(patch):
+        path = worktree / filepath
+        if not path.resolve().is_relative_to(worktree.resolve()):
+            raise ValueError(f"Patch touches a file outside of the codebase: {filepath}")
+        files[filepath] = path.read_text(encoding="utf-8") if path.is_file() else None
+
+    for filepath, content in apply_patch_to_files(files, patch).items():
+        path = worktree / filepath
+        if content is None:
+            path.unlink(missing_ok=True)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+
+
+def junit_address(test_id: str) -> Tuple[str, str]:
+    """
+    Get the `classname` and `name` of a test in the JUnit XML report of pytest, e.g. `tests.test_a.TestB` and
+    `test_c[x - y]` for `tests/test_a.py::TestB::test_c[x - y]`.
+    """
+    path, bracket, params = test_id.partition("[")
+    names = path.split("::")
+    names[0] = re.sub(r"\.py$", "", names[0].replace("/", "."))
+    names[-1] += bracket + params
+    return ".".join(names[:-1]), names[-1]
+
+
+def parse_junit_report(report_file: Path, test_ids: List[str]) -> Dict[str, str]:
+    """
+    Get the outcome (`PASSED`, `FAILED`, `ERROR`, `XFAIL` or `SKIPPED`) of the given tests in a JUnit XML report.
+
+    Tests missing from the report are left out.
+    """
+    import xml.etree.ElementTree as ElementTree
+
+    test_ids_by_address = {junit_address(test_id): test_id for test_id in test_ids}
+    outcomes = {}
+    for testcase in ElementTree.parse(report_file).iter("testcase"):
+        test_id = test_ids_by_address.get((testcase.get("classname", ""), testcase.get("name", "")))
+        if test_id is None:
+            continue
+        tags = {child.tag: child for child in testcase}
+        if "error" in tags:
+            outcome = "ERROR"
+        elif "failure" in tags:
+            outcome = "FAILED"
+        elif "skipped" in tags:
+            outcome = "XFAIL" if tags["skipped"].get("type") == "pytest.xfail" else "SKIPPED"
+        else:
+            outcome = "PASSED"
+        # a test failing in its teardown is reported twice, the failure wins
+        if outcomes.get(test_id) not in ("ERROR", "FAILED"):
+            outcomes[test_id] = outcome
+    return outcomes
+
+
+@profiled("test-running")
+def run_tests(worktree: Path, test_ids: List[str], timeout: float) -> Tuple[Dict[str, str], bool]:
+    """
+    Run tests with the script of `generate_test_script` and collect the outcome of each test from the JUnit XML
+    report of pytest.
+
+    The tests run in their own process group, which is killed on timeout.
+
+    Returns:
+        The outcome of each reported test (`PASSED`, `FAILED`, ...), and whether the run timed out.
+    """
+    # written next to the worktree, so that the tests cannot see it
+    report_file = worktree.parent / f"{worktree.name}.junit.xml"
+    pytest_args = ["-p", "no:cacheprovider", shlex.quote(f"--junitxml={report_file}"), "-o", "junit_logging=no"]
+    test_script = generate_test_script(test_ids, pytest_args=pytest_args)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    process = subprocess.Popen(
+        test_script,
+        shell=True,
+        cwd=worktree,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        report_file.unlink(missing_ok=True)
+        return {}, True
+
+    try:
+        outcomes = parse_junit_report(report_file, test_ids)
+    except (OSError, SyntaxError):
+        # pytest crashed before writing its report, e.g. on a broken conftest
+        outcomes = {}
+    report_file.unlink(missing_ok=True)
+    return outcomes, False
+
+
+class WorktreePool:
+    """
+    Create and remove the detached `git worktree`s of the instances, one git command at a time per repository.
+    """
+
+    def __init__(self, work_root: str):
+        self.work_root = Path(work_root)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def _repository_lock(self, repo_dir: str) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(repo_dir, threading.Lock())
+
+    @profiled("worktree-checkout")
+    def add(self, repo_dir: str, name: str, commit: str) -> Path:
+        worktree = self.work_root / name
+        with self._repository_lock(repo_dir):
+            subprocess.run(["git", "worktree", "add", "--detach", "--force", str(worktree), commit], cwd=repo_dir, check=True, capture_output=True)
+        return worktree
+
+    @profiled("worktree-removal")
+    def remove(self, repo_dir: str, worktree: Path):
+        with self._repository_lock(repo_dir):
+            result = subprocess.run(["git", "worktree", "remove", "--force", str(worktree)], cwd=repo_dir, capture_output=True)
+            if result.returncode != 0:
+                shutil.rmtree(worktree, ignore_errors=True)
+                subprocess.run(["git", "worktree", "prune"], cwd=repo_dir, capture_output=True)
+
+
+def select_pass_to_pass(instance: Dict, patch: str) -> Tuple[List[str], str]:
+    """
+    Select the pass-to-pass tests to run for a patch.
+
+    The impacted tests of an instance (`pass_to_pass_impacted`) cover the files its step changes, so they are
+    selected only when the patch touches no other file; otherwise all pass-to-pass tests are.
+
+    Returns:
+        The selected test ids, and the selection (`impacted` or `full`).
+    """
+    if instance.get('pass_to_pass_impacted') is not None:
+        if set(get_patch_filepaths(patch)) <= set(get_patch_filepaths(instance['patch'])):
+            return instance['pass_to_pass_impacted'], "impacted"
+    return instance['pass_to_pass'], "full"
+
+
+def evaluate_instance(instance: Dict, patch: str, repo_dir: str, worktrees: WorktreePool, timeout: float, full_pass_to_pass: bool = False) -> Dict:
+    """
+    Evaluate the patch of an instance in a fresh worktree of its base commit.
+
+    Returns:
+        The result of the instance, with its status (`resolved`, `unresolved`, `patch-failed`, `timeout` or `error`)
+        and the tests that passed and failed.
+    """
+    start_time = time.perf_counter()
+    result = {"instance_id": instance['instance_id'], "repo": instance['repo']}
+    fail_to_pass = instance['fail_to_pass']
+    if full_pass_to_pass:
+        pass_to_pass, result["pass-to-pass-selection"] = instance['pass_to_pass'], "full"
+    else:
+        pass_to_pass, result["pass-to-pass-selection"] = select_pass_to_pass(instance, patch)
+
+    worktree = None
+    try:
+        worktree = worktrees.add(repo_dir, instance['instance_id'], instance['base_commit'])
+        try:
+            apply_patch_to_worktree(worktree, patch)
+        except (ValueError, OSError) as e:
+            result.update({"status": "patch-failed", "error": str(e)})
+            return result
+
+        outcomes, timed_out = run_tests(worktree, fail_to_pass + pass_to_pass, timeout)
+        if timed_out:
+            result["status"] = "timeout"
+            return result
+
+        for key, test_ids in (("fail-to-pass", fail_to_pass), ("pass-to-pass", pass_to_pass)):
+            passed = [test_id for test_id in test_ids if outcomes.get(test_id) in PASSING_OUTCOMES]
+            failed = [test_id for test_id in test_ids if outcomes.get(test_id) not in PASSING_OUTCOMES]
+            result[key] = {"passed": passed, "failed": failed}
+        resolved = not result["fail-to-pass"]["failed"] and not result["pass-to-pass"]["failed"]
+        result["status"] = "resolved" if resolved else "unresolved"
+        result["tests-run"] = len(outcomes)
+        return result
+    except Exception as e:
+        result.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+        return result
+    finally:
+        if worktree is not None:
+            worktrees.remove(repo_dir, worktree)
+        result["duration"] = round(time.perf_counter() - start_time, 3)
+        count(f"instances-{result['status']}")
+
+
+def evaluate(
+    instances: List[Dict],
+    predictions: Dict[str, str],
+    output_dir: str,
+    codebase_dir: Optional[str] = None,
+    codebase_root: Optional[str] = None,
+    max_workers: int = 8,
+    timeout: float = 1800,
+    temp_dir: Optional[str] = None,
+    full_pass_to_pass: bool = False,
+) -> Dict:
+    """
+    Evaluate the predicted patches of the instances in parallel.
+
+    The results are appended to `results.jsonl` as instances finish, and the summary with throughput metrics is
+    written to `report.json`.
+
+    Returns:
+        The summary.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if temp_dir is not None:
+        Path(temp_dir).mkdir(parents=True, exist_ok=True)
+
+    def get_repo_dir(instance: Dict) -> str:
+        if codebase_dir is not None:
+            return str(Path(codebase_dir).resolve())
+        return str((Path(codebase_root) / instance['repo'].replace('/', '__--__')).resolve())
+
+    start_time = time.perf_counter()
+    statuses = {status: 0 for status in ("resolved", "unresolved", "patch-failed", "timeout", "error")}
+    tests_run = 0
+    with TemporaryDirectory(dir=temp_dir) as work_root, open(output_dir / "results.jsonl", "w") as f:
+        worktrees = WorktreePool(work_root)
+        with create_progress() as progress, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            task = progress.add_task("[cyan]Evaluating instances...", total=len(instances))
+            futures = [
+                executor.submit(evaluate_instance, instance, predictions[instance['instance_id']], get_repo_dir(instance), worktrees, timeout, full_pass_to_pass)
+                for instance in instances
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                statuses[result['status']] += 1
+                tests_run += result.get("tests-run", 0)
+                f.write(json_io.dumps(result, pretty=False) + "\n")
+                f.flush()
+                progress.update(task, advance=1)
+    wall_time = time.perf_counter() - start_time
+
+    summary = {
+        "instances": len(instances),
+        **statuses,
+        "resolved-rate": statuses["resolved"] / len(instances) if instances else 0.0,
+        "tests-run": tests_run,
+        "wall-time": round(wall_time, 3),
+        "instances-per-minute": round(len(instances) / wall_time * 60, 3) if wall_time > 0 else 0.0,
+        "tests-per-second": round(tests_run / wall_time, 3) if wall_time > 0 else 0.0,
+    }
+    json_io.dump(summary, output_dir / "report.json", pretty=True)
+
+    return summary
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-evaluate-python")
+
+    with open(args.dataset, "r") as f:
+        instances = [json_io.loads(line) for line in f]
+
+    if args.predictions is not None:
+        predictions = load_predictions(args.predictions)
+    else:
+        predictions = {instance['instance_id']: instance['patch'] for instance in instances}
+
+    instance_ids = set(args.instance_ids) if args.instance_ids else None
+    instances = [
+        instance for instance in instances
+        if instance['instance_id'] in predictions and (instance_ids is None or instance['instance_id'] in instance_ids)
+    ]
+
+    summary = evaluate(
+        instances,
+        predictions,
+        args.output_dir,
+        codebase_dir=args.codebase_dir,
+        codebase_root=args.codebase_root,
+        max_workers=args.max_workers,
+        timeout=args.timeout,
+        temp_dir=args.temp_dir,
+        full_pass_to_pass=args.full_pass_to_pass,
+    )
+    print(f"Resolved {summary['resolved']} of {summary['instances']} instances in {summary['wall-time']}s ({summary['instances-per-minute']} instances per minute).")
+
+
+if __name__ == "__main__":
+
+    main()
@@ -2,13 +2,22 @@ from .common import (
     collect_nodes,
     read_file_from_project,
     generate_patch,
+    generate_patch_from_commits,
+    list_ignored_files,
+    split_lines,
+    parse_unified_diff,
+    get_patch_filepaths,
     convert_patch_to_replace,
+    parse_replace_blocks,
+    apply_patch_to_files,
     generate_test_script,
 )
 from .code_utils import CodeParser
 from .codebase import (
     clean_codebase,
     reinit_codebase,
+    is_worktree_committed,
+    rollback_codebase,
     update_codebase_on_schedule,
     skeletonize_codebase_on_schedule,
 )
@@ -19,9 +28,18 @@ __all__ = [
     "CodeParser",
     "clean_codebase",
     "reinit_codebase",
+    "is_worktree_committed",
+    "rollback_codebase",
     "update_codebase_on_schedule",
     "skeletonize_codebase_on_schedule",
     "generate_patch",
+    "generate_patch_from_commits",
+    "list_ignored_files",
+    "split_lines",
+    "parse_unified_diff",
+    "get_patch_filepaths",
     "convert_patch_to_replace",
+    "parse_replace_blocks",
+    "apply_patch_to_files",
     "generate_test_script",
 ]
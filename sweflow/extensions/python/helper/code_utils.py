@@ -3,6 +3,8 @@ from typing import List, Dict, Tuple, Literal
 import ast
 import textwrap
 
+from sweflow.utils.profiling import profiled, count
+
 
 class CodeParser():
     """
@@ -19,11 +21,13 @@ class CodeParser():
         return node.lineno
 
     @classmethod
+    @profiled("ast-parsing")
     def get_function_node(cls, source_code: str, function_name: str, lineno: int):
         """
         Get the function node by function name and start line.
         """
         tree = ast.parse(source_code)
+        count("files-parsed")
 
         for node in ast.walk(tree):
             if isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef) \
@@ -236,6 +240,7 @@ class FileSkeletonizer(ast.NodeTransformer):
         return transformed_code
 
 
+@profiled("skeletonizing")
 def skeletonize_file(
     file_info: Dict[str, str],
     target_core_nodes: List[str],
@@ -274,5 +279,52 @@ def skeletonize_file(
 
     # get the reference code
     reference_code = reference_code_generator.run(mode='reference')
+    count("files-skeletonized")
 
     return skeletonized_code, reference_code
+
+
+def _is_stub_body(node: ast.FunctionDef | ast.AsyncFunctionDef) -> bool:
+    """
+    Check if the body of a function, past its docstring, is a lone `...`, which is also its skeleton.
+    """
+    body = node.body
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+        body = body[1:]
+    return len(body) == 1 and isinstance(body[0], ast.Expr) \
+        and isinstance(body[0].value, ast.Constant) and body[0].value.value is Ellipsis
+
+
+def estimate_patch_lines(
+    tree: ast.Module,
+    filepath: str,
+    target_core_nodes: List[str],
+    dependent_core_nodes: List[str],
+) -> int:
+    """
+    Estimate the number of lines the reference patch of a file changes, from the AST spans of its functions.
+
+    The functions are visited as `FileSkeletonizer` visits them: the body of a target function changes unless it is
+    already a lone `...`, a dependent function is removed whole, and the functions nested in a function are left out.
+
+    :param tree: The parsed source code of the file.
+    :param filepath: The filepath of the file.
+    :param target_core_nodes: The target core nodes to skeletonize.
+    :param dependent_core_nodes: The dependent core nodes to skeletonize.
+    :return: The number of changed lines, 0 if the skeleton and the reference of the file are the same.
+    """
+    target_core_nodes, dependent_core_nodes = set(target_core_nodes), set(dependent_core_nodes)
+    changed_lines = 0
+    nodes = list(ast.iter_child_nodes(tree))
+    while nodes:
+        node = nodes.pop()
+        if not isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef):
+            nodes.extend(ast.iter_child_nodes(node))
+            continue
+        node_id = f"{filepath}:{CodeParser.get_start_line(node)}:{node.name}"
+        if node_id in target_core_nodes:
+            if not _is_stub_body(node):
+                changed_lines += node.end_lineno - node.body[0].lineno + 1
+        elif node_id in dependent_core_nodes:
+            changed_lines += node.end_lineno - CodeParser.get_start_line(node) + 1
+    return changed_lines
@@ -1,77 +1,296 @@
-from typing import List, Dict
+from typing import List, Dict, Callable, TYPE_CHECKING
 from pathlib import Path
-from git import Repo
 
+import os
 import re
 import shutil
 
+from sweflow.utils.profiling import profiled, count
+
 from .common import read_file_from_project
 from .code_utils import skeletonize_file
 
+if TYPE_CHECKING:
+    from git import Repo
+
+CACHE_DIRS = ("__pycache__", ".pytest_cache")
+CORE_DUMP_PATTERN = re.compile(r'^core\.\d+$')
+
+# FICLONE ioctl request number on Linux, used for copy-on-write reflinks
+FICLONE = 0x40049409
+
 
-def delete_core_dumps(directory_path: Path):
+def clean_codebase(codebase_dir: str):
     """
-    Delete all core dump files in the given directory.
+    Recursively delete Python cache folders, pytest cache and core dumps in the given directory.
+
+    The tree is walked once with `os.scandir`; cache folders are removed without descending into
+    them and the `.git` directory is never entered.
     """
-    pattern = re.compile(r'^core\.\d+$')
+    stack = [codebase_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in CACHE_DIRS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        print(f"Deleted cache folder: {entry.path}")
+                    elif entry.name != ".git":
+                        stack.append(entry.path)
+                elif CORE_DUMP_PATTERN.match(entry.name) and entry.is_file(follow_symlinks=False):
+                    try:
+                        os.unlink(entry.path)
+                        print(f"Deleted core dump file: {entry.path}")
+                    except Exception as e:
+                        print(f"Failed to delete {entry.path}: {e}")
+
 
-    for path in directory_path.rglob("core.*"):
-        if path.is_file() and pattern.match(path.name):
-            try:
-                path.unlink()
-                print(f"Deleted core dump file: {path}")
-            except Exception as e:
-                print(f"Failed to delete {path}: {e}")
+def _translate_exclude_pattern(pattern: str) -> str:
+    """
+    Translate a single `.gitignore`-style glob into a regular expression matched against relative paths.
+    """
+    regex, i = "", 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            regex += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
 
 
-def clean_codebase(codebase_dir: str):
+def compile_excludes(patterns: List[str]) -> Callable[[str, bool], bool]:
     """
-    Recursively delete Python cache folders and pytest cache in the given directory.
+    Compile `.gitignore`-style exclude patterns into a predicate.
+
+    Supported syntax: comments (`#`), negation (`!`), directory-only patterns (trailing `/`),
+    anchored patterns (containing `/`), and the `*`, `?`, `[...]` and `**` wildcards.
+    As in git, the last matching pattern wins.
+
+    Args:
+        patterns: The exclude patterns.
+    Returns:
+        A function `(relative_path, is_dir) -> bool` telling whether the path is excluded.
     """
-    codebase = Path(codebase_dir)
+    rules = []
+    for pattern in patterns or []:
+        pattern = pattern.rstrip()
+        if not pattern or pattern.startswith("#"):
+            continue
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            regex = re.compile(_translate_exclude_pattern(pattern.lstrip("/")) + "$")
+            anchored = True
+        else:
+            regex = re.compile(_translate_exclude_pattern(pattern) + "$")
+            anchored = False
+        rules.append((regex, anchored, dir_only, negate))
 
-    # traverse the directory and delete cache folders
-    for path in codebase.rglob("*"):
-        if path.name in ("__pycache__", ".pytest_cache") and path.is_dir():
-            shutil.rmtree(path, ignore_errors=True)
-            print(f"Deleted cache folder: {path}")
+    def is_excluded(relpath: str, is_dir: bool) -> bool:
+        excluded = False
+        name = relpath.rsplit("/", 1)[-1]
+        for regex, anchored, dir_only, negate in rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath if anchored else name):
+                excluded = not negate
+        return excluded
 
-    # delete core dumps
-    delete_core_dumps(codebase)
+    return is_excluded
 
 
-def reinit_codebase(project_root: str, codebase_dir: str = None, initial_branch: str = "main") -> Repo:
+def _reflink(src: str, dst: str):
     """
-    Prepare a codebase by cloning it and removing the .git directory.
-    
+    Create a copy-on-write clone of `src` at `dst`; raises `OSError` if the filesystem does not support it.
+    """
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _link_or_copy(src: str, dst: str, link_mode: str) -> str:
+    """
+    Materialize `src` at `dst` using the cheapest method allowed by `link_mode`.
+
+    Returns:
+        The method that was actually used: `reflink`, `hardlink` or `copy`.
+    """
+    if link_mode in ("auto", "reflink"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except (OSError, ImportError):
+            pass
+    if link_mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def snapshot_codebase(
+    project_root: str,
+    codebase_dir: str,
+    excludes: List[str] = None,
+    link_mode: str = "auto",
+) -> Dict[str, int]:
+    """
+    Snapshot the project into the codebase directory with a single pruned `os.scandir` walk.
+
+    Files are materialized as reflinks or hardlinks where the filesystem allows it and copied otherwise.
+    Hardlinked files are safe because every later write into the codebase replaces the file instead of
+    writing through the link (see `update_codebase_with_files`), and git does the same on checkout.
+    Inside `.git` only the immutable object store is linked, refs, logs, config and index are copied.
+
+    Args:
+        project_root: The path to the project root
+        codebase_dir: The path to the codebase directory to snapshot the project to
+        excludes: `.gitignore`-style patterns of paths to leave out of the snapshot
+        link_mode: One of `auto`, `reflink`, `hardlink` or `copy`
+    Returns:
+        The number of files materialized with each method.
+    """
+    is_excluded = compile_excludes(excludes)
+    stats = {"reflink": 0, "hardlink": 0, "copy": 0, "symlink": 0, "excluded": 0}
+
+    Path(codebase_dir).mkdir(parents=True, exist_ok=True)
+    stack = [""]
+    while stack:
+        reldir = stack.pop()
+        with os.scandir(os.path.join(project_root, reldir)) as entries:
+            for entry in entries:
+                relpath = f"{reldir}/{entry.name}" if reldir else entry.name
+                target = os.path.join(codebase_dir, relpath)
+                is_dir = entry.is_dir(follow_symlinks=False)
+                # the patterns are about the project files, the git metadata is seeded whole
+                in_git_dir = relpath == ".git" or relpath.startswith(".git/")
+                if not in_git_dir and is_excluded(relpath, is_dir):
+                    stats["excluded"] += 1
+                    continue
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                    stats["symlink"] += 1
+                elif is_dir:
+                    os.makedirs(target, exist_ok=True)
+                    stack.append(relpath)
+                elif in_git_dir and not relpath.startswith(".git/objects/"):
+                    stats[_link_or_copy(entry.path, target, "copy")] += 1
+                else:
+                    stats[_link_or_copy(entry.path, target, link_mode)] += 1
+
+    return stats
+
+
+@profiled("codebase-snapshot")
+def reinit_codebase(
+    project_root: str,
+    codebase_dir: str = None,
+    initial_branch: str = "main",
+    excludes: List[str] = None,
+    link_mode: str = "auto",
+) -> "Repo":
+    """
+    Prepare a codebase by snapshotting the project and committing it on a fresh main branch.
+
+    If the project already is a git repository, the snapshot links its object store and copies its index,
+    so only files whose size or mtime changed since the last `git add` are re-hashed by the initial commit.
+
     Args:
         project_root: The path to the project root
         codebase_dir: The path to the codebase directory to clone the repository to
+        initial_branch: The name of the branch holding the initial commit
+        excludes: `.gitignore`-style patterns of paths to leave out of the snapshot
+        link_mode: One of `auto`, `reflink`, `hardlink` or `copy`
     """
-    # copy the codebase to temp directory
-    shutil.copytree(project_root, codebase_dir, dirs_exist_ok=True)
+    from git import Repo
+
+    # snapshot the codebase to temp directory
+    snapshot_codebase(project_root, codebase_dir, excludes=excludes, link_mode=link_mode)
 
     # initialize new git repository
-    if not (Path(codebase_dir) / ".git").exists():
+    seeded = (Path(codebase_dir) / ".git").exists()
+    if not seeded:
         repo = Repo.init(codebase_dir, initial_branch=initial_branch)
     else:
         repo = Repo(codebase_dir)
         # rename current branch to main
-        repo.git.branch("-m", "main")
+        repo.git.branch("-m", initial_branch)
 
     # config user and email
     with repo.config_writer() as config:
         config.set_value("user", "name", "sweflow")
         config.set_value("user", "email", "sweflow@sweflow.ai")
 
-    # create initial commit on main branch
-    repo.git.add(all=True)
+    # create initial commit on main branch; a seeded index only needs to trust size and mtime,
+    # since inodes and ctimes always change in the snapshot
+    if seeded:
+        repo.git(c=["core.checkStat=minimal", "core.trustctime=false"]).add(all=True)
+    else:
+        repo.git.add(all=True)
     repo.git.commit("-m", "Initial test commit", "--allow-empty")
 
     return repo
 
 
-def update_codebase_with_files(repo: Repo, files_to_update: List[Dict[str, str]]):
+def is_worktree_committed(repo: "Repo") -> bool:
+    """
+    Check whether every file in the working tree, including ignored ones, is committed on the current branch.
+    """
+    return not repo.git.status("--porcelain", "--ignored", "--untracked-files=all").strip()
+
+
+def rollback_codebase(repo: "Repo", completed_steps: List[int], branch: str = "main"):
+    """
+    Roll an interrupted codebase back to its last completed step.
+
+    The working tree is reset to the main branch and the step branches of steps that were not completed
+    (possibly created before the interruption) are deleted, so these steps can be prepared again.
+
+    Args:
+        repo: The git repository to roll back
+        completed_steps: The steps whose branches are kept
+        branch: The main branch of the repository
+    """
+    repo.git.checkout("-f", branch)
+    repo.git.clean("-fd")
+    completed_branches = {f"step-{step}-{kind}" for step in completed_steps for kind in ("skeleton", "reference")}
+    for head in repo.heads:
+        if head.name.startswith("step-") and head.name not in completed_branches:
+            repo.delete_head(head, force=True)
+
+
+def update_codebase_with_files(repo: "Repo", files_to_update: List[Dict[str, str]]):
     """
     Update files in the repository.
     
@@ -85,12 +304,16 @@ def update_codebase_with_files(repo: Repo, files_to_update: List[Dict[str, str]]
         file_path = Path(repo.working_dir) / file_dict['filepath']
         # create parent directories if they don't exist
         file_path.parent.mkdir(parents=True, exist_ok=True)
+        # replace instead of truncating, the snapshot may hardlink the file to the project root
+        if file_path.exists():
+            file_path.unlink()
         # write file content
         with open(file_path, 'w') as f:
             f.write(file_dict['content'])
 
 
-def update_codebase_on_schedule(repo: Repo, schedule: Dict, skeleton_files: List[Dict[str, str]], reference_files: List[Dict[str, str]]) -> Dict[str, str]:
+@profiled("git-commits")
+def update_codebase_on_schedule(repo: "Repo", schedule: Dict, skeleton_files: List[Dict[str, str]], reference_files: List[Dict[str, str]]) -> Dict[str, str]:
     """
     Update a repository for a sample by checking out a new branch, writing files, and committing the changes.
     
@@ -111,10 +334,10 @@ def update_codebase_on_schedule(repo: Repo, schedule: Dict, skeleton_files: List
     # commit the changes
     repo.git.add(all=True)
     repo.git.commit("-m", f"prepare skeleton for step {step}", "--allow-empty")
+    # get commit hash of the skeleton, before leaving its branch
+    base_commit = repo.head.commit.hexsha
     # checkout back to the current branch
     repo.heads[current_branch].checkout()
-    # get commit hash
-    base_commit = repo.head.commit.hexsha
 
     # update reference files
     branch_name = f"step-{step}-reference"
@@ -125,6 +348,7 @@ def update_codebase_on_schedule(repo: Repo, schedule: Dict, skeleton_files: List
     repo.git.commit("-m", f"prepare reference for step {step}", "--allow-empty")
     # get commit hash
     reference_commit = repo.head.commit.hexsha
+    count("commits-written", 2)
 
     # checkout back to the main branch
     repo.heads[current_branch].checkout()
@@ -1,7 +1,16 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+import os
+import re
 import difflib
+import shlex
+import subprocess
+
+from sweflow.utils.profiling import profiled
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+GIT_DIFF_HEADER_PATTERN = re.compile(r"^diff --git a/.* b/")
 
 
 def collect_nodes(development_plans: Dict[str, List[str]], key: str = 'core-nodes') -> List[str]:
@@ -46,6 +55,20 @@ def aggregate_nodes_by_file(nodes: List[str]) -> Dict[str, List[str]]:
     return nodes_by_file
 
 
+def split_lines(content: str) -> List[str]:
+    """
+    Split a content into lines on `\n` only, without the line endings.
+
+    Unlike `str.splitlines`, form feeds, `\x1c`-`\x1e`, `\x85` or `\u2028` inside a source line do not break it,
+    so the lines are the ones of git and of unified-diff hunks.
+    """
+    lines = content.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+@profiled("diffing")
 def generate_patch(skeleton_files: List[Dict[str, str]], reference_files: List[Dict[str, str]]) -> str:
     """
     Generate a unified diff patch that supports creating, modifying, and deleting files.
@@ -75,7 +98,7 @@ def generate_patch(skeleton_files: List[Dict[str, str]], reference_files: List[D
             # Handle new files
             diff = difflib.unified_diff(
                 [],
-                reference_content.splitlines(),
+                split_lines(reference_content),
                 fromfile="/dev/null",
                 tofile=f"{filename}",
                 lineterm="",
@@ -83,7 +106,7 @@ def generate_patch(skeleton_files: List[Dict[str, str]], reference_files: List[D
         elif filename not in reference_files_dict:
             # Handle file deletion
             diff = difflib.unified_diff(
-                skeleton_content.splitlines(),
+                split_lines(skeleton_content),
                 [],
                 fromfile=f"{filename}",
                 tofile="/dev/null",
@@ -92,8 +115,8 @@ def generate_patch(skeleton_files: List[Dict[str, str]], reference_files: List[D
         else:
             # Handle file modifications
             diff = difflib.unified_diff(
-                skeleton_content.splitlines(),
-                reference_content.splitlines(),
+                split_lines(skeleton_content),
+                split_lines(reference_content),
                 fromfile=f"{filename}",
                 tofile=f"{filename}",
                 lineterm="",
@@ -108,6 +131,158 @@ def generate_patch(skeleton_files: List[Dict[str, str]], reference_files: List[D
     return patch
 
 
+@profiled("diffing")
+def generate_patch_from_commits(repo_dir: str, base: str, reference: str, algorithm: str = "histogram") -> str:
+    """
+    Generate a unified diff patch between two commits with `git diff`.
+
+    The git extended headers (`diff --git`, `index`, file modes) and `\\ No newline at end of file` markers are
+    dropped, so the patch has the same layout as the one from `generate_patch` and can be converted
+    by `convert_patch_to_replace`.
+
+    Args:
+        repo_dir (str): Path to the git repository.
+        base (str): The commit (or ref) holding the skeleton files.
+        reference (str): The commit (or ref) holding the reference files.
+        algorithm (str): The diff algorithm of git, e.g. `histogram`, `patience` or `myers`.
+
+    Returns:
+        str: A unified diff patch representing the differences between the two commits.
+    """
+    # the output must not depend on the config of the user nor on `.gitattributes` (binary or textconv drivers)
+    diff = subprocess.run(
+        [
+            "git", "-c", "core.quotePath=false", "-c", "diff.suppressBlankEmpty=false", "diff", "--no-color",
+            "--no-ext-diff", "--no-textconv", "--no-renames", "--no-relative", "--text", "-U3", "--no-prefix",
+            f"--diff-algorithm={algorithm}", base, reference,
+        ],
+        cwd=repo_dir,
+        env={**os.environ, "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1"},
+        check=True,
+        capture_output=True,
+    ).stdout.decode("utf-8", errors="surrogateescape")
+
+    patch_lines = []
+    in_hunk = False
+    for line in split_lines(diff):
+        if line.startswith("diff --git "):
+            in_hunk = False
+        elif line.startswith("@@ "):
+            in_hunk = True
+            # drop the function context git appends to the hunk header
+            patch_lines.append(line[:line.index(" @@", 2) + 3])
+        elif in_hunk:
+            if not line.startswith("\\"):
+                patch_lines.append(line)
+        elif line.startswith("--- ") or line.startswith("+++ "):
+            patch_lines.append(line)
+
+    patch = "\n".join(patch_lines) + "\n"  # Ensure patch ends with a newline
+
+    return patch
+
+
+def list_ignored_files(repo_dir: str, filepaths: List[str]) -> List[str]:
+    """
+    Get the untracked files ignored by the `.gitignore` of a repository among the given ones.
+
+    `git add --all` leaves these files out of the commits, so their changes are missing from `git diff`.
+    """
+    if not filepaths:
+        return []
+    process = subprocess.run(
+        ["git", "check-ignore", "-z", "--stdin"],
+        cwd=repo_dir,
+        input="\0".join(filepaths).encode("utf-8"),
+        capture_output=True,
+    )
+    # exits with 1 when no file is ignored
+    if process.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(process.returncode, process.args, process.stdout, process.stderr)
+    return [filepath for filepath in process.stdout.decode("utf-8").split("\0") if filepath]
+
+
+def _diff_header_path(line: str, prefix: str, git_style: bool) -> str:
+    """
+    Get the path of a `--- ` or `+++ ` file header, without its timestamp and, in git-style patches, its `a/` or
+    `b/` prefix.
+    """
+    path = line[4:].split("\t", 1)[0].strip()
+    if git_style and path.startswith(prefix):
+        path = path[len(prefix):]
+    return path
+
+
+def parse_unified_diff(patch: str) -> List[Dict]:
+    """
+    Parse a unified-diff patch, as written by `generate_patch`, `generate_patch_from_commits` or a plain `git diff`.
+
+    Hunks are read up to the line counts of their header, so their removed `-- ...` or added `++ ...` lines are not
+    taken for file headers. The `a/` and `b/` prefixes of git-style patches (with `diff --git a/... b/...` headers,
+    or `a/` and `b/` file headers) are stripped, and `\\ No newline at end of file` markers are skipped.
+
+    Args:
+        patch (str): The unified-diff patch.
+
+    Returns:
+        List[Dict]: The `old-file` and `new-file` (`/dev/null` for a created or deleted file) and the
+            `(search lines, replace lines)` of the `hunks` of every file, in order.
+    """
+    lines = split_lines(patch)
+    git_style = any(GIT_DIFF_HEADER_PATTERN.match(line) for line in lines)
+
+    files_diffs = []
+    old_lines, new_lines = 0, 0
+    for idx, line in enumerate(lines):
+        if old_lines > 0 or new_lines > 0:
+            hunk = files_diffs[-1]['hunks'][-1]
+            if line.startswith('-'):
+                hunk[0].append(line[1:])
+                old_lines -= 1
+            elif line.startswith('+'):
+                hunk[1].append(line[1:])
+                new_lines -= 1
+            elif not line.startswith('\\'):
+                # a context line, whose leading space some tools strip from blank lines
+                hunk[0].append(line[1:])
+                hunk[1].append(line[1:])
+                old_lines -= 1
+                new_lines -= 1
+            continue
+        if line.startswith('--- ') and idx + 1 < len(lines) and lines[idx + 1].startswith('+++ '):
+            old_file, new_file = line, lines[idx + 1]
+            # without `diff --git` headers, a created or deleted file cannot tell a prefix from a directory
+            file_git_style = git_style or (old_file.startswith('--- a/') and new_file.startswith('+++ b/'))
+            files_diffs.append({
+                'old-file': _diff_header_path(old_file, 'a/', file_git_style),
+                'new-file': _diff_header_path(new_file, 'b/', file_git_style),
+                'hunks': [],
+            })
+            continue
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match and files_diffs:
+            old_lines = int(match.group(1)) if match.group(1) is not None else 1
+            new_lines = int(match.group(2)) if match.group(2) is not None else 1
+            files_diffs[-1]['hunks'].append(([], []))
+        # anything else outside hunks (`diff --git`, `index`, file modes, `\\` markers) is skipped
+
+    return files_diffs
+
+
+def get_patch_filepaths(patch: str) -> List[str]:
+    """
+    Get the files touched by a replace-formatted or unified-diff patch, in order.
+    """
+    if '```replace:' in patch or '<<<<<<< SEARCH' in patch:
+        filepaths = [filename for filename, _, _ in parse_replace_blocks(patch)]
+    else:
+        filepaths = [
+            path for file_diff in parse_unified_diff(patch) for path in (file_diff['old-file'], file_diff['new-file'])
+            if path != '/dev/null'
+        ]
+    return list(dict.fromkeys(filepaths))
+
+
 def convert_patch_to_replace(patch: str) -> str:
     """
     Converts a unified-diff patch into a 'replace' formatted content.
@@ -118,97 +293,13 @@ def convert_patch_to_replace(patch: str) -> str:
     Returns:
         str: The replace-formatted content.
     """
-    lines = patch.splitlines()
-
     files_diffs = []
-
-    current_old_file = None
-    current_new_file = None
-    current_file_data = None  # used to collect all chunks of the current file
-    in_hunk = False  # mark if current is processing a hunk
-
-    # temporary storage for current hunk's search/replace
-    search_lines = []
-    replace_lines = []
-
-    def finish_hunk():
-        """
-        store the current hunk (search_lines, replace_lines) into the current file data structure.
-        """
-        if search_lines or replace_lines:
-            current_file_data['chunks'].append((search_lines[:], replace_lines[:]))
-            search_lines.clear()
-            replace_lines.clear()
-
-    def finish_file():
-        """
-        finish the current file's collection and store it into files_diffs.
-        """
-        if current_file_data:
-            # if the last hunk is not finished, finish it first
-            finish_hunk()
-            if current_file_data['chunks']:
-                files_diffs.append(current_file_data)
-
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx]
-
-        if line.startswith('--- '):
-            # a new file diff starts
-            # if there is a file not finished, finish it first
-            finish_file()
-
-            # extract the old file name
-            # for example, line is like: --- path/to/file1.py
-            current_old_file = line[4:].strip()
-            # prepare a new file diff container
-            current_file_data = {
-                'filename': None,  # not sure yet, will be set after +++
-                'chunks': []
-            }
-            in_hunk = False
-
-        elif line.startswith('+++ '):
-            # extract the new file name
-            current_new_file = line[4:].strip()
-            # set the real filename, usually the old file and new file are the same, which means modification
-            # if the new file is /dev/null, it may represent deletion, if the old file is /dev/null, it may represent addition
-            # for simplicity, here directly use new_file as filename when it is not /dev/null, otherwise use old_file
-            if current_new_file != '/dev/null':
-                current_file_data['filename'] = current_new_file
-            else:
-                current_file_data['filename'] = current_old_file
-
-            in_hunk = False
-
-        elif line.startswith('@@ '):
-            # a new hunk, finish the last hunk first and then start the next one
-            finish_hunk()
-            in_hunk = True
-            # @@ -1,4 +1,4 @@ this line can parse line numbers, but here we do not go deep into it, just skip it
-            # different blocks will be stored in (search, replace) separately
-            # no extra work is needed, just move to the next one
-        else:
-            # if in hunk area, process the line, otherwise it may be an empty line or other, here simply skip it
-            if in_hunk and current_file_data is not None:
-                if line.startswith('-'):
-                    # minus line -> only put into search
-                    search_lines.append(line[1:])
-                elif line.startswith('+'):
-                    # plus line -> only put into replace
-                    replace_lines.append(line[1:])
-                else:
-                    # no +/- prefix (or space prefix) -> put into both search & replace
-                    # according to the standard of unified diff, context line usually starts with ' '
-                    # here simply remove the possible leading space
-                    search_lines.append(line[1:])
-                    replace_lines.append(line[1:])
-
-        idx += 1
-
-    # there may still be the last file/last hunk not written
-    finish_file()
+    for file_diff in parse_unified_diff(patch):
+        # a deleted file is edited under its old name, any other under its new one
+        filename = file_diff['new-file'] if file_diff['new-file'] != '/dev/null' else file_diff['old-file']
+        chunks = [(search_lines, replace_lines) for search_lines, replace_lines in file_diff['hunks'] if search_lines or replace_lines]
+        if chunks:
+            files_diffs.append({'filename': filename, 'chunks': chunks})
 
     # start to convert files_diffs to the final output format
     output_lines = []
@@ -227,14 +318,134 @@ def convert_patch_to_replace(patch: str) -> str:
     return '\n'.join(output_lines)
 
 
-def generate_test_script(test_ids: List[str]) -> str:
+def parse_replace_blocks(content: str) -> List[Tuple[str, List[str], List[str]]]:
+    """
+    Parse 'replace' formatted content into its edits.
+
+    Both the layout of `convert_patch_to_replace` (the replace lines follow the `>>>>>>> REPLACE` marker) and the
+    usual one (the replace lines sit between `=======` and `>>>>>>> REPLACE`) are accepted.
+
+    Args:
+        content (str): The replace-formatted content.
+
+    Returns:
+        List[Tuple[str, List[str], List[str]]]: The (filename, search lines, replace lines) of every block, in order.
+    """
+    edits = []
+    filename = None
+    search_lines, replace_lines = None, None
+    state = None  # one of None, 'search', 'replace' (usual layout), 'replace-after' (layout of this module)
+
+    def finish_block():
+        if search_lines is not None:
+            edits.append((filename, search_lines, replace_lines))
+
+    for line in split_lines(content):
+        if line.startswith('```replace:'):
+            # a block left without its closing fence belongs to the previous file
+            finish_block()
+            search_lines, replace_lines, state = None, None, None
+            filename = line[len('```replace:'):].strip()
+        elif line == '```' and state != 'search' and state != 'replace':
+            finish_block()
+            search_lines, replace_lines, state = None, None, None
+        elif line == '<<<<<<< SEARCH' and state != 'search':
+            finish_block()
+            search_lines, replace_lines, state = [], [], 'search'
+        elif line == '=======' and state == 'search':
+            state = 'replace'
+        elif line == '>>>>>>> REPLACE' and state == 'replace':
+            state = 'replace-after' if not replace_lines else None
+        elif state == 'search':
+            search_lines.append(line)
+        elif state in ('replace', 'replace-after'):
+            replace_lines.append(line)
+    finish_block()
+
+    return edits
+
+
+def get_deleted_files(patch: str) -> List[str]:
+    """
+    Get the files deleted by a unified-diff patch (`+++ /dev/null`).
+    """
+    return [file_diff['old-file'] for file_diff in parse_unified_diff(patch) if file_diff['new-file'] == '/dev/null']
+
+
+def apply_patch_to_files(files: Dict[str, Optional[str]], patch: str) -> Dict[str, Optional[str]]:
+    """
+    Apply a 'replace' formatted or unified-diff patch to file contents in memory.
+
+    Unified-diff patches are converted with `convert_patch_to_replace` first. Every search block is matched as
+    whole lines, after the previous block of the same file if possible.
+
+    Args:
+        files (Dict[str, Optional[str]]): The current content of every file touched by the patch, None for a missing file.
+        patch (str): The replace-formatted or unified-diff patch.
+
+    Returns:
+        Dict[str, Optional[str]]: The new content of every touched file, None for a deleted file.
+
+    Raises:
+        ValueError: If a search block is not found.
+    """
+    is_replace = '```replace:' in patch or '<<<<<<< SEARCH' in patch
+    edits = parse_replace_blocks(patch if is_replace else convert_patch_to_replace(patch))
+
+    contents = {}
+    cursors = {}
+    for filename, search_lines, replace_lines in edits:
+        if filename not in contents:
+            content = files.get(filename)
+            contents[filename] = split_lines(content) if content is not None else None
+            cursors[filename] = 0
+        lines = contents[filename]
+        if lines is None:
+            if search_lines:
+                raise ValueError(f"Cannot search in missing file: {filename}")
+            contents[filename] = replace_lines[:]
+            cursors[filename] = len(replace_lines)
+            continue
+        if not search_lines:
+            # an empty search appends to the file
+            lines.extend(replace_lines)
+            cursors[filename] = len(lines)
+            continue
+        start = _find_lines(lines, search_lines, cursors[filename])
+        if start < 0:
+            start = _find_lines(lines, search_lines, 0)
+        if start < 0:
+            raise ValueError(f"Search block not found in {filename}:\n" + "\n".join(search_lines))
+        lines[start:start + len(search_lines)] = replace_lines
+        cursors[filename] = start + len(replace_lines)
+
+    new_files = {filename: "\n".join(lines) + "\n" if lines else "" for filename, lines in contents.items()}
+    if not is_replace:
+        for filename in get_deleted_files(patch):
+            new_files[filename] = None
+    return new_files
+
+
+def _find_lines(lines: List[str], search_lines: List[str], start: int) -> int:
+    """
+    Find the first position from `start` where `search_lines` appear in `lines`, -1 if none.
+    """
+    first = search_lines[0]
+    for i in range(start, len(lines) - len(search_lines) + 1):
+        if lines[i] == first and lines[i:i + len(search_lines)] == search_lines:
+            return i
+    return -1
+
+
+def generate_test_script(test_ids: List[str], pytest_args: List[str] = None) -> str:
     """
     Generate a test script to verify the skeletonization.
 
     :param test_ids: List of test ids.
+    :param pytest_args: Extra pytest arguments, e.g. `["-rA"]` to report the outcome of every test.
     """
-    test_checkpoints = [test_id for test_id in test_ids]
+    test_checkpoints = [shlex.quote(test_id) for test_id in test_ids]
 
-    test_script = " ".join(["python", "-m", "pytest"] + test_checkpoints)
+    test_script = " ".join(["python", "-m", "pytest"] + (pytest_args or []) + test_checkpoints)
 
     return test_script
@@ -1,7 +1,8 @@
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict, Set, TYPE_CHECKING
 
-import networkx as nx
+if TYPE_CHECKING:
+    import networkx as nx
 
 
 def generate_uuid(item: Dict) -> str:
@@ -26,7 +27,7 @@ class RuntimeDependencyGraph():
         else:
             self.graph = None
 
-    def build_graph(self, trace: Dict) -> nx.DiGraph:
+    def build_graph(self, trace: Dict) -> "nx.DiGraph":
         """
         Build the dependency graph from the trace.
         """
@@ -39,6 +40,8 @@ class RuntimeDependencyGraph():
                 dependencies[caller_id] = set()
             dependencies[caller_id].add(callee_id)
 
+        import networkx as nx
+
         dependency_graph = nx.DiGraph()
         for caller, callees in dependencies.items():
             for callee in callees:
@@ -0,0 +1,440 @@
+"""
+Run the whole pipeline for a repository, from its test traces to its dataset.
+
+The schedule, docstrings, specifications and codebase outputs are passed between the stages in memory; the
+JSON artifact of a stage is only written with `--artifacts`. With `--incremental`, every artifact is written along
+with a manifest of the input and output hashes of its stage, and a re-run skips the stages that are up to date.
+With `--pipelined`, the docstring, specification and codebase stages overlap: the LLM requests are sent in step
+order from a background thread, and each step of the codebase is built as soon as the docstrings of its nodes arrive.
+"""
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+
+import time
+import argparse
+
+import sweflow
+from sweflow.extensions.python import create_docstring, create_specification
+from sweflow.extensions.python.schedule import create_development_schedule, save_development_schedule
+from sweflow.extensions.python.create_docstring import generate_docstrings
+from sweflow.extensions.python.create_specification import generate_specifications
+from sweflow.extensions.python.create_codebase import add_codebase_arguments, create_codebase, save_codebase_outputs
+from sweflow.extensions.python.helper import collect_nodes
+from sweflow.utils import json_io
+from sweflow.utils.merge import build_instances, iter_instances
+from sweflow.utils.stage_manifest import StageManifest
+from sweflow.utils.test_impact import TestImpactIndex
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profile_phase
+
+STAGES = ("schedule", "docstrings", "specifications", "codebase", "merge")
+ARTIFACT_STAGES = ("schedule", "docstrings", "specifications", "codebase")
+SCHEDULE_OUTPUTS = ("development-schedule.json", "dependency-graphs.json", "test-impact-index.json")
+# the codebase outputs read by the merge stage
+CODEBASE_OUTPUTS = (
+    "reference-patches", "fail-to-pass-test-ids", "pass-to-pass-test-ids", "impacted-pass-to-pass-test-ids",
+    "base-commits", "reference-commits", "step-flags",
+)
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Run the whole pipeline for a repository")
+
+    parser.add_argument("--repository", type=str, required=True, help="The full name of the repository")
+    parser.add_argument("--project-root", type=str, required=True, help="Path to the repository")
+    parser.add_argument("--trace-file", type=str, required=True, help="Path to the pytest trace file, or a directory of trace shards")
+    parser.add_argument("--output-dir", type=str, required=True, help="Path to the output directory of the dataset, the codebase archives and the artifacts")
+    parser.add_argument("--selected-tests", type=str, default=None, help="Path to a JSON list of test ids, only these tests are scheduled")
+    parser.add_argument("--artifacts", type=str, nargs="*", default=[], choices=ARTIFACT_STAGES, help="Stages whose JSON outputs are also saved to the output directory")
+    parser.add_argument("--impacted-pass-to-pass", action="store_true", help="Also add the pass-to-pass test ids impacted by each step to the dataset")
+    # LLM options of the docstring and specification stages
+    parser.add_argument("--base-url", type=str, help="Base URL for the OpenAI API")
+    parser.add_argument("--api-key", type=str, help="API key for the OpenAI API")
+    parser.add_argument("--model", type=str, help="OpenAI model of both stages")
+    parser.add_argument("--docstring-model", type=str, default=None, help="OpenAI model for docstring generation (defaults to `--model`)")
+    parser.add_argument("--specification-model", type=str, default=None, help="OpenAI model for specification generation (defaults to `--model`)")
+    parser.add_argument("--docstring-max-qpm", type=int, default=256, help="Max QPM of docstring generation")
+    parser.add_argument("--specification-max-qpm", type=int, default=128, help="Max QPM of specification generation")
+    parser.add_argument("--max-retries", type=int, default=3, help="Max retries for the OpenAI API")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Path to the directory of the LLM caches (defaults to `<output-dir>/cache`)")
+    parser.add_argument("--incremental", action="store_true", help="Save every artifact with the input and output hashes of its stage, and skip the stages whose inputs did not change since the last run")
+    parser.add_argument("--force", type=str, nargs="*", default=[], choices=STAGES, help="Stages to run even if they are up to date")
+    parser.add_argument("--pipelined", action="store_true", help="Overlap the docstring, specification and codebase stages, building each step as soon as its docstrings arrive")
+    add_codebase_arguments(parser)
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    if args.resume and args.work_dir is None:
+        parser.error("`--resume` requires `--work-dir`")
+
+    return args
+
+
+@contextmanager
+def timed_stage(stage: str, wall_times: Dict[str, float]):
+    """
+    Record the wall time of a stage in seconds.
+    """
+    print(f"Running stage `{stage}`...")
+    start_time = time.perf_counter()
+    try:
+        with profile_phase(f"stage-{stage}"):
+            yield
+    finally:
+        wall_times[stage] = round(time.perf_counter() - start_time, 3)
+
+
+def describe_stage(stage: str, args: argparse.Namespace, output_dir: Path) -> StageManifest:
+    """
+    Hash the inputs of a stage: its input files, the options changing its outputs, and the outputs of its upstream stages.
+    """
+    manifest = StageManifest(output_dir / "manifests", stage)
+    # a change of the pipeline code or of its prompts invalidates every stage
+    manifest.add_file("code", Path(sweflow.__file__).parent)
+    if stage == "schedule":
+        manifest.add_file("trace-file", args.trace_file)
+        # the steps predicted to be trivial depend on the sources
+        manifest.add_project("project", args.project_root)
+        if args.selected_tests is not None:
+            manifest.add_file("selected-tests", args.selected_tests)
+    elif stage in ("docstrings", "specifications"):
+        model, data_dir = {
+            "docstrings": (args.docstring_model or args.model, create_docstring.DATA_DIR),
+            "specifications": (args.specification_model or args.model, create_specification.DATA_DIR),
+        }[stage]
+        manifest.add_file("development-schedule", output_dir / "development-schedule.json")
+        manifest.add_project("project", args.project_root)
+        manifest.add_value("model", model)
+        manifest.add_file("prompts", data_dir)
+    elif stage == "codebase":
+        manifest.add_file("development-schedule", output_dir / "development-schedule.json")
+        manifest.add_file("docstrings", output_dir / "docstrings.json")
+        manifest.add_project("project", args.project_root)
+        if args.impacted_pass_to_pass:
+            manifest.add_file("test-impact-index", output_dir / "test-impact-index.json")
+        if args.exclude_from is not None:
+            manifest.add_file("exclude-from", args.exclude_from)
+        manifest.add_value("options", {
+            name: getattr(args, name.replace("-", "_"))
+            for name in (
+                "exclude", "archive-format", "origin-archive", "files-format", "diff-backend", "diff-algorithm",
+                "link-mode", "pass-to-pass-format", "impacted-pass-to-pass",
+            )
+        })
+    else:
+        manifest.add_value("repository", args.repository)
+        manifest.add_file("specifications", output_dir / "specifications.json")
+        for name in CODEBASE_OUTPUTS:
+            manifest.add_file(name, output_dir / f"{name}.json")
+    return manifest
+
+
+def is_up_to_date(args: argparse.Namespace, manifest: Optional[StageManifest]) -> bool:
+    """
+    Whether a stage can be skipped, in which case its manifest is refreshed.
+    """
+    if manifest is None or manifest.stage in args.force or not manifest.is_up_to_date():
+        return False
+    # record the current mtimes of the outputs, so they are not hashed again by the next run
+    manifest.save(list(manifest.previous['outputs']))
+    print(f"Stage `{manifest.stage}` is up to date, reusing its outputs.")
+    return True
+
+
+def codebase_output_files(args: argparse.Namespace, output_dir: Path, outputs: Dict) -> List[Path]:
+    """
+    List the files written by the codebase stage: its JSON outputs, its archives and its blob store.
+    """
+    names = ["skeleton-files", "reference-files", *CODEBASE_OUTPUTS]
+    files = [output_dir / f"{name}.json" for name in names if outputs[name] is not None]
+    files.append(output_dir / f"codebase.{args.archive_format}")
+    origin_format = "zip" if args.archive_format == "bundle" else args.archive_format
+    if (output_dir / f"codebase.origin.{origin_format}").exists():
+        files.append(output_dir / f"codebase.origin.{origin_format}")
+    if args.files_format == "blobs":
+        files += [output_dir / name for name in ("files.pack", "files.index.json", "skeleton-files.manifest.json", "reference-files.manifest.json")]
+    return files
+
+
+def run_pipelined_stages(
+    args: argparse.Namespace,
+    output_dir: Path,
+    cache_dir: Path,
+    artifacts: List[str],
+    development_schedule: List[Dict],
+    test_impact_index: TestImpactIndex,
+    describe: Callable[[str], Optional[StageManifest]],
+    wall_times: Dict[str, float],
+    skipped: Set[str],
+) -> Tuple[Dict, List[Dict], Optional[Dict]]:
+    """
+    Run the docstring, specification and codebase stages together.
+
+    The docstring and specification requests are sent concurrently in step order from a background thread, while
+    the codebase is built step by step, each step waiting for the docstrings of its own nodes only. The wall time
+    of each stage runs from the start of the requests until its last output.
+
+    Returns:
+        The docstrings, the specifications and the outputs of the codebase (`None` if it is up to date).
+    """
+    # asyncio is slow to import, and only needed by the pipelined stages
+    from sweflow.utils.request_stream import RequestStream
+
+    stream = RequestStream()
+
+    docstrings_manifest = describe("docstrings")
+    if is_up_to_date(args, docstrings_manifest):
+        skipped.add("docstrings")
+        docstrings, docstring_batch = json_io.load(output_dir / "docstrings.json"), None
+        indices_of_step = {}
+    else:
+        docstring_samples = create_docstring.prepare_samples(args.project_root, development_schedule)
+        model = args.docstring_model or args.model
+        docstring_client = create_docstring.create_client(
+            args.base_url, args.api_key, args.docstring_max_qpm, args.max_retries, str(cache_dir / "docstrings.jsonl"),
+        )
+        docstring_requests = [create_docstring.request_collate(sample, n_shots=2, model=model) for sample in docstring_samples]
+        docstring_batch = stream.add(docstring_client, docstring_requests)
+        # the requests of the nodes each step develops
+        step_of_node = {}
+        for schedule in development_schedule:
+            for node in schedule['nodes-to-develop']:
+                step_of_node.setdefault(node, schedule['step'])
+        indices_of_step = defaultdict(list)
+        for index, sample in enumerate(docstring_samples):
+            indices_of_step[step_of_node[sample['node-id']]].append(index)
+        # filled in step by step, as the codebase needs them
+        docstrings = {}
+
+    specifications_manifest = describe("specifications")
+    if is_up_to_date(args, specifications_manifest):
+        skipped.add("specifications")
+        specifications, specification_batch = json_io.load(output_dir / "specifications.json"), None
+    else:
+        specification_samples = create_specification.prepare_samples(args.project_root, development_schedule)
+        model = args.specification_model or args.model
+        specification_client = create_specification.create_client(
+            args.base_url, args.api_key, args.specification_max_qpm, args.max_retries, str(cache_dir / "specifications.jsonl"),
+        )
+        specification_requests = [create_specification.request_collate(sample, n_shots=2, model=model) for sample in specification_samples]
+        specification_batch = stream.add(specification_client, specification_requests)
+
+    def wait_for_step(schedule: Dict):
+        indices = indices_of_step.get(schedule['step'], [])
+        if indices:
+            responses = stream.wait(docstring_batch, indices)
+            docstrings.update(create_docstring.collect_docstrings([docstring_samples[index] for index in indices], responses))
+
+    # the wall times of the three stages run from the start of the stream
+    start_time = time.perf_counter()
+    with stream:
+        print("Running stages `docstrings`, `specifications` and `codebase` pipelined...")
+        # the codebase depends on the docstrings, it is only up to date if they were
+        codebase_manifest = describe("codebase") if docstring_batch is None else None
+        if is_up_to_date(args, codebase_manifest):
+            skipped.add("codebase")
+            outputs = None
+        else:
+            args.output_codebase_dir = str(output_dir)
+            args.output_dir = str(output_dir)
+            outputs = create_codebase(
+                args, development_schedule, docstrings, test_impact_index if args.impacted_pass_to_pass else None, wait_for_step,
+            )
+        wall_times["codebase"] = round(time.perf_counter() - start_time, 3)
+
+        if docstring_batch is not None:
+            docstrings = create_docstring.collect_docstrings(docstring_samples, stream.wait(docstring_batch))
+        if specification_batch is not None:
+            specifications = create_specification.collect_specifications(specification_samples, stream.wait(specification_batch))
+
+    for stage, batch in (("docstrings", docstring_batch), ("specifications", specification_batch)):
+        wall_times[stage] = round(stream.wall_time(batch), 3) if batch is not None else 0.0
+
+    # the artifacts are saved in stage order, once the docstrings the codebase manifest depends on are written
+    if docstring_batch is not None:
+        if "docstrings" in artifacts:
+            json_io.dump(docstrings, output_dir / "docstrings.json")
+        if docstrings_manifest is not None:
+            docstrings_manifest.save([output_dir / "docstrings.json"])
+    if specification_batch is not None:
+        if "specifications" in artifacts:
+            json_io.dump(specifications, output_dir / "specifications.json")
+        if specifications_manifest is not None:
+            specifications_manifest.save([output_dir / "specifications.json"])
+    if outputs is not None:
+        if "codebase" in artifacts:
+            save_codebase_outputs(output_dir, outputs, args.pass_to_pass_format)
+        codebase_manifest = describe("codebase")
+        if codebase_manifest is not None:
+            codebase_manifest.save(codebase_output_files(args, output_dir, outputs))
+
+    return docstrings, specifications, outputs
+
+
+def run_pipeline(args: argparse.Namespace) -> Dict:
+    """
+    Run every stage of the pipeline and write the dataset to `<output-dir>/dataset.jsonl`.
+
+    Returns:
+        The statistics of the run, with the wall time of each stage.
+    """
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = Path(args.cache_dir) if args.cache_dir is not None else output_dir / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # the outputs of skipped stages are loaded back from their artifacts
+    artifacts = ARTIFACT_STAGES if args.incremental else args.artifacts
+
+    wall_times, skipped = {}, set()
+    start_time = time.perf_counter()
+
+    def describe(stage: str) -> Optional[StageManifest]:
+        return describe_stage(stage, args, output_dir) if args.incremental else None
+
+    with timed_stage("schedule", wall_times):
+        manifest = describe("schedule")
+        if is_up_to_date(args, manifest):
+            skipped.add("schedule")
+            development_schedule = json_io.load(output_dir / "development-schedule.json")
+            test_impact_index = TestImpactIndex.load(output_dir / "test-impact-index.json")
+        else:
+            selected_tests = None
+            if args.selected_tests is not None:
+                selected_tests = json_io.load(args.selected_tests)
+            development_schedule, dependency_graphs, test_impact_index = create_development_schedule(args.trace_file, selected_tests, args.project_root)
+            if "schedule" in artifacts:
+                save_development_schedule(output_dir, development_schedule, dependency_graphs, test_impact_index)
+            if manifest is not None:
+                manifest.save([output_dir / name for name in SCHEDULE_OUTPUTS])
+
+    if args.pipelined:
+        docstrings, specifications, outputs = run_pipelined_stages(
+            args, output_dir, cache_dir, artifacts, development_schedule, test_impact_index, describe, wall_times, skipped,
+        )
+    else:
+        with timed_stage("docstrings", wall_times):
+            manifest = describe("docstrings")
+            if is_up_to_date(args, manifest):
+                skipped.add("docstrings")
+                docstrings = json_io.load(output_dir / "docstrings.json")
+            else:
+                docstrings = generate_docstrings(
+                    args.project_root,
+                    development_schedule,
+                    base_url=args.base_url,
+                    api_key=args.api_key,
+                    model=args.docstring_model or args.model,
+                    max_qpm=args.docstring_max_qpm,
+                    max_retries=args.max_retries,
+                    cache_file=str(cache_dir / "docstrings.jsonl"),
+                )
+                if "docstrings" in artifacts:
+                    json_io.dump(docstrings, output_dir / "docstrings.json")
+                if manifest is not None:
+                    manifest.save([output_dir / "docstrings.json"])
+
+        with timed_stage("specifications", wall_times):
+            manifest = describe("specifications")
+            if is_up_to_date(args, manifest):
+                skipped.add("specifications")
+                specifications = json_io.load(output_dir / "specifications.json")
+            else:
+                specifications = generate_specifications(
+                    args.project_root,
+                    development_schedule,
+                    base_url=args.base_url,
+                    api_key=args.api_key,
+                    model=args.specification_model or args.model,
+                    max_qpm=args.specification_max_qpm,
+                    max_retries=args.max_retries,
+                    cache_file=str(cache_dir / "specifications.jsonl"),
+                )
+                if "specifications" in artifacts:
+                    json_io.dump(specifications, output_dir / "specifications.json")
+                if manifest is not None:
+                    manifest.save([output_dir / "specifications.json"])
+
+        with timed_stage("codebase", wall_times):
+            manifest = describe("codebase")
+            if is_up_to_date(args, manifest):
+                skipped.add("codebase")
+                outputs = None
+            else:
+                # the codebase archives and the blob store go to the output directory
+                args.output_codebase_dir = str(output_dir)
+                args.output_dir = str(output_dir)
+                outputs = create_codebase(args, development_schedule, docstrings, test_impact_index if args.impacted_pass_to_pass else None)
+                if "codebase" in artifacts:
+                    save_codebase_outputs(output_dir, outputs, args.pass_to_pass_format)
+                if manifest is not None:
+                    manifest.save(codebase_output_files(args, output_dir, outputs))
+
+    with timed_stage("merge", wall_times):
+        manifest = describe("merge")
+        if (output_dir / "run-stats.json").exists() and is_up_to_date(args, manifest):
+            skipped.add("merge")
+            # the instance counts of the previous run still hold
+            previous_stats = json_io.load(output_dir / "run-stats.json")
+            merge_stats = {key: previous_stats[key] for key in ("steps", "instances", "flagged-out")}
+        else:
+            merge_stats = {}
+            if outputs is not None:
+                outputs["specifications"] = specifications
+                instances = build_instances(args.repository, outputs, merge_stats)
+            else:
+                # the codebase is up to date, its outputs are read back from its artifacts
+                instances = iter_instances(args.repository, str(output_dir), merge_stats)
+            with open(output_dir / "dataset.jsonl", "w", encoding="utf-8") as f:
+                for item in instances:
+                    f.write(json_io.dumps(item, pretty=False) + "\n")
+            if manifest is not None:
+                manifest.save([output_dir / "dataset.jsonl"])
+
+    # the LLM requests not sent for the steps predicted to be trivial
+    trivial_schedule = [schedule for schedule in development_schedule if schedule.get('predicted-trivial', False)]
+    llm_requests_avoided = len(collect_nodes(trivial_schedule, key='nodes-to-develop')) \
+        + sum(bool(schedule['target-test-nodes']) for schedule in trivial_schedule)
+
+    stats = {
+        "repository": args.repository,
+        **merge_stats,
+        "predicted-trivial-steps": len(trivial_schedule),
+        "llm-requests-avoided": llm_requests_avoided,
+        # the pipelined stages overlap, so their wall times do not add up
+        "wall-time": round(time.perf_counter() - start_time, 3),
+        "pipelined": args.pipelined,
+        "stages": [{"stage": stage, "wall-time": wall_times[stage], "skipped": stage in skipped} for stage in STAGES],
+    }
+    json_io.dump(stats, output_dir / "run-stats.json", pretty=True)
+
+    return stats
+
+
+def print_stats(stats: Dict):
+    """
+    Print the wall time of each stage.
+    """
+    for item in stats["stages"]:
+        print(f"{item['stage']:>16}: {item['wall-time']:.3f}s" + (" (up to date)" if item['skipped'] else ""))
+    print(f"{'total':>16}: {stats['wall-time']:.3f}s")
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-run")
+    json_io.configure_json(args)
+
+    stats = run_pipeline(args)
+
+    print(f"Created {stats['instances']} instances of `{stats['repository']}` in `{args.output_dir}`.")
+    print(f"Skipped {stats['predicted-trivial-steps']} predicted-trivial steps, avoiding {stats['llm-requests-avoided']} LLM requests.")
+    print_stats(stats)
+
+
+if __name__ == "__main__":
+
+    main()
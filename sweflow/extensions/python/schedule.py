@@ -1,10 +1,9 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator, Optional
 from collections import defaultdict
 from pathlib import Path
 
+import ast
 import argparse
-import networkx as nx
-import json
 
 from sweflow.extensions.python.rdg import (
     RuntimeDependencyGraph,
@@ -15,32 +14,55 @@ from sweflow.extensions.python.rdg import (
     get_target_core_nodes,
     get_dependent_core_nodes,
 )
+from sweflow.extensions.python.helper import read_file_from_project
+from sweflow.extensions.python.helper.code_utils import estimate_patch_lines
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profile_phase, profiled, count
 from sweflow.utils.progress import create_progress
+from sweflow.utils.test_impact import TestImpactIndex
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate development plan for a Python project')
-    parser.add_argument('-t', '--trace-file', type=str, help='Path to the pytest trace file')
+    parser.add_argument('-t', '--trace-file', type=str, help='Path to the pytest trace file, or a directory of trace shards')
     parser.add_argument('-o', '--output-dir', type=str, help='Output directory to save the development plans')
+    parser.add_argument('--selected-tests', type=str, default=None, help='Path to a JSON list of test ids, only these tests are scheduled')
+    parser.add_argument('--project-root', type=str, default=None, help='Path to the repository, to mark the steps whose reference patch is predicted to be empty')
+    json_io.add_json_arguments(parser)
+    add_profile_arguments(parser)
     return parser.parse_args()
 
 
+def iter_traces(trace_file: str) -> Iterator[Dict]:
+    """
+    Stream the traces from a JSON file holding a list of traces, or from a directory of JSONL trace shards
+    (`traces-*.jsonl`, as written by `sweflow.extensions.python.tracer`).
+    """
+    trace_path = Path(trace_file)
+    if trace_path.is_dir():
+        for shard in sorted(trace_path.glob("traces-*.jsonl")):
+            with open(shard, "r") as f:
+                yield from (json_io.loads(line) for line in f)
+        return
+    yield from json_io.iter_array(trace_path)
+
+
 def collect_rdg_info(trace_file: str) -> List[Dict]:
     """
     Collect the information of the runtime dependency graphs.
 
     Args:
-        trace_file: Path to the pytest trace file (json format)
+        trace_file: Path to the pytest trace file (json format), or to a directory of JSONL trace shards
 
     Returns:
         List of dictionaries containing the information of the runtime dependency graphs
     """
-    traces = json.load(open(trace_file))
-
     rdg_info = []
-    with create_progress() as progress:
-        task = progress.add_task(f"[cyan]Collecting runtime dependency graphs...", total=len(traces))
-        for trace in traces:
+    # the traces are streamed, so only their graphs are held in memory
+    with profile_phase('rdg-building'), create_progress() as progress:
+        task = progress.add_task(f"[cyan]Collecting runtime dependency graphs...", total=None)
+        for trace in iter_traces(trace_file):
+            count('traces')
             progress.update(task, advance=1)
             rdg = RuntimeDependencyGraph(trace)
             if trace['test-func-id'] not in rdg.graph:
@@ -51,19 +73,34 @@ def collect_rdg_info(trace_file: str) -> List[Dict]:
                 'root-node': trace['test-func-id'],
                 'runtime-dependency-graph': rdg,
             })
+    count('runtime-dependency-graphs', len(rdg_info))
 
     return rdg_info
 
 
+@profiled('test-impact-index')
+def build_test_impact_index(rdg_info: List[Dict]) -> TestImpactIndex:
+    """
+    Build the inverted index from core node to covering tests from the runtime dependency graph of each test.
+    """
+    covered_nodes = defaultdict(set)
+    for info in rdg_info:
+        covered_nodes[info['test-id']].update(get_core_nodes(info['runtime-dependency-graph']))
+    return TestImpactIndex.build(covered_nodes)
+
+
 def merge_runtime_dependency_graphs(rdgs: List[RuntimeDependencyGraph]) -> RuntimeDependencyGraph:
     """
     Merge multiple runtime dependency graphs.
     """
+    import networkx as nx
+
     merged_rdg = RuntimeDependencyGraph()
     merged_rdg.graph = nx.compose_all([rdg.graph for rdg in rdgs])
     return merged_rdg
 
 
+@profiled('grouping')
 def prepare_schedule_info(rdg_info: List[Dict]) -> List[Dict]:
     """
     Prepare the schedule info from the rdg info.
@@ -121,10 +158,13 @@ def prepare_schedule_info(rdg_info: List[Dict]) -> List[Dict]:
     return schedule_info
 
 
+@profiled('scheduling')
 def generate_development_schedule(schedule_info: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
     """
     Generate the development schedule from the schedule info.
     """
+    import networkx as nx
+
     schedules, dependency_graphs = [], []
     for info in schedule_info:
         schedules.append({
@@ -162,12 +202,68 @@ def generate_development_schedule(schedule_info: List[Dict]) -> Tuple[List[Dict]
     return development_schedule, development_dependency_graphs
 
 
-def main():
+@profiled('trivial-prediction')
+def predict_trivial_steps(project_root: str, development_schedule: List[Dict]) -> int:
+    """
+    Estimate the size of the reference patch of each step from the AST spans of its nodes to develop, and mark the
+    steps whose patch is predicted to be empty as `predicted-trivial`.
 
-    args = parse_args()
+    Any non-empty patch has more tokens than the threshold of `create_codebase` with its file headers alone, so
+    the predicted-trivial steps are the ones it would flag out. Steps whose files cannot be read or parsed are
+    not predicted trivial.
+
+    Returns:
+        The number of predicted-trivial steps
+    """
+    trees: Dict[str, Optional[ast.Module]] = {}
+    for schedule in development_schedule:
+        nodes_to_develop = set(schedule['nodes-to-develop'])
+        target_core_nodes = [node for node in schedule['target-core-nodes'] if node in nodes_to_develop]
+        dependent_core_nodes = [node for node in schedule['dependent-core-nodes'] if node in nodes_to_develop]
+
+        patch_lines = 0
+        for filepath in sorted({node.split(':')[0] for node in target_core_nodes + dependent_core_nodes}):
+            # each file is parsed once for all steps
+            if filepath not in trees:
+                try:
+                    trees[filepath] = ast.parse(read_file_from_project(project_root, filepath))
+                except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+                    trees[filepath] = None
+            if trees[filepath] is None:
+                patch_lines = None
+                break
+            patch_lines += estimate_patch_lines(trees[filepath], filepath, target_core_nodes, dependent_core_nodes)
+
+        schedule['predicted-patch-lines'] = patch_lines
+        schedule['predicted-trivial'] = patch_lines == 0
+
+    num_trivial_steps = sum(schedule['predicted-trivial'] for schedule in development_schedule)
+    count('predicted-trivial-steps', num_trivial_steps)
+    return num_trivial_steps
+
+
+def create_development_schedule(trace_file: str, selected_tests: List[str] = None, project_root: str = None) -> Tuple[List[Dict], List[Dict], TestImpactIndex]:
+    """
+    Create the development schedule of a project from its test traces.
+
+    Args:
+        trace_file: Path to the pytest trace file (json format), or to a directory of JSONL trace shards
+        selected_tests: If given, only these tests are scheduled
+        project_root: If given, the steps predicted to have an empty reference patch are marked `predicted-trivial`
 
+    Returns:
+        The development schedule, the dependency graph of each step and the test impact index
+    """
     # collect the rdg info
-    rdg_info = collect_rdg_info(args.trace_file)
+    rdg_info = collect_rdg_info(trace_file)
+
+    # keep the selected tests only
+    if selected_tests is not None:
+        selected_tests = set(selected_tests)
+        rdg_info = [info for info in rdg_info if info['test-id'] in selected_tests]
+
+    # index the tests covering each core node
+    test_impact_index = build_test_impact_index(rdg_info)
 
     # prepare the schedule info
     schedule_info = prepare_schedule_info(rdg_info)
@@ -177,13 +273,42 @@ def main():
 
     # generate the development schedule
     development_schedule, dependency_graphs = generate_development_schedule(schedule_info)
+    count('steps', len(development_schedule))
 
-    print(f"Created {len(development_schedule)} development schedule.")
-    with open(Path(args.output_dir) / 'development-schedule.json', 'w') as f:
-        json.dump(development_schedule, f, indent=4)
+    # mark the steps whose reference patch is predicted to be empty
+    if project_root is not None:
+        num_trivial_steps = predict_trivial_steps(project_root, development_schedule)
+        print(f"Predicted {num_trivial_steps} trivial steps out of {len(development_schedule)}.")
+
+    return development_schedule, dependency_graphs, test_impact_index
+
+
+@profiled('saving')
+def save_development_schedule(output_dir: str, development_schedule: List[Dict], dependency_graphs: List[Dict], test_impact_index: TestImpactIndex):
+    """
+    Save the development schedule, the dependency graphs and the test impact index.
+    """
+    json_io.dump(development_schedule, Path(output_dir) / 'development-schedule.json')
 
-    with open(Path(args.output_dir) / 'dependency-graphs.json', 'w') as f:
-        json.dump(dependency_graphs, f, indent=4)
+    json_io.dump_array(dependency_graphs, Path(output_dir) / 'dependency-graphs.json')
+
+    test_impact_index.dump(Path(output_dir) / 'test-impact-index.json')
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, 'sweflow-schedule-python')
+    json_io.configure_json(args)
+
+    selected_tests = None
+    if args.selected_tests is not None:
+        selected_tests = json_io.load(args.selected_tests)
+
+    development_schedule, dependency_graphs, test_impact_index = create_development_schedule(args.trace_file, selected_tests, args.project_root)
+
+    print(f"Created {len(development_schedule)} development schedule.")
+    save_development_schedule(args.output_dir, development_schedule, dependency_graphs, test_impact_index)
 
     print(f"Development schedule and dependency graphs are saved to {args.output_dir}.")
 
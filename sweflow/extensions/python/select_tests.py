@@ -0,0 +1,121 @@
+from typing import Dict, List
+from pathlib import Path
+
+import heapq
+import argparse
+
+from sweflow.extensions.python.rdg import get_core_nodes
+from sweflow.extensions.python.schedule import collect_rdg_info
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Select a subset of tests that preserves the core node coverage of the full suite')
+    parser.add_argument('-t', '--trace-file', type=str, required=True, help='Path to the pytest trace file, or a directory of trace shards, from a cheap or earlier run')
+    parser.add_argument('-o', '--output-dir', type=str, required=True, help='Output directory to save the selected tests and the report')
+    parser.add_argument('--max-tests', type=int, default=None, help='Maximum number of selected tests')
+    parser.add_argument('--signature-weight', type=float, default=1.0, help='Gain of a test whose core node signature is not selected yet, in covered nodes')
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+@profiled('selection')
+def select_tests(covered_nodes: Dict[str, frozenset], max_tests: int = None, signature_weight: float = 1.0) -> List[str]:
+    """
+    Greedily select tests maximizing the distinct core nodes they cover and the diversity of their signatures.
+
+    The gain of a test is the number of core nodes it covers that no selected test covers, plus `signature_weight`
+    if no selected test has the same set of core nodes (which `prepare_schedule_info` would merge into one step).
+    Gains only shrink as tests are selected, so they are re-evaluated lazily: a test is selected when its refreshed
+    gain still beats the best stale gain. Tests without any gain left are never selected.
+
+    Args:
+        covered_nodes: The core nodes covered by each test, in the order of the suite.
+        max_tests: The budget of selected tests, unlimited if None.
+        signature_weight: The gain of a new signature.
+
+    Returns:
+        The selected test ids, in selection order.
+    """
+    covered, signatures = set(), set()
+
+    def gain(test_id: str) -> float:
+        nodes = covered_nodes[test_id]
+        return len(nodes - covered) + (signature_weight if nodes not in signatures else 0.0)
+
+    # ties are broken by the order of the suite
+    heap = [(-gain(test_id), position, test_id) for position, test_id in enumerate(covered_nodes)]
+    heapq.heapify(heap)
+
+    selected = []
+    while heap and (max_tests is None or len(selected) < max_tests):
+        _, position, test_id = heapq.heappop(heap)
+        current_gain = gain(test_id)
+        if current_gain <= 0:
+            continue
+        if heap and current_gain < -heap[0][0]:
+            heapq.heappush(heap, (-current_gain, position, test_id))
+            continue
+        selected.append(test_id)
+        covered.update(covered_nodes[test_id])
+        signatures.add(covered_nodes[test_id])
+
+    return selected
+
+
+def coverage_report(covered_nodes: Dict[str, frozenset], selected: List[str]) -> Dict:
+    """
+    Report the core nodes and signatures retained by the selected tests.
+    """
+    all_nodes = set().union(*covered_nodes.values()) if covered_nodes else set()
+    selected_nodes = set().union(*(covered_nodes[test_id] for test_id in selected)) if selected else set()
+    all_signatures = set(covered_nodes.values())
+    selected_signatures = {covered_nodes[test_id] for test_id in selected}
+    return {
+        "tests": len(covered_nodes),
+        "selected-tests": len(selected),
+        "core-nodes": len(all_nodes),
+        "covered-core-nodes": len(selected_nodes),
+        "core-node-coverage": len(selected_nodes) / len(all_nodes) if all_nodes else 1.0,
+        "signatures": len(all_signatures),
+        "selected-signatures": len(selected_signatures),
+        "uncovered-core-nodes": sorted(all_nodes - selected_nodes),
+    }
+
+
+@profiled('coverage-collection')
+def collect_covered_nodes(trace_file: str) -> Dict[str, frozenset]:
+    """
+    Collect the core nodes covered by each test with a runtime dependency graph.
+    """
+    covered_nodes = {}
+    for info in collect_rdg_info(trace_file):
+        covered_nodes[info['test-id']] = covered_nodes.get(info['test-id'], frozenset()) | frozenset(get_core_nodes(info['runtime-dependency-graph']))
+    return covered_nodes
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, 'sweflow-select-tests-python')
+
+    covered_nodes = collect_covered_nodes(args.trace_file)
+
+    selected = select_tests(covered_nodes, args.max_tests, args.signature_weight)
+    report = coverage_report(covered_nodes, selected)
+
+    # keep the order of the suite
+    selected_ids = set(selected)
+    selected = [test_id for test_id in covered_nodes if test_id in selected_ids]
+
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    json_io.dump(selected, Path(args.output_dir) / 'selected-tests.json', pretty=True)
+    json_io.dump(report, Path(args.output_dir) / 'selection-report.json', pretty=True)
+
+    print(f"Selected {report['selected-tests']} of {report['tests']} tests, covering {report['covered-core-nodes']} of {report['core-nodes']} core nodes and {report['selected-signatures']} of {report['signatures']} signatures.")
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,258 @@
+"""
+Trace the call relations of every test of a project, as consumed by `schedule.collect_rdg_info`.
+
+The tracer is a pytest plugin (`-p sweflow.extensions.python.tracer`). On Python 3.12+ it listens to the
+`PY_START` events of `sys.monitoring` (PEP 669) and disables them for every code object outside the project,
+so that library code runs at full speed after its first call. Older interpreters fall back to `sys.setprofile`.
+"""
+from typing import Dict, Optional, Set, Tuple
+from pathlib import Path
+from types import CodeType
+
+import os
+import sys
+import inspect
+import time
+import argparse
+import subprocess
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profile_phase
+
+TRACE_SHARD_PATTERN = "traces-*.jsonl"
+# `sys.monitoring` tool ids tried in order: the one of profilers, then the ones without a predefined use
+MONITORING_TOOL_IDS = (2, 3, 4)
+EXCLUDED_DIR_NAMES = ("site-packages", "dist-packages", ".venv", "venv", ".tox", ".nox")
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Trace the call relations of the tests of a Python project")
+
+    parser.add_argument("--project-root", type=str, required=True, help="Path to the project, the tests run from there")
+    parser.add_argument("--output-dir", type=str, required=True, help="Path to the output directory of the trace shards")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Number of traced tests per shard")
+    parser.add_argument("--python", type=str, default=sys.executable, help="Python interpreter of the project")
+    parser.add_argument("--test-ids-file", type=str, default=None, help="Path to a JSON list of test ids (e.g. `selected-tests.json`), only these tests are run")
+    parser.add_argument("--measure-overhead", action="store_true", help="Also run the tests untraced and report the tracing overhead")
+    parser.add_argument("pytest_args", nargs="*", help="Extra pytest arguments (after `--`)")
+    add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("sweflow-trace")
+    group.addoption("--sweflow-trace-dir", default=None, help="Write the call relations of every test to JSONL shards in this directory")
+    group.addoption("--sweflow-trace-shard-size", type=int, default=1000, help="Number of traced tests per shard")
+    group.addoption("--sweflow-test-ids", default=None, help="Path to a JSON list of test ids, the other tests are deselected")
+
+
+def pytest_collection_modifyitems(config, items):
+    test_ids_file = config.getoption("--sweflow-test-ids")
+    if test_ids_file is None:
+        return
+    test_ids = set(json_io.load(test_ids_file))
+    deselected = [item for item in items if item.nodeid not in test_ids]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if item.nodeid in test_ids]
+
+
+def pytest_configure(config):
+    trace_dir = config.getoption("--sweflow-trace-dir")
+    if trace_dir is not None:
+        config.pluginmanager.register(
+            TestTracer(str(config.rootpath), trace_dir, config.getoption("--sweflow-trace-shard-size")),
+            "sweflow-test-tracer",
+        )
+
+
+class TestTracer:
+    """
+    Record the caller and callee pairs of project functions for each test, and stream them to JSONL shards.
+
+    A node is a project function identified by its path relative to the project root, its first line (that of its
+    first decorator, as `co_firstlineno`) and its name. The caller of a call is the innermost project function on
+    the stack, so calls through library code are attributed to the project function that made them.
+    """
+
+    __test__ = False  # not a pytest test class
+
+    def __init__(self, project_root: str, trace_dir: str, shard_size: int = 1000):
+        self.project_root = os.path.realpath(project_root)
+        self.trace_dir = Path(trace_dir)
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.shard, self.shard_index, self.shard_count = None, 0, 0
+        # node of each code object, None outside the project
+        self.nodes: Dict[CodeType, Optional[Tuple[str, int, str]]] = {}
+        self.relations: Set[Tuple[CodeType, CodeType]] = set()
+        self.tracing = False
+        self.items = {}
+        self.use_monitoring = hasattr(sys, "monitoring")
+        if self.use_monitoring:
+            self.tool_id = self._claim_tool_id()
+            sys.monitoring.register_callback(self.tool_id, sys.monitoring.events.PY_START, self._on_start)
+
+    @staticmethod
+    def _claim_tool_id() -> int:
+        """
+        Claim the first `sys.monitoring` tool id not used by another tool, e.g. coverage or a profiler.
+        """
+        for tool_id in MONITORING_TOOL_IDS:
+            if sys.monitoring.get_tool(tool_id) is None:
+                sys.monitoring.use_tool_id(tool_id, "sweflow-tracer")
+                return tool_id
+        import pytest
+
+        tools = ", ".join(f"{tool_id}: {sys.monitoring.get_tool(tool_id)}" for tool_id in MONITORING_TOOL_IDS)
+        raise pytest.UsageError(f"No `sys.monitoring` tool id is free for the test tracer ({tools}), run the tests without the other tools")
+
+    def _node(self, code: CodeType) -> Optional[Tuple[str, int, str]]:
+        if code in self.nodes:
+            return self.nodes[code]
+        node = None
+        filename = os.path.realpath(code.co_filename) if not code.co_filename.startswith("<") else ""
+        if filename.startswith(self.project_root + os.sep) and not code.co_name.startswith("<"):
+            relpath = os.path.relpath(filename, self.project_root)
+            if not any(part in EXCLUDED_DIR_NAMES for part in Path(relpath).parts):
+                node = (relpath, code.co_firstlineno, code.co_name)
+        self.nodes[code] = node
+        return node
+
+    def _record(self, frame, code: CodeType):
+        # attribute the call to the innermost project function on the stack
+        caller = frame.f_back
+        while caller is not None and self._node(caller.f_code) is None:
+            caller = caller.f_back
+        if caller is not None:
+            self.relations.add((caller.f_code, code))
+
+    def _on_start(self, code: CodeType, instruction_offset: int):
+        if self._node(code) is None:
+            return sys.monitoring.DISABLE
+        if self.tracing:
+            self._record(sys._getframe(1), code)
+
+    def _on_profile(self, frame, event: str, arg):
+        if event == "call" and self._node(frame.f_code) is not None:
+            self._record(frame, frame.f_code)
+
+    def start(self):
+        self.relations = set()
+        self.tracing = True
+        if self.use_monitoring:
+            sys.monitoring.set_events(self.tool_id, sys.monitoring.events.PY_START)
+        else:
+            sys.setprofile(self._on_profile)
+
+    def stop(self):
+        self.tracing = False
+        if self.use_monitoring:
+            sys.monitoring.set_events(self.tool_id, 0)
+        else:
+            sys.setprofile(None)
+
+    def _write(self, trace: Dict):
+        if self.shard is None:
+            self.shard = open(self.trace_dir / f"traces-{os.getpid()}-{self.shard_index:05d}.jsonl", "w")
+        self.shard.write(json_io.dumps(trace, pretty=False) + "\n")
+        self.shard_count += 1
+        if self.shard_count == self.shard_size:
+            self.shard.close()
+            self.shard, self.shard_index, self.shard_count = None, self.shard_index + 1, 0
+
+    def pytest_collection_finish(self, session):
+        self.items = {item.nodeid: item for item in session.items}
+
+    # a test is traced from the start of its setup to the end of its teardown
+    def pytest_runtest_logstart(self, nodeid, location):
+        self.start()
+
+    def pytest_runtest_logfinish(self, nodeid, location):
+        self.stop()
+
+        item = self.items.get(nodeid)
+        if item is None:
+            return
+        function = getattr(getattr(item, "obj", None), "__func__", getattr(item, "obj", None))
+        # decorated tests (e.g. with `mock.patch`) keep the test function in `__wrapped__`
+        function = inspect.unwrap(function) if function is not None else None
+        test_code = getattr(function, "__code__", None)
+        test_node = self._node(test_code) if test_code is not None else None
+        if test_node is None:
+            return
+        call_relations = []
+        for caller, callee in self.relations:
+            (caller_path, caller_lineno, caller_name), (callee_path, callee_lineno, callee_name) = self.nodes[caller], self.nodes[callee]
+            call_relations.append({
+                "caller": {"filepath": caller_path, "lineno": caller_lineno, "func_name": caller_name},
+                "callee": {"filepath": callee_path, "lineno": callee_lineno, "func_name": callee_name},
+            })
+        call_relations.sort(key=lambda relation: (tuple(relation['caller'].values()), tuple(relation['callee'].values())))
+        self._write({
+            "test-id": item.nodeid,
+            "test-func-id": ":".join(str(part) for part in test_node),
+            "call-relations": call_relations,
+        })
+
+    def pytest_unconfigure(self, config):
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+        if self.use_monitoring:
+            sys.monitoring.register_callback(self.tool_id, sys.monitoring.events.PY_START, None)
+            sys.monitoring.free_tool_id(self.tool_id)
+
+
+def run_pytest(python: str, project_root: str, pytest_args: list) -> float:
+    """
+    Run pytest in the project and return its wall time in seconds.
+    """
+    start_time = time.perf_counter()
+    subprocess.run([python, "-m", "pytest", "-q", "-p", "no:cacheprovider", *pytest_args], cwd=project_root)
+    return time.perf_counter() - start_time
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-trace-tests-python")
+
+    output_dir = Path(args.output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for shard in output_dir.glob(TRACE_SHARD_PATTERN):
+        shard.unlink()
+
+    # the plugin only traces with `--sweflow-trace-dir`, so the untraced run loads it too
+    pytest_args = ["-p", "sweflow.extensions.python.tracer"]
+    if args.test_ids_file is not None:
+        pytest_args.append(f"--sweflow-test-ids={Path(args.test_ids_file).resolve()}")
+    pytest_args += args.pytest_args
+
+    stats = {}
+    if args.measure_overhead:
+        with profile_phase("untraced-run"):
+            stats["untraced-wall-time"] = round(run_pytest(args.python, args.project_root, pytest_args), 3)
+
+    trace_args = [f"--sweflow-trace-dir={output_dir}", f"--sweflow-trace-shard-size={args.shard_size}"]
+    with profile_phase("traced-run"):
+        stats["traced-wall-time"] = round(run_pytest(args.python, args.project_root, pytest_args + trace_args), 3)
+    if args.measure_overhead:
+        stats["overhead"] = round(stats["traced-wall-time"] / stats["untraced-wall-time"], 3) if stats["untraced-wall-time"] > 0 else None
+
+    stats["tests"], stats["call-relations"] = 0, 0
+    for shard in output_dir.glob(TRACE_SHARD_PATTERN):
+        with open(shard, "r") as f:
+            for line in f:
+                stats["tests"] += 1
+                stats["call-relations"] += len(json_io.loads(line)['call-relations'])
+    json_io.dump(stats, output_dir / "trace-stats.json", pretty=True)
+
+    print(f"Traced {stats['tests']} tests into `{output_dir}`.")
+
+
+if __name__ == "__main__":
+
+    main()
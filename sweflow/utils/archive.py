@@ -0,0 +1,101 @@
+from typing import IO, List
+from pathlib import Path
+
+import os
+import shutil
+import subprocess
+import tarfile
+
+from sweflow.utils.profiling import profiled
+
+ARCHIVE_FORMATS = ("zip", "tar.gz", "tar.zst", "bundle")
+
+
+def _write_tar(source_dir: str, fileobj: IO[bytes]):
+    """
+    Stream an uncompressed tar of the source directory into a file object.
+    """
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for name in sorted(os.listdir(source_dir)):
+            tar.add(Path(source_dir) / name, arcname=name)
+
+
+def _pipe_tar(source_dir: str, output_file: Path, command: List[str]):
+    """
+    Stream a tar of the source directory through an external compressor writing to the output file.
+    """
+    with open(output_file, "wb") as f:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f)
+        try:
+            _write_tar(source_dir, process.stdin)
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"`{' '.join(command)}` exited with code {returncode}")
+
+
+def _archive_tar_gz(source_dir: str, output_file: Path, threads: int):
+    """
+    Create a gzip-compressed tarball, compressed in parallel with `pigz` when it is installed.
+    """
+    if shutil.which("pigz"):
+        _pipe_tar(source_dir, output_file, ["pigz", "-p", str(threads), "-c"])
+        return
+    with tarfile.open(output_file, mode="w:gz") as tar:
+        for name in sorted(os.listdir(source_dir)):
+            tar.add(Path(source_dir) / name, arcname=name)
+
+
+def _archive_tar_zst(source_dir: str, output_file: Path, threads: int):
+    """
+    Create a zstd-compressed tarball with the multi-threaded `zstd` CLI or the `zstandard` package.
+    """
+    if shutil.which("zstd"):
+        _pipe_tar(source_dir, output_file, ["zstd", f"-T{threads}", "-q", "-c"])
+        return
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("`tar.zst` archives require the `zstd` CLI or the `zstandard` package")
+    compressor = zstandard.ZstdCompressor(threads=threads)
+    with open(output_file, "wb") as f, compressor.stream_writer(f) as writer:
+        _write_tar(source_dir, writer)
+
+
+def _archive_bundle(source_dir: str, output_file: Path):
+    """
+    Create a git bundle with every ref of the repository in the source directory.
+    """
+    subprocess.run(["git", "bundle", "create", str(output_file.resolve()), "--all"], cwd=source_dir, check=True, capture_output=True)
+
+
+@profiled("archive-creation")
+def archive_directory(source_dir: str, output_base: str, archive_format: str = "zip", threads: int = None) -> Path:
+    """
+    Archive a directory.
+
+    Args:
+        source_dir: The directory to archive.
+        output_base: The output path without extension, the extension of the format is appended.
+        archive_format: One of `zip`, `tar.gz`, `tar.zst` or `bundle` (a git repository is required).
+        threads: Number of compression threads for `tar.gz` and `tar.zst`, defaults to the number of CPUs.
+    Returns:
+        The path to the created archive.
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Invalid archive format: {archive_format}")
+    threads = threads or os.cpu_count() or 1
+
+    output_file = Path(f"{output_base}.{archive_format}")
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if archive_format == "zip":
+        shutil.make_archive(output_base, "zip", source_dir)
+    elif archive_format == "tar.gz":
+        _archive_tar_gz(source_dir, output_file, threads)
+    elif archive_format == "tar.zst":
+        _archive_tar_zst(source_dir, output_file, threads)
+    else:
+        _archive_bundle(source_dir, output_file)
+
+    return output_file
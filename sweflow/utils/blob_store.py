@@ -0,0 +1,140 @@
+from typing import Dict, List, Iterator
+from pathlib import Path
+from functools import lru_cache
+
+import hashlib
+import mmap
+import zlib
+
+from sweflow.utils import json_io
+
+
+class BlobStoreWriter:
+    """
+    Write per-step file contents as a deduplicated, content-addressed blob store.
+
+    Every unique content is stored once, zlib-compressed, in `<name>.pack` and located through
+    `<name>.index.json`. Each kind of output (e.g. `skeleton-files`) gets a `<kind>.manifest.json`
+    holding, for every step, a mapping of `filepath -> hash`.
+    """
+
+    def __init__(self, output_dir: str, name: str = "files"):
+        """
+        Initialize the writer.
+
+        :param output_dir: The directory to write the store to.
+        :param name: The name of the pack and index files.
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.pack = open(self.output_dir / f"{name}.pack", "wb")
+        self.offset = 0
+        self.blobs = {}
+        self.manifests = {}
+
+    def put(self, content: str) -> str:
+        """
+        Store a content if it is not stored yet and return its hash.
+        """
+        data = content.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self.blobs:
+            compressed = zlib.compress(data)
+            self.pack.write(compressed)
+            self.blobs[digest] = [self.offset, len(compressed)]
+            self.offset += len(compressed)
+        return digest
+
+    def add_step(self, kind: str, step: int, files: List[Dict[str, str]]):
+        """
+        Store the files of a step and record them in the manifest of the given kind.
+
+        :param kind: The kind of output, e.g. `skeleton-files` or `reference-files`.
+        :param step: The step of the files.
+        :param files: List of dictionaries with keys 'filepath' and 'content'.
+        """
+        manifest = {file['filepath']: self.put(file['content']) for file in files}
+        self.manifests.setdefault(kind, []).append({"step": step, kind: manifest})
+
+    def close(self):
+        """
+        Flush the pack and write the index and manifests.
+        """
+        self.pack.close()
+        json_io.dump({"pack": f"{self.name}.pack", "hash": "sha1", "compression": "zlib", "blobs": self.blobs}, self.output_dir / f"{self.name}.index.json")
+        for kind, manifest in self.manifests.items():
+            json_io.dump({"index": f"{self.name}.index.json", "steps": manifest}, self.output_dir / f"{kind}.manifest.json")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BlobStoreReader:
+    """
+    Read step contents back from a blob store, decompressing each blob only when it is requested.
+    """
+
+    def __init__(self, output_dir: str, name: str = "files"):
+        """
+        Initialize the reader.
+
+        :param output_dir: The directory holding the store.
+        :param name: The name of the pack and index files.
+        """
+        self.output_dir = Path(output_dir)
+        self.blobs = json_io.load(self.output_dir / f"{name}.index.json")["blobs"]
+        self.file = open(self.output_dir / f"{name}.pack", "rb")
+        # an empty file cannot be memory-mapped
+        self.pack = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.blobs else b""
+        self.manifests = {}
+        self.get = lru_cache(maxsize=256)(self._get)
+
+    def manifest(self, kind: str) -> Dict[int, Dict[str, str]]:
+        """
+        Get the `step -> {filepath: hash}` manifest of the given kind.
+        """
+        if kind not in self.manifests:
+            steps = json_io.load(self.output_dir / f"{kind}.manifest.json")['steps']
+            self.manifests[kind] = {item['step']: item[kind] for item in steps}
+        return self.manifests[kind]
+
+    def _get(self, digest: str) -> str:
+        """
+        Get the content stored under a hash, use the cached `get` instead.
+        """
+        offset, length = self.blobs[digest]
+        return zlib.decompress(self.pack[offset:offset + length]).decode("utf-8")
+
+    def steps(self, kind: str) -> List[int]:
+        """
+        Get the steps recorded in the manifest of the given kind.
+        """
+        return list(self.manifest(kind))
+
+    def load_step(self, kind: str, step: int) -> List[Dict[str, str]]:
+        """
+        Get the files of a step as a list of dictionaries with keys 'filepath' and 'content'.
+        """
+        return [{"filepath": filepath, "content": self.get(digest)} for filepath, digest in self.manifest(kind)[step].items()]
+
+    def iter_steps(self, kind: str) -> Iterator[Dict]:
+        """
+        Iterate over the steps in the layout of the plain JSON output, e.g. `{"step": 0, "skeleton-files": [...]}`.
+        """
+        for step in self.manifest(kind):
+            yield {"step": step, kind: self.load_step(kind, step)}
+
+    def close(self):
+        if self.blobs:
+            self.pack.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,128 @@
+from typing import Dict
+from pathlib import Path
+
+import os
+import shutil
+import hashlib
+import zlib
+
+from sweflow.utils import json_io
+
+
+class StepCheckpoint:
+    """
+    Append-only JSON-lines checkpoint of completed steps.
+
+    Each line holds the outputs of one completed step, with its files replaced by a mapping of `filepath -> hash`.
+    Every unique content is stored once, zlib-compressed, in the `<checkpoint>.blobs` directory next to the
+    checkpoint, so the checkpoint stays small and resuming only holds the hashes in memory. Blobs and lines are
+    synced as they are written, so after a crash every step but possibly a half-written last line can be recovered.
+    """
+
+    FILE_KEYS = ("skeleton-files", "reference-files")
+
+    def __init__(self, checkpoint_file: str):
+        """
+        Initialize the checkpoint.
+
+        :param checkpoint_file: The path to the checkpoint file.
+        """
+        self.checkpoint_file = Path(checkpoint_file)
+        self.blob_dir = self.checkpoint_file.with_suffix(".blobs")
+        self.file = None
+
+    def exists(self) -> bool:
+        return self.checkpoint_file.exists()
+
+    def load(self) -> Dict[int, Dict]:
+        """
+        Load the completed steps and drop a trailing partial record, so that new records can be appended.
+
+        :return: A mapping of step to its recorded outputs, with the hashes of its files (see `restore`).
+        """
+        records, valid_size = {}, 0
+        with open(self.checkpoint_file, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json_io.loads(line)
+                except ValueError:
+                    break
+                records[record['step']] = record
+                valid_size += len(line)
+        os.truncate(self.checkpoint_file, valid_size)
+        return records
+
+    def restore(self, record: Dict) -> Dict:
+        """
+        Get the outputs of a loaded step with the contents of its files.
+        """
+        outputs = dict(record)
+        for key in self.FILE_KEYS:
+            outputs[key] = [{"filepath": filepath, "content": self._get(digest)} for filepath, digest in record[key].items()]
+        return outputs
+
+    def reset(self):
+        """
+        Start an empty checkpoint.
+        """
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.rmtree(self.blob_dir, ignore_errors=True)
+        self.checkpoint_file.write_text("")
+
+    def append(self, record: Dict):
+        """
+        Durably append the record of a completed step.
+        """
+        record = dict(record)
+        new_dirs = set()
+        for key in self.FILE_KEYS:
+            record[key] = {file['filepath']: self._put(file['content'], new_dirs) for file in record[key]}
+        # the blobs must be durable before the line referencing them
+        for directory in new_dirs:
+            _fsync_dir(directory)
+        if self.file is None:
+            self.file = open(self.checkpoint_file, "a", encoding="utf-8")
+        self.file.write(json_io.dumps(record, pretty=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest[2:]
+
+    def _put(self, content: str, new_dirs: set) -> str:
+        """
+        Store a content if it is not stored yet and return its hash.
+        """
+        data = content.encode("utf-8", errors="surrogateescape")
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # written aside and renamed, so that a blob is either missing or complete
+            temp_path = path.with_suffix(".tmp")
+            with open(temp_path, "wb") as f:
+                f.write(zlib.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            new_dirs.update((path.parent, self.blob_dir))
+        return digest
+
+    def _get(self, digest: str) -> str:
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8", errors="surrogateescape")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _fsync_dir(directory: Path):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,348 @@
+from typing import Dict, List, Tuple, IO, TYPE_CHECKING
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import re
+import gzip
+import zlib
+import hashlib
+import argparse
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profile_phase, profiled, count
+from sweflow.utils.progress import create_progress
+
+if TYPE_CHECKING:
+    import numpy as np
+
+NEAR_FIELDS = ("patch", "problem_statement")
+
+# MinHash permutations are `(a * x + b) mod p` over 32-bit shingle hashes, which fits in 64-bit integers
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Remove duplicate and near-duplicate instances from a merged dataset")
+    parser.add_argument("--input", type=str, required=True, help="Path to a JSONL file, or a directory of JSONL shards")
+    parser.add_argument("--output-dir", type=str, required=True, help="Path to the output directory of the deduplicated shards")
+    parser.add_argument("--num-workers", type=int, default=8, help="Number of shards processed in parallel")
+    parser.add_argument("--near-fields", type=str, nargs="*", default=list(NEAR_FIELDS), choices=NEAR_FIELDS, help="Fields checked for near-duplicates")
+    parser.add_argument("--num-perm", type=int, default=128, help="Number of MinHash permutations")
+    parser.add_argument("--bands", type=int, default=16, help="Number of LSH bands, must divide the number of permutations")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity from which two instances are near-duplicates")
+    parser.add_argument("--shingle-size", type=int, default=5, help="Number of words per shingle")
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+
+def normalize_patch(patch: str) -> str:
+    """
+    Normalize a patch so that the same change applied at other paths or line numbers compares equal.
+
+    File headers and hunk line numbers are dropped, and trailing whitespace is stripped. Hunks are read up to the
+    line counts of their header, so their removed `-- ...` or added `++ ...` lines are not taken for file headers.
+    """
+    lines = []
+    old_lines, new_lines = 0, 0
+    for line in patch.split("\n"):
+        if old_lines > 0 or new_lines > 0:
+            if line.startswith("-"):
+                old_lines -= 1
+            elif line.startswith("+"):
+                new_lines -= 1
+            elif not line.startswith("\\"):
+                old_lines, new_lines = old_lines - 1, new_lines - 1
+            lines.append(line.rstrip())
+            continue
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            old_lines = int(match.group(1)) if match.group(1) is not None else 1
+            new_lines = int(match.group(2)) if match.group(2) is not None else 1
+            lines.append("@@")
+        elif line.startswith("\\"):
+            # `\ No newline at end of file` after the last line of a hunk
+            lines.append(line.rstrip())
+        # anything else outside hunks is a file header
+    return "\n".join(lines)
+
+
+def shingles(text: str, shingle_size: int = 5) -> List[int]:
+    """
+    Hash the word shingles of a text to 32-bit integers.
+    """
+    words = text.split()
+    if len(words) <= shingle_size:
+        return [zlib.crc32(" ".join(words).encode("utf-8"))] if words else []
+    return list({zlib.crc32(" ".join(words[i:i + shingle_size]).encode("utf-8")) for i in range(len(words) - shingle_size + 1)})
+
+
+def minhash_permutations(num_perm: int = 128, seed: int = 1) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Draw the coefficients of the MinHash permutations, the same ones for a given seed in every process.
+    """
+    import numpy as np
+
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes: List[int], a: "np.ndarray", b: "np.ndarray", chunk_size: int = 4096) -> "np.ndarray":
+    """
+    Compute the MinHash signature of a set of shingle hashes.
+    """
+    import numpy as np
+
+    signature = np.full(len(a), MAX_HASH, dtype=np.uint64)
+    values = np.array(hashes, dtype=np.uint64)
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        permuted = (a[:, None] * chunk[None, :] + b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=1))
+    return signature.astype(np.uint32)
+
+
+def _open_jsonl(path: Path, mode: str) -> IO[str]:
+    """
+    Open a JSONL file for reading or writing text, compressed according to its suffix.
+    """
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t")
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("`zst` shards require the `zstandard` package")
+        return zstandard.open(path, mode + "t")
+    return open(path, mode)
+
+
+def discover_shards(input_path: str) -> List[Path]:
+    """
+    Find the JSONL shards of a dataset, sorted by name, or the input itself if it is a file.
+    """
+    input_path = Path(input_path)
+    if input_path.is_file():
+        return [input_path]
+    return sorted(path for path in input_path.iterdir() if path.name.endswith((".jsonl", ".jsonl.gz", ".jsonl.zst")))
+
+
+def fingerprint_shard(shard: str, near_fields: List[str], num_perm: int, shingle_size: int) -> List[Tuple[str, str, Dict[str, "np.ndarray"]]]:
+    """
+    Fingerprint the instances of a shard in file order.
+
+    Returns:
+        For each instance, its id, the hash of its normalized patch, and the MinHash signature of each near field
+        (None for an empty field).
+    """
+    a, b = minhash_permutations(num_perm)
+    fingerprints = []
+    with _open_jsonl(Path(shard), "r") as f:
+        for line in f:
+            item = json_io.loads(line)
+            normalized_patch = normalize_patch(item["patch"])
+            exact_hash = hashlib.sha1(normalized_patch.encode("utf-8")).hexdigest() if normalized_patch.strip() else None
+            signatures = {}
+            for field in near_fields:
+                # a field may be missing or None, e.g. the problem statement of a failed specification request
+                text = normalized_patch if field == "patch" else item.get(field) or ""
+                hashes = shingles(text, shingle_size)
+                signatures[field] = minhash(hashes, a, b) if hashes else None
+            fingerprints.append((item["instance_id"], exact_hash, signatures))
+    return fingerprints
+
+
+def filter_shard(shard: str, output_file: str, removed_ids: List[str]) -> int:
+    """
+    Copy a shard without the removed instances.
+
+    Returns:
+        The number of instances kept.
+    """
+    removed_ids, kept = set(removed_ids), 0
+    with _open_jsonl(Path(shard), "r") as f, _open_jsonl(Path(output_file), "w") as out:
+        for line in f:
+            if json_io.loads(line)["instance_id"] in removed_ids:
+                continue
+            out.write(line)
+            kept += 1
+    return kept
+
+
+class UnionFind:
+
+    def __init__(self, size: int):
+        self.parents = list(range(size))
+
+    def find(self, x: int) -> int:
+        while self.parents[x] != x:
+            self.parents[x] = self.parents[self.parents[x]]
+            x = self.parents[x]
+        return x
+
+    def union(self, x: int, y: int):
+        # the root is always the earliest instance, which is the one kept
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self.parents[max(x, y)] = min(x, y)
+
+
+@profiled("clustering")
+def find_duplicates(
+    fingerprints: List[Tuple[str, str, Dict[str, "np.ndarray"]]],
+    bands: int = 16,
+    threshold: float = 0.8,
+) -> Tuple[UnionFind, Dict[int, set]]:
+    """
+    Cluster instances with the same normalized patch, or a near field estimated at least `threshold` similar.
+
+    Near-duplicate candidates share a band of their signature (LSH), and each candidate is verified against every
+    instance of its bucket that is not in its cluster yet.
+
+    Returns:
+        The clusters as a union-find over the instance positions, and the reasons each instance was merged into one.
+    """
+    import numpy as np
+
+    clusters = UnionFind(len(fingerprints))
+    reasons = defaultdict(set)
+
+    exact_buckets = {}
+    lsh_buckets = {}
+    for index, (_, exact_hash, signatures) in enumerate(fingerprints):
+        if exact_hash is not None:
+            if exact_hash in exact_buckets:
+                clusters.union(exact_buckets[exact_hash], index)
+                reasons[index].add("exact-patch")
+            else:
+                exact_buckets[exact_hash] = index
+        for field, signature in signatures.items():
+            if signature is None:
+                continue
+            rows = len(signature) // bands
+            for band in range(bands):
+                key = (field, band, signature[band * rows:(band + 1) * rows].tobytes())
+                bucket = lsh_buckets.setdefault(key, [])
+                for candidate in bucket:
+                    if clusters.find(candidate) == clusters.find(index):
+                        continue
+                    if np.mean(fingerprints[candidate][2][field] == signature) >= threshold:
+                        clusters.union(candidate, index)
+                        reasons[index].add(f"near-{field.replace('_', '-')}")
+                bucket.append(index)
+    return clusters, reasons
+
+
+def deduplicate(
+    input_path: str,
+    output_dir: str,
+    num_workers: int = 8,
+    near_fields: List[str] = NEAR_FIELDS,
+    num_perm: int = 128,
+    bands: int = 16,
+    threshold: float = 0.8,
+    shingle_size: int = 5,
+) -> Dict:
+    """
+    Remove duplicate and near-duplicate instances from a dataset of JSONL shards.
+
+    Shards are fingerprinted in parallel, duplicates are clustered across all shards, and the first instance of
+    every cluster (in shard and line order) is kept. The shards are rewritten under the same names, and the removed
+    clusters are reported in `dedup-report.json`.
+
+    Returns:
+        The report.
+    """
+    if num_perm % bands != 0:
+        raise ValueError(f"The number of permutations ({num_perm}) must be a multiple of the number of bands ({bands})")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    shards = discover_shards(input_path)
+
+    with create_progress() as progress, ProcessPoolExecutor(max_workers=num_workers) as executor, profile_phase("fingerprinting"):
+        task = progress.add_task("[cyan]Fingerprinting shards...", total=len(shards))
+        futures = [executor.submit(fingerprint_shard, str(shard), list(near_fields), num_perm, shingle_size) for shard in shards]
+        fingerprints, shard_sizes = [], []
+        # gather in shard order, so that the kept instances do not depend on the number of workers
+        for future in futures:
+            shard_fingerprints = future.result()
+            fingerprints.extend(shard_fingerprints)
+            shard_sizes.append(len(shard_fingerprints))
+            progress.update(task, advance=1)
+        count("instances", len(fingerprints))
+
+        clusters, reasons = find_duplicates(fingerprints, bands, threshold)
+        members = defaultdict(list)
+        for index in range(len(fingerprints)):
+            members[clusters.find(index)].append(index)
+
+        removed = defaultdict(list)
+        start = 0
+        for shard_index, size in enumerate(shard_sizes):
+            for index in range(start, start + size):
+                if clusters.find(index) != index:
+                    removed[shard_index].append(fingerprints[index][0])
+            start += size
+
+        task = progress.add_task("[cyan]Writing shards...", total=len(shards))
+        with profile_phase("filtering"):
+            futures = [
+                executor.submit(filter_shard, str(shard), str(output_dir / shard.name), removed[shard_index])
+                for shard_index, shard in enumerate(shards)
+            ]
+            for future in futures:
+                future.result()
+                progress.update(task, advance=1)
+
+    removed_clusters = [
+        {
+            "kept": fingerprints[root][0],
+            "removed": [fingerprints[index][0] for index in indices[1:]],
+            "reasons": sorted(set().union(*(reasons[index] for index in indices))),
+        }
+        for root, indices in members.items() if len(indices) > 1
+    ]
+    num_removed = sum(len(cluster["removed"]) for cluster in removed_clusters)
+    report = {
+        "summary": {
+            "instances": len(fingerprints),
+            "kept": len(fingerprints) - num_removed,
+            "removed": num_removed,
+            "clusters": len(removed_clusters),
+        },
+        "clusters": removed_clusters,
+    }
+    json_io.dump(report, output_dir / "dedup-report.json", pretty=True)
+
+    return report
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow.utils.dedup")
+
+    print(f"Deduplicating dataset: {args.input}")
+
+    report = deduplicate(
+        args.input,
+        args.output_dir,
+        num_workers=args.num_workers,
+        near_fields=args.near_fields,
+        num_perm=args.num_perm,
+        bands=args.bands,
+        threshold=args.threshold,
+        shingle_size=args.shingle_size,
+    )
+    summary = report["summary"]
+    print(f"Kept {summary['kept']} of {summary['instances']} instances, removed {summary['removed']} in {summary['clusters']} clusters.")
+
+
+if __name__ == "__main__":
+
+    main()
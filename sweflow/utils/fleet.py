@@ -0,0 +1,409 @@
+"""
+Run the pipeline stages of many repositories concurrently, from a manifest of repositories.
+
+Every stage of every repository is a job, run as a subprocess of the stage's command. The state of the jobs is
+kept in a SQLite database, so an interrupted fleet run resumes where it stopped and failed jobs are retried with
+exponential backoff. Ready jobs are started longest first, within the worker pool of their stage and the CPU,
+memory and disk caps of the fleet.
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+
+import os
+import sys
+import time
+import shlex
+import random
+import shutil
+import signal
+import sqlite3
+import argparse
+import resource
+import subprocess
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling
+
+STAGES = ("schedule", "docstrings", "specifications", "codebase", "merge")
+STAGE_DEPENDENCIES = {
+    "schedule": [],
+    "docstrings": ["schedule"],
+    "specifications": ["schedule"],
+    "codebase": ["docstrings"],
+    "merge": ["codebase", "specifications"],
+}
+# number of CPUs a job of each stage keeps busy, the LLM stages mostly wait for the API
+STAGE_CPUS = {"schedule": 1, "docstrings": 0, "specifications": 0, "codebase": 1, "merge": 1}
+DEFAULT_STAGE_WORKERS = {"schedule": 4, "docstrings": 4, "specifications": 4, "codebase": 4, "merge": 4}
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Run the pipeline for a fleet of repositories")
+
+    parser.add_argument("--manifest", type=str, required=True, help="Path to a JSONL manifest, one `{\"repository\", \"project-root\", \"trace-file\"[, \"weight\"]}` object per line")
+    parser.add_argument("--output-root", type=str, required=True, help="Path to the output directory, each repository goes to `<owner>__--__<name>/`")
+    parser.add_argument("--database", type=str, default=None, help="Path to the status database (defaults to `<output-root>/fleet.db`)")
+    parser.add_argument("--stages", type=str, nargs="+", default=list(STAGES), choices=STAGES, help="Stages to run, the others are considered done")
+    parser.add_argument("--workers", type=str, nargs="*", default=[], help="Worker pool size of a stage, as `<stage>=<n>` (4 per stage by default)")
+    parser.add_argument("--max-cpus", type=int, default=os.cpu_count(), help="Maximum number of CPU-bound jobs running at once")
+    parser.add_argument("--min-free-memory", type=int, default=2048, help="Minimum available memory in MiB to start a job")
+    parser.add_argument("--max-job-memory", type=int, default=None, help="Address space limit of each job in MiB")
+    parser.add_argument("--min-free-disk", type=int, default=10240, help="Minimum free disk space in MiB of the output root to start a job")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Number of attempts of a job before it is marked failed")
+    parser.add_argument("--backoff", type=float, default=30.0, help="Delay in seconds before the first retry, doubled on every further retry")
+    parser.add_argument("--timeout", type=float, default=None, help="Timeout in seconds of every job")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry the jobs marked failed by an earlier run")
+    parser.add_argument("--status", action="store_true", help="Print the status of the fleet and exit")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Interval in seconds between two checks of the running jobs")
+    # stage options
+    parser.add_argument("--base-url", type=str, default=None, help="Base URL for the OpenAI API")
+    parser.add_argument("--api-key", type=str, default=None, help="API key for the OpenAI API")
+    parser.add_argument("--docstring-model", type=str, default=None, help="OpenAI model for docstring generation")
+    parser.add_argument("--specification-model", type=str, default=None, help="OpenAI model for specification generation")
+    parser.add_argument("--max-qpm", type=int, default=32, help="Max QPM of every LLM job")
+    parser.add_argument("--temp-dir", type=str, default="/tmp", help="Path to the temporary directory of the codebase jobs")
+    parser.add_argument("--codebase-args", type=str, default="", help="Extra arguments of `sweflow-create-codebase`, as a single string")
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    workers = dict(DEFAULT_STAGE_WORKERS)
+    for item in args.workers:
+        stage, _, size = item.partition("=")
+        if stage not in STAGES or not size.isdigit():
+            parser.error(f"Invalid `--workers` value `{item}`, expected `<stage>=<n>` with a stage among {list(STAGES)}")
+        workers[stage] = int(size)
+    args.workers = workers
+
+    return args
+
+
+def repository_dir(output_root: str, repository: str) -> Path:
+    return Path(output_root) / repository.replace("/", "__--__")
+
+
+def path_size(path: str) -> int:
+    """
+    Get the size in bytes of a file, or of all files in a directory.
+    """
+    path = Path(path)
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def available_memory_mb() -> Optional[float]:
+    """
+    Get the available memory in MiB from `/proc/meminfo`, or None where it is missing.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class FleetDatabase:
+    """
+    Persistent status of the jobs of a fleet run, one row per repository and stage.
+    """
+
+    def __init__(self, database_file: str):
+        self.connection = sqlite3.connect(database_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS repositories (
+                repository TEXT PRIMARY KEY,
+                spec TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                repository TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                weight REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                started_at REAL,
+                finished_at REAL,
+                duration REAL,
+                error TEXT,
+                PRIMARY KEY (repository, stage)
+            );
+        """)
+        self.connection.commit()
+
+    def add_repositories(self, repositories: List[Dict], stages: List[str]):
+        """
+        Register the repositories of the manifest; the jobs of known repositories keep their status.
+        """
+        for spec in repositories:
+            self.connection.execute("INSERT OR REPLACE INTO repositories (repository, spec) VALUES (?, ?)", (spec['repository'], json_io.dumps(spec, pretty=False)))
+            for stage in STAGES:
+                # stages left out of the run count as done for their dependents
+                status = "pending" if stage in stages else "skipped"
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO jobs (repository, stage, status, weight) VALUES (?, ?, ?, ?)",
+                    (spec['repository'], stage, status, spec['weight']),
+                )
+                if stage in stages:
+                    self.connection.execute("UPDATE jobs SET status = 'pending' WHERE repository = ? AND stage = ? AND status = 'skipped'", (spec['repository'], stage))
+                else:
+                    self.connection.execute("UPDATE jobs SET status = 'skipped' WHERE repository = ? AND stage = ? AND status = 'pending'", (spec['repository'], stage))
+        self.connection.commit()
+
+    def reset(self, retry_failed: bool = False):
+        """
+        Make the jobs interrupted by a previous run pending again, and the failed ones too if asked.
+        """
+        # an interrupted attempt is not held against the job
+        self.connection.execute("UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0) WHERE status = 'running'")
+        if retry_failed:
+            self.connection.execute("UPDATE jobs SET status = 'pending', attempts = 0, next_attempt = 0 WHERE status = 'failed'")
+        self.connection.commit()
+
+    def spec(self, repository: str) -> Dict:
+        row = self.connection.execute("SELECT spec FROM repositories WHERE repository = ?", (repository,)).fetchone()
+        return json_io.loads(row['spec'])
+
+    def ready_jobs(self, now: float) -> List[sqlite3.Row]:
+        """
+        Get the pending jobs whose dependencies are done and whose backoff is over, longest first.
+        """
+        jobs = self.connection.execute(
+            "SELECT * FROM jobs WHERE status = 'pending' AND next_attempt <= ? ORDER BY weight DESC, repository, stage", (now,)
+        ).fetchall()
+        done = {
+            (row['repository'], row['stage'])
+            for row in self.connection.execute("SELECT repository, stage FROM jobs WHERE status IN ('done', 'skipped')")
+        }
+        return [job for job in jobs if all((job['repository'], dependency) in done for dependency in STAGE_DEPENDENCIES[job['stage']])]
+
+    def has_pending(self) -> bool:
+        """
+        Whether any pending job can still run, i.e. none of its dependencies failed.
+        """
+        statuses = {(row['repository'], row['stage']): row['status'] for row in self.connection.execute("SELECT repository, stage, status FROM jobs")}
+
+        def blocked(repository: str, stage: str) -> bool:
+            return any(statuses[(repository, dependency)] == "failed" or blocked(repository, dependency) for dependency in STAGE_DEPENDENCIES[stage])
+
+        return any(status == "pending" and not blocked(repository, stage) for (repository, stage), status in statuses.items())
+
+    def start(self, repository: str, stage: str):
+        self.connection.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL WHERE repository = ? AND stage = ?",
+            (time.time(), repository, stage),
+        )
+        self.connection.commit()
+
+    def finish(self, repository: str, stage: str, duration: float):
+        self.connection.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, duration = ? WHERE repository = ? AND stage = ?",
+            (time.time(), duration, repository, stage),
+        )
+        self.connection.commit()
+
+    def fail(self, repository: str, stage: str, error: str, max_attempts: int, backoff: float):
+        """
+        Record a failed attempt, to be retried after an exponential backoff until `max_attempts`.
+        """
+        attempts = self.connection.execute("SELECT attempts FROM jobs WHERE repository = ? AND stage = ?", (repository, stage)).fetchone()['attempts']
+        if attempts < max_attempts:
+            # jitter the delay, so repositories failing together do not retry together
+            delay = backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+            status, next_attempt = "pending", time.time() + delay
+        else:
+            status, next_attempt = "failed", 0
+        self.connection.execute(
+            "UPDATE jobs SET status = ?, next_attempt = ?, finished_at = ?, error = ? WHERE repository = ? AND stage = ?",
+            (status, next_attempt, time.time(), error, repository, stage),
+        )
+        self.connection.commit()
+
+    def set_weight(self, repository: str, weight: float):
+        self.connection.execute("UPDATE jobs SET weight = ? WHERE repository = ? AND status = 'pending'", (weight, repository))
+        self.connection.commit()
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        summary = {stage: {} for stage in STAGES}
+        for row in self.connection.execute("SELECT stage, status, COUNT(*) AS count FROM jobs GROUP BY stage, status"):
+            summary[row['stage']][row['status']] = row['count']
+        return summary
+
+    def failures(self) -> List[sqlite3.Row]:
+        return self.connection.execute("SELECT repository, stage, attempts, error FROM jobs WHERE status = 'failed' ORDER BY repository, stage").fetchall()
+
+
+def load_manifest(manifest_file: str) -> List[Dict]:
+    """
+    Load the repositories of the manifest; the weight of a repository defaults to the size of its traces.
+    """
+    repositories = []
+    with open(manifest_file, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            spec = json_io.loads(line)
+            for key in ("repository", "project-root", "trace-file"):
+                if key not in spec:
+                    raise ValueError(f"Missing `{key}` in the manifest entry: {line.strip()}")
+            spec.setdefault("weight", path_size(spec['trace-file']))
+            repositories.append(spec)
+    return repositories
+
+
+def stage_command(stage: str, spec: Dict, output_dir: Path, args: argparse.Namespace) -> List[str]:
+    """
+    Build the command of a stage for a repository.
+    """
+    python = [sys.executable, "-m"]
+    if stage == "schedule":
+        return python + [
+            "sweflow.extensions.python.schedule", "--trace-file", spec['trace-file'], "--project-root", spec['project-root'],
+            "--output-dir", str(output_dir),
+        ]
+    if stage in ("docstrings", "specifications"):
+        module, model = {
+            "docstrings": ("sweflow.extensions.python.create_docstring", args.docstring_model),
+            "specifications": ("sweflow.extensions.python.create_specification", args.specification_model),
+        }[stage]
+        command = python + [
+            module,
+            "--project-root", spec['project-root'],
+            "--development-schedule", str(output_dir / "development-schedule.json"),
+            "--max-qpm", str(args.max_qpm),
+            "--cache-file", str(output_dir / "cache" / f"{stage}.jsonl"),
+            "--output-file", str(output_dir / f"{stage}.json"),
+        ]
+        for option, value in (("--base-url", args.base_url), ("--api-key", args.api_key), ("--model", model)):
+            if value is not None:
+                command += [option, value]
+        return command
+    if stage == "codebase":
+        return python + [
+            "sweflow.extensions.python.create_codebase",
+            "--project-root", spec['project-root'],
+            "--development-schedule", str(output_dir / "development-schedule.json"),
+            "--docstrings", str(output_dir / "docstrings.json"),
+            "--temp-dir", args.temp_dir,
+            "--output-codebase-dir", str(output_dir),
+            "--output-dir", str(output_dir),
+        ] + shlex.split(args.codebase_args)
+    return python + ["sweflow.utils.merge", "--repository", spec['repository'], "--input-dir", str(output_dir), "--output-file", str(output_dir / "dataset.jsonl")]
+
+
+def _limit_memory(max_job_memory: Optional[int]):
+    if max_job_memory is not None:
+        limit = max_job_memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_fleet(args: argparse.Namespace, database: FleetDatabase):
+    """
+    Start ready jobs within the pools and caps, and reap the running ones, until no job can run anymore.
+    """
+    running = {}  # (repository, stage) -> (process, log file, start time)
+    try:
+        _run_jobs(args, database, running)
+    finally:
+        # the jobs run in their own sessions, stop them with the fleet so a resumed run restarts them cleanly
+        for process, log, _ in running.values():
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            log.close()
+
+
+def _run_jobs(args: argparse.Namespace, database: FleetDatabase, running: Dict):
+    while True:
+        now = time.time()
+        # reap the finished and timed out jobs
+        for key, (process, log, start_time) in list(running.items()):
+            repository, stage = key
+            if process.poll() is None:
+                if args.timeout is None or now - start_time < args.timeout:
+                    continue
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                error = f"timed out after {args.timeout:.0f}s"
+            else:
+                error = None if process.returncode == 0 else f"exited with code {process.returncode}, see `{log.name}`"
+            log.close()
+            del running[key]
+            if error is None:
+                database.finish(repository, stage, round(now - start_time, 3))
+                if stage == "schedule":
+                    # the schedule gives a better estimate of the cost of the remaining stages than the traces
+                    output_dir = repository_dir(args.output_root, repository)
+                    database.set_weight(repository, path_size(output_dir / "development-schedule.json"))
+            else:
+                database.fail(repository, stage, error, args.max_attempts, args.backoff)
+                print(f"Job `{stage}` of `{repository}` failed: {error}")
+
+        # start the ready jobs, longest first
+        stage_running = {stage: sum(key[1] == stage for key in running) for stage in STAGES}
+        cpus_running = sum(STAGE_CPUS[stage] for _, stage in running)
+        for job in database.ready_jobs(now):
+            repository, stage = job['repository'], job['stage']
+            if stage_running[stage] >= args.workers[stage] or cpus_running + STAGE_CPUS[stage] > args.max_cpus:
+                continue
+            memory = available_memory_mb()
+            if memory is not None and memory < args.min_free_memory:
+                break
+            if shutil.disk_usage(args.output_root).free / (1024 * 1024) < args.min_free_disk:
+                break
+            output_dir = repository_dir(args.output_root, repository)
+            (output_dir / "logs").mkdir(parents=True, exist_ok=True)
+            log = open(output_dir / "logs" / f"{stage}.log", "a")
+            command = stage_command(stage, database.spec(repository), output_dir, args)
+            database.start(repository, stage)
+            process = subprocess.Popen(
+                command,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+                preexec_fn=lambda: _limit_memory(args.max_job_memory),
+            )
+            running[(repository, stage)] = (process, log, now)
+            stage_running[stage] += 1
+            cpus_running += STAGE_CPUS[stage]
+
+        if not running and not database.has_pending():
+            break
+        time.sleep(args.poll_interval)
+
+
+def print_summary(database: FleetDatabase):
+    for stage, counts in database.summary().items():
+        print(f"{stage:>16}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    for row in database.failures():
+        print(f"Failed `{row['stage']}` of `{row['repository']}` after {row['attempts']} attempts: {row['error']}")
+
+
+def main():
+
+    args = parse_args()
+    start_profiling(args, "sweflow-fleet")
+
+    Path(args.output_root).mkdir(parents=True, exist_ok=True)
+    database = FleetDatabase(args.database or str(Path(args.output_root) / "fleet.db"))
+
+    if args.status:
+        print_summary(database)
+        return
+
+    repositories = load_manifest(args.manifest)
+    database.add_repositories(repositories, args.stages)
+    database.reset(args.retry_failed)
+
+    print(f"Running {len(args.stages)} stages for {len(repositories)} repositories.")
+    run_fleet(args, database)
+    print_summary(database)
+
+
+if __name__ == "__main__":
+
+    main()
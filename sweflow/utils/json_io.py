@@ -0,0 +1,198 @@
+"""
+JSON I/O of the pipeline artifacts.
+
+Artifacts are (de)serialized with `orjson` when it is installed, several times faster than `json` on large
+artifacts, and otherwise with `json`; both backends write the same compact UTF-8 output. Entry points accept
+`--pretty` to indent their artifacts instead. Large arrays can be read and written one item at a time with
+`iter_array` and `ArrayWriter`, without holding the whole document in memory; `ArrayWriter` writes one item per
+line.
+"""
+from typing import Any, Iterable, Iterator
+from pathlib import Path
+
+import json
+import argparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_PRETTY = False
+
+
+def add_json_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the JSON output options of an entry point.
+    """
+    parser.add_argument("--pretty", action="store_true", help="Indent the JSON artifacts instead of writing them compact")
+
+
+def configure_json(args: argparse.Namespace):
+    """
+    Indent the artifacts written by the process if `--pretty` is given.
+    """
+    global _PRETTY
+    _PRETTY = getattr(args, "pretty", False)
+
+
+def dumps(obj: Any, pretty: bool = None) -> str:
+    """
+    Serialize an object, indented if `pretty` (by default, if `--pretty` was given).
+    """
+    pretty = _PRETTY if pretty is None else pretty
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def canonical(obj: Any) -> str:
+    """
+    Serialize an object with sorted keys and `json`, whatever the backend, so that its hash is stable.
+    """
+    return json.dumps(obj, sort_keys=True, default=str)
+
+
+def loads(data: str | bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dump(obj: Any, output_file: str | Path, pretty: bool = None):
+    """
+    Write an object to a JSON file.
+    """
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(dumps(obj, pretty))
+
+
+def load(input_file: str | Path) -> Any:
+    """
+    Read an object from a JSON file.
+    """
+    with open(input_file, "rb") as f:
+        return loads(f.read())
+
+
+def iter_array(input_file: str | Path, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    Yield the items of a JSON file holding an array, reading it by chunks.
+
+    Arrays laid out one item per line, as written by `ArrayWriter`, have each line decoded with `orjson` when it
+    is installed. Other layouts are decoded item by item with `json`, which can decode a value followed by more
+    data. A chunk never ending an item is followed by a larger one, so that large items are decoded in linear time.
+    """
+    decoder = json.JSONDecoder()
+    with open(input_file, "r", encoding="utf-8") as f:
+        buffer, position, eof = "", 0, False
+
+        def skip(chars: str):
+            nonlocal position
+            while position < len(buffer) and buffer[position] in chars:
+                position += 1
+
+        def fill() -> bool:
+            nonlocal buffer, position, eof
+            # read at least as much as is kept, so that an item is decoded a logarithmic number of times
+            chunk = f.read(max(chunk_size, len(buffer) - position))
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            return not eof
+
+        # find the opening bracket
+        while True:
+            skip(" \t\r\n")
+            if position < len(buffer) or not fill():
+                break
+        if position == len(buffer) or buffer[position] != "[":
+            raise ValueError(f"`{input_file}` does not hold a JSON array")
+        position += 1
+        # the items are on their own lines if the bracket ends its line, until one of them is not
+        while True:
+            skip(" \t\r")
+            if position < len(buffer) or not fill():
+                break
+        by_line = orjson is not None and buffer.startswith("\n", position)
+
+        while True:
+            skip(" \t\r\n,")
+            if position == len(buffer):
+                if not fill():
+                    raise ValueError(f"`{input_file}` ends in the middle of its array")
+                continue
+            if buffer[position] == "]":
+                return
+            if by_line:
+                newline = buffer.find("\n", position)
+                if newline < 0 and not eof:
+                    fill()
+                    continue
+                line = buffer[position:newline if newline >= 0 else len(buffer)].rstrip(" \t\r")
+                try:
+                    item = orjson.loads(line[:-1] if line.endswith(",") else line)
+                except orjson.JSONDecodeError:
+                    by_line = False
+                else:
+                    yield item
+                    position = newline if newline >= 0 else len(buffer)
+                    continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                item, end = None, None
+            # an item is complete once something follows it, e.g. a number may go on in the next chunk
+            if end is None or (end == len(buffer) and not eof):
+                if not fill():
+                    raise ValueError(f"`{input_file}` ends in the middle of its array")
+                continue
+            yield item
+            position = end
+
+
+class ArrayWriter:
+    """
+    Write a JSON array one item at a time.
+    """
+
+    def __init__(self, output_file: str | Path, pretty: bool = None):
+        """
+        Initialize the writer.
+
+        :param output_file: The path to the JSON file.
+        :param pretty: Whether to indent the items, by default if `--pretty` was given.
+        """
+        self.pretty = _PRETTY if pretty is None else pretty
+        self.file = open(output_file, "w", encoding="utf-8")
+        self.file.write("[")
+        self.count = 0
+
+    def write(self, item: Any):
+        separator = "," if self.count else ""
+        if self.pretty:
+            self.file.write(separator + "\n  " + dumps(item, True).replace("\n", "\n  "))
+        else:
+            # one item per line, so that `iter_array` can decode each line at once
+            self.file.write(separator + "\n" + dumps(item, False))
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n]" if self.count else "]")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def dump_array(items: Iterable, output_file: str | Path, pretty: bool = None) -> int:
+    """
+    Write the items of an iterable as a JSON array, and return their number.
+    """
+    with ArrayWriter(output_file, pretty) as writer:
+        for item in items:
+            writer.write(item)
+    return writer.count
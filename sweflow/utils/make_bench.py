@@ -1,9 +1,10 @@
 import argparse
-import json
 from collections import defaultdict
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
 from pathlib import Path
-from tqdm import tqdm
+
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profiled
 
 SWEEFLOW_REPOS = [
     "arrow-py/arrow",
@@ -21,55 +22,149 @@ SWEEFLOW_REPOS = [
 ]
 
 
-def make_sweflow_bench(data: List[Dict], output_file: str = "data/sweflow-bench.jsonl"):
-
-    sweflow_bench_data = []
-    stats = defaultdict(int)
+class BenchWriter:
+    """
+    Write the instances of a benchmark to a JSONL file, together with their per-repository statistics
+    (`<name>.stats.json`) and byte-offset index (`<name>.index.json`).
+
+    The index maps each repository to the `[start, end)` byte ranges of its lines, so the instances of
+    one repository can be read without scanning the whole file (see `read_repository`).
+    """
+
+    def __init__(self, output_file: str, max_per_repo: int = None):
+        """
+        Initialize the writer.
+
+        :param output_file: The path to the output JSONL file.
+        :param max_per_repo: If given, at most this many instances of each repository are written.
+        """
+        self.output_file = Path(output_file)
+        self.max_per_repo = max_per_repo
+        self.stats = defaultdict(int)
+        self.index = defaultdict(list)
+        self.offset = 0
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.output_file, "wb")
+
+    def write(self, item: Dict):
+        repo = item["repo"]
+        if self.max_per_repo is not None and self.stats[repo] >= self.max_per_repo:
+            return
+        line = (json_io.dumps(item, pretty=False) + "\n").encode("utf-8")
+        self.file.write(line)
+        ranges = self.index[repo]
+        # extend the last range while the instances of a repository are contiguous
+        if ranges and ranges[-1][1] == self.offset:
+            ranges[-1][1] += len(line)
+        else:
+            ranges.append([self.offset, self.offset + len(line)])
+        self.offset += len(line)
+        self.stats[repo] += 1
+
+    def close(self):
+        self.file.close()
+        json_io.dump(self.stats, self.output_file.with_suffix(".stats.json"), pretty=True)
+        json_io.dump(self.index, self.output_file.with_suffix(".index.json"))
+
+
+@profiled("bench-writing")
+def make_sweflow_benches(
+    data: Iterable[Dict],
+    bench_file: str = "data/sweflow-bench.jsonl",
+    lite_file: str = "data/sweflow-bench-lite.jsonl",
+    lite_size: int = 50,
+):
+    """
+    Write the benchmark and its lite version in a single pass over the data.
+
+    :param lite_size: The maximum number of instances of each repository in the lite version.
+    """
+    from tqdm import tqdm
+
+    bench = BenchWriter(bench_file)
+    lite = BenchWriter(lite_file, max_per_repo=lite_size)
     for item in tqdm(data):
         if item["repo"] in SWEEFLOW_REPOS:
-            stats[item["repo"]] += 1
-            sweflow_bench_data.append(item)
+            bench.write(item)
+            lite.write(item)
+    bench.close()
+    lite.close()
 
-    with open(output_file, "w") as f:
-        for item in sweflow_bench_data:
-            f.write(json.dumps(item) + "\n")
 
-    with open(f"{str(output_file).strip('.jsonl')}.stats.json", "w") as f:
-        json.dump(stats, f, indent=4)
+def make_sweflow_bench(data: Iterable[Dict], output_file: str = "data/sweflow-bench.jsonl"):
+    from tqdm import tqdm
 
+    bench = BenchWriter(output_file)
+    for item in tqdm(data):
+        if item["repo"] in SWEEFLOW_REPOS:
+            bench.write(item)
+    bench.close()
 
-def make_sweflow_bench_lite(data: List[Dict], output_file: str = "data/sweflow-bench-lite.jsonl"):
 
-    sweflow_bench_data = []
-    stats = defaultdict(int)
+def make_sweflow_bench_lite(data: Iterable[Dict], output_file: str = "data/sweflow-bench-lite.jsonl"):
+    from tqdm import tqdm
+
+    bench = BenchWriter(output_file, max_per_repo=50)
     for item in tqdm(data):
         if item["repo"] in SWEEFLOW_REPOS:
-            stats[item["repo"]] += 1
-            if stats[item["repo"]] > 50:
-                continue
-            sweflow_bench_data.append(item)
+            bench.write(item)
+    bench.close()
+
+
+def read_repository(jsonl_file: str, repo: str, index_file: str = None) -> Iterator[Dict]:
+    """
+    Read the instances of one repository from a benchmark file, seeking to them with its offset index.
 
-    with open(output_file, "w") as f:
-        for item in sweflow_bench_data:
-            f.write(json.dumps(item) + "\n")
+    :param index_file: The path to the index, defaults to `<name>.index.json` next to the benchmark file.
+    """
+    index_file = index_file if index_file is not None else Path(jsonl_file).with_suffix(".index.json")
+    ranges = json_io.load(index_file).get(repo, [])
+    with open(jsonl_file, "rb") as f:
+        for start, end in ranges:
+            f.seek(start)
+            for line in f.read(end - start).splitlines():
+                yield json_io.loads(line)
 
-    with open(f"{str(output_file).strip('.jsonl')}.stats.json", "w") as f:
-        json.dump(stats, f, indent=4)
+
+def load_instances(input_path: str, repos: List[str] = SWEEFLOW_REPOS) -> Iterator[Dict]:
+    """
+    Load the instances of a JSONL file, or scan the instances of the given repositories from a Parquet
+    dataset partitioned by repository (see `sweflow.utils.merge --format parquet`).
+    """
+    if Path(input_path).is_dir():
+        from sweflow.utils.parquet import scan_instances
+
+        yield from scan_instances(input_path, repos=repos)
+        return
+
+    with open(input_path, "rb") as f:
+        for line in f:
+            yield json_io.loads(line)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input-file", type=str, default="data/sweflow.jsonl")
+    parser.add_argument("--input-file", type=str, default="data/sweflow.jsonl", help="Path to the JSONL dataset, or to a Parquet dataset directory")
+    parser.add_argument("--output-dir", type=str, default=None, help="Path to the output directory, defaults to the directory of the input file")
+    parser.add_argument("--lite-size", type=int, default=50, help="Maximum number of instances of each repository in the lite benchmark")
+    add_profile_arguments(parser)
     return parser.parse_args()
 
 
-if __name__ == "__main__":
+def main():
 
     args = parse_args()
+    start_profiling(args, "sweflow.utils.make_bench")
+    output_dir = Path(args.output_dir) if args.output_dir is not None else Path(args.input_file).parent
+
+    make_sweflow_benches(
+        load_instances(args.input_file),
+        output_dir / "sweflow-bench.jsonl",
+        output_dir / "sweflow-bench-lite.jsonl",
+        lite_size=args.lite_size,
+    )
 
-    with open(args.input_file, "r") as f:
-        data = [json.loads(line) for line in tqdm(f)]
 
-    make_sweflow_bench(data, Path(args.input_file).parent / "sweflow-bench.jsonl")
+if __name__ == "__main__":
 
-    make_sweflow_bench_lite(data, Path(args.input_file).parent / "sweflow-bench-lite.jsonl")
+    main()
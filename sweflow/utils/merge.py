@@ -1,57 +1,99 @@
-from typing import Dict, List
+from typing import Dict, List, Iterator, Tuple, IO
 from pathlib import Path
 
-import json
+import gzip
+import shutil
 import argparse
 
+from sweflow.utils import json_io
+from sweflow.utils.profiling import add_profile_arguments, start_profiling, profile_phase, profiled, count
+from sweflow.utils.progress import create_progress
+from sweflow.utils.test_ids import PassToPassTestIds
+
+COMPRESSIONS = ("none", "gz", "zst")
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Merge JSON dataset to JSONL file")
     parser.add_argument("--repository", type=str, help="The full name of the repository")
     parser.add_argument("--input-dir", type=str, help="Path to the input directory")
     parser.add_argument("--output-file", type=str, help="Path to the output JSONL file")
+    # merge many repositories at once
+    parser.add_argument("--input-root", type=str, default=None, help="Path to a directory of repository outputs named `<owner>__--__<name>`")
+    parser.add_argument("--input-subdir", type=str, default="json", help="Sub-directory of each repository holding the JSON files, if present")
+    parser.add_argument("--output-dir", type=str, default=None, help="Path to the output directory of the sharded JSONL files")
+    parser.add_argument("--num-workers", type=int, default=8, help="Number of repositories processed in parallel")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Number of instances per output shard")
+    parser.add_argument("--compression", type=str, default="none", choices=COMPRESSIONS, help="Compression of the output shards")
+    parser.add_argument("--format", type=str, default="jsonl", choices=OUTPUT_FORMATS, help="Write sharded JSONL, or Parquet partitioned by repository")
+    add_profile_arguments(parser)
     return parser.parse_args()
 
 
-def merge_to_jsonl(repository: str, input_dir: str, output_file: str):
+def iter_instances(repository: str, input_dir: str, stats: Dict[str, int] = None) -> Iterator[Dict]:
     """
-    Load a JSON data files.
+    Load the JSON data files of a repository and yield its instances in step order.
+
+    Args:
+        repository: The full name of the repository.
+        input_dir: Path to the directory holding the JSON data files.
+        stats: If given, filled with the number of steps, instances and steps flagged out.
+    """
+    outputs = {}
+    for name in ("step-flags", "specifications", "base-commits", "reference-commits", "fail-to-pass-test-ids", "reference-patches"):
+        outputs[name] = json_io.load(Path(input_dir) / f"{name}.json")
+    # pass-to-pass test ids (either format), expanded only when each instance is written
+    outputs["pass-to-pass-test-ids"] = PassToPassTestIds.load(Path(input_dir) / "pass-to-pass-test-ids.json")
+    # pass-to-pass test ids impacted by each step, if a test impact index was given to create the codebase
+    impacted_file = Path(input_dir) / "impacted-pass-to-pass-test-ids.json"
+    outputs["impacted-pass-to-pass-test-ids"] = PassToPassTestIds.load(impacted_file) if impacted_file.exists() else None
+
+    yield from build_instances(repository, outputs, stats)
+
+
+def build_instances(repository: str, outputs: Dict, stats: Dict[str, int] = None) -> Iterator[Dict]:
+    """
+    Yield the instances of a repository in step order from the outputs of the pipeline held in memory.
+
+    Args:
+        repository: The full name of the repository.
+        outputs: The content of each JSON data file, keyed by its name without `.json`; the pass-to-pass
+            test ids are a `PassToPassTestIds`, and the impacted ones are optional.
+        stats: If given, filled with the number of steps, instances and steps flagged out.
     """
     # step flags
-    with open(Path(input_dir) / "step-flags.json", "r") as f:
-        step_flags = [item['flag'] for item in json.load(f)]
+    step_flags = [item['flag'] for item in outputs["step-flags"]]
     # specifications
-    with open(Path(input_dir) / "specifications.json", "r") as f:
-        specifications = [item['specification'] for item in json.load(f) if step_flags[item['step']]]
+    specifications = [item['specification'] for item in outputs["specifications"] if step_flags[item['step']]]
     # base commits
-    with open(Path(input_dir) / "base-commits.json", "r") as f:
-        base_commits = [item['base-commit'] for item in json.load(f) if step_flags[item['step']]]
+    base_commits = [item['base-commit'] for item in outputs["base-commits"] if step_flags[item['step']]]
     # reference commits
-    with open(Path(input_dir) / "reference-commits.json", "r") as f:
-        reference_commits = [item['reference-commit'] for item in json.load(f) if step_flags[item['step']]]
+    reference_commits = [item['reference-commit'] for item in outputs["reference-commits"] if step_flags[item['step']]]
     # fail-to-pass test ids
-    with open(Path(input_dir) / "fail-to-pass-test-ids.json", "r") as f:
-        fail_to_pass_test_ids = [item['fail-to-pass-test-ids'] for item in json.load(f) if step_flags[item['step']]]
+    fail_to_pass_test_ids = [item['fail-to-pass-test-ids'] for item in outputs["fail-to-pass-test-ids"] if step_flags[item['step']]]
     # pass-to-pass test ids
-    with open(Path(input_dir) / "pass-to-pass-test-ids.json", "r") as f:
-        pass_to_pass_test_ids = [item['pass-to-pass-test-ids'] for item in json.load(f) if step_flags[item['step']]]
+    all_pass_to_pass_test_ids = outputs["pass-to-pass-test-ids"]
+    pass_to_pass_steps = [step for step in all_pass_to_pass_test_ids.steps() if step_flags[step]]
+    impacted_test_ids = outputs.get("impacted-pass-to-pass-test-ids")
     # reference patches
-    with open(Path(input_dir) / "reference-patches.json", "r") as f:
-        reference_patches = [item['reference-patch'] for item in json.load(f) if step_flags[item['step']]]
+    reference_patches = [item['reference-patch'] for item in outputs["reference-patches"] if step_flags[item['step']]]
 
     # all data must have the same length
     assert len(specifications) \
         == len(base_commits) == len(reference_commits) \
-        == len(fail_to_pass_test_ids) == len(pass_to_pass_test_ids) \
+        == len(fail_to_pass_test_ids) == len(pass_to_pass_steps) \
         == len(reference_patches)
 
-    data = []
+    if stats is not None:
+        stats.update({"steps": len(step_flags), "instances": len(specifications), "flagged-out": len(step_flags) - len(specifications)})
+
     for step, (
             specification,
             base_commit,
             reference_commit,
             fail_to_pass_test_ids,
-            pass_to_pass_test_ids,
+            pass_to_pass_step,
             reference_patch,
     ) in enumerate(
             zip(
@@ -59,12 +101,12 @@ def merge_to_jsonl(repository: str, input_dir: str, output_file: str):
                 base_commits,
                 reference_commits,
                 fail_to_pass_test_ids,
-                pass_to_pass_test_ids,
+                pass_to_pass_steps,
                 reference_patches,
             ),
             start=1,
     ):
-        data.append({
+        instance = {
             "instance_id": f"{repository.replace('/', '__--__')}-dev-{step}",
             "repo": repository,
             "problem_statement": specification,
@@ -72,17 +114,177 @@ def merge_to_jsonl(repository: str, input_dir: str, output_file: str):
             "reference_commit": reference_commit,
             "patch": reference_patch,
             "fail_to_pass": fail_to_pass_test_ids,
-            "pass_to_pass": pass_to_pass_test_ids,
-        })
+            "pass_to_pass": all_pass_to_pass_test_ids.get(pass_to_pass_step),
+        }
+        if impacted_test_ids is not None:
+            instance["pass_to_pass_impacted"] = impacted_test_ids.get(pass_to_pass_step)
+        yield instance
+
+
+@profiled("merging")
+def merge_to_jsonl(repository: str, input_dir: str, output_file: str) -> Dict[str, int]:
+    """
+    Merge the JSON data files of a repository into a JSONL file.
+
+    Returns:
+        The number of steps, instances and steps flagged out.
+    """
+    stats = {}
+    with open(output_file, "w", encoding="utf-8") as f:
+        for item in iter_instances(repository, input_dir, stats):
+            f.write(json_io.dumps(item, pretty=False) + "\n")
+    return stats
+
+
+def discover_repositories(input_root: str, input_subdir: str = "json") -> List[Tuple[str, Path]]:
+    """
+    Find the repository outputs under a root directory, sorted by repository name.
+
+    Each child directory is named after the repository with `/` replaced by `__--__`, and holds the
+    JSON data files either directly or in `input_subdir`.
+    """
+    repositories = []
+    for child in sorted(Path(input_root).iterdir()):
+        input_dir = child / input_subdir if (child / input_subdir).is_dir() else child
+        if (input_dir / "step-flags.json").exists():
+            repositories.append((child.name.replace("__--__", "/"), input_dir))
+    return repositories
+
 
-    with open(output_file, "w") as f:
-        for item in data:
-            f.write(json.dumps(item) + "\n")
+def _merge_repository(repository: str, input_dir: str, part_file: str, parquet_file: str = None) -> Dict:
+    """
+    Merge one repository into a part file, or a Parquet file if given; failures are reported in the statistics instead of raised.
+    """
+    stats = {"repository": repository}
+    try:
+        stats.update(merge_to_jsonl(repository, input_dir, part_file))
+        if parquet_file is not None:
+            from sweflow.utils.parquet import jsonl_to_parquet
+
+            jsonl_to_parquet(part_file, parquet_file)
+            Path(part_file).unlink()
+    except Exception as e:
+        Path(part_file).unlink(missing_ok=True)
+        stats["error"] = f"{type(e).__name__}: {e}"
+    return stats
+
+
+def _open_shard(output_dir: Path, index: int, compression: str) -> IO[str]:
+    """
+    Open an output shard for writing text.
+    """
+    if compression == "gz":
+        return gzip.open(output_dir / f"shard-{index:05d}.jsonl.gz", "wt", encoding="utf-8")
+    if compression == "zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("`zst` compression requires the `zstandard` package")
+        return zstandard.open(output_dir / f"shard-{index:05d}.jsonl.zst", "wt", encoding="utf-8")
+    return open(output_dir / f"shard-{index:05d}.jsonl", "w", encoding="utf-8")
+
+
+def merge_repositories(
+    input_root: str,
+    output_dir: str,
+    input_subdir: str = "json",
+    num_workers: int = 8,
+    shard_size: int = 10000,
+    compression: str = "none",
+    output_format: str = "jsonl",
+) -> List[Dict]:
+    """
+    Merge the outputs of many repositories into sharded JSONL files, or a Parquet dataset.
+
+    Repositories are merged in parallel into per-repository part files, which are then streamed into
+    shards of `shard_size` instances. Instances are ordered by repository name, then by step, so the
+    output does not depend on the number of workers. With the `parquet` format, every repository is
+    written to its own `<owner>__--__<name>/data.parquet` partition instead.
+
+    Returns:
+        The statistics of each repository, also saved to `merge-stats.json`.
+    """
+    output_dir = Path(output_dir)
+    parts_dir = output_dir / ".parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    repositories = discover_repositories(input_root, input_subdir)
+    part_files = {repository: parts_dir / f"{repository.replace('/', '__--__')}.jsonl" for repository, _ in repositories}
+    if output_format == "parquet":
+        from sweflow.utils.parquet import repository_parquet_file
+
+        parquet_files = {repository: str(repository_parquet_file(output_dir, repository)) for repository, _ in repositories}
+    else:
+        parquet_files = {repository: None for repository, _ in repositories}
+
+    # the process pool machinery is slow to import, and only needed to merge several repositories
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    all_stats = {}
+    with create_progress() as progress, ProcessPoolExecutor(max_workers=num_workers) as executor, profile_phase("merging"):
+        task = progress.add_task("[cyan]Merging repositories...", total=len(repositories))
+        futures = [
+            executor.submit(_merge_repository, repository, str(input_dir), str(part_files[repository]), parquet_files[repository])
+            for repository, input_dir in repositories
+        ]
+        for future in as_completed(futures):
+            stats = future.result()
+            all_stats[stats['repository']] = stats
+            count("instances", stats.get("instances", 0))
+            progress.update(task, advance=1)
+
+    # stream the parts into shards in repository order
+    with profile_phase("sharding"):
+        shard, shard_index, shard_count = None, 0, 0
+        for repository, _ in repositories:
+            if "error" in all_stats[repository] or output_format == "parquet":
+                continue
+            with open(part_files[repository], "r", encoding="utf-8") as part:
+                for line in part:
+                    if shard is None:
+                        shard = _open_shard(output_dir, shard_index, compression)
+                    shard.write(line)
+                    shard_count += 1
+                    if shard_count == shard_size:
+                        shard.close()
+                        shard, shard_index, shard_count = None, shard_index + 1, 0
+        if shard is not None:
+            shard.close()
+    shutil.rmtree(parts_dir)
+
+    all_stats = [all_stats[repository] for repository, _ in repositories]
+    summary = {
+        "repositories": len(all_stats),
+        "failed-repositories": sum("error" in stats for stats in all_stats),
+        "instances": sum(stats.get("instances", 0) for stats in all_stats),
+        "flagged-out": sum(stats.get("flagged-out", 0) for stats in all_stats),
+    }
+    json_io.dump({"summary": summary, "repositories": all_stats}, output_dir / "merge-stats.json", pretty=True)
+
+    return all_stats
 
 
 def main():
 
     args = parse_args()
+    start_profiling(args, "sweflow.utils.merge")
+
+    if args.input_root is not None:
+        print(f"Processing datasets under: {args.input_root}")
+        all_stats = merge_repositories(
+            args.input_root,
+            args.output_dir,
+            input_subdir=args.input_subdir,
+            num_workers=args.num_workers,
+            shard_size=args.shard_size,
+            compression=args.compression,
+            output_format=args.format,
+        )
+        for stats in all_stats:
+            if "error" in stats:
+                print(f"Failed to merge `{stats['repository']}`: {stats['error']}")
+        print(f"Merged {sum(stats.get('instances', 0) for stats in all_stats)} instances from {len(all_stats)} repositories into `{args.output_dir}`.")
+        return
+
     print(f"Processing dataset: {args.repository}")
 
     merge_to_jsonl(args.repository, args.input_dir, args.output_file)
@@ -0,0 +1,90 @@
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+
+from sweflow.utils import json_io
+
+INSTANCE_SCHEMA = pa.schema([
+    ("instance_id", pa.string()),
+    ("repo", pa.string()),
+    ("problem_statement", pa.string()),
+    ("base_commit", pa.string()),
+    ("reference_commit", pa.string()),
+    ("patch", pa.string()),
+    ("fail_to_pass", pa.list_(pa.string())),
+    ("pass_to_pass", pa.list_(pa.string())),
+])
+# fields only some datasets have, typed when present
+OPTIONAL_FIELDS = [
+    pa.field("pass_to_pass_impacted", pa.list_(pa.string())),
+]
+
+
+def jsonl_to_parquet(jsonl_file: str, parquet_file: str, row_group_size: int = 1024):
+    """
+    Convert a JSONL file of instances to a Parquet file with the instance schema.
+
+    Fields missing from the schema are inferred, so extra instance fields are kept.
+    """
+    with open(jsonl_file, "r") as f:
+        first_line = f.readline()
+    fields = json_io.loads(first_line).keys() if first_line else []
+    schema = INSTANCE_SCHEMA
+    for field in OPTIONAL_FIELDS:
+        if field.name in fields:
+            schema = schema.append(field)
+    parse_options = pj.ParseOptions(explicit_schema=schema, unexpected_field_behavior="infer")
+    # large patches and problem statements do not fit the default block size
+    read_options = pj.ReadOptions(block_size=64 << 20)
+    table = pj.read_json(jsonl_file, read_options=read_options, parse_options=parse_options)
+    Path(parquet_file).parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, parquet_file, row_group_size=row_group_size, compression="zstd")
+
+
+def repository_parquet_file(output_dir: str, repository: str) -> Path:
+    """
+    Get the Parquet file of a repository in a dataset partitioned by repository.
+    """
+    return Path(output_dir) / repository.replace("/", "__--__") / "data.parquet"
+
+
+def open_dataset(dataset_dir: str, repos: List[str] = None) -> ds.Dataset:
+    """
+    Open a dataset partitioned by repository with memory-mapped files.
+
+    Args:
+        dataset_dir: The directory holding one `<owner>__--__<name>/data.parquet` per repository.
+        repos: If given, only the partitions of these repositories are opened.
+    """
+    files = sorted(Path(dataset_dir).glob("*/data.parquet"))
+    if repos is not None:
+        partitions = {repo.replace("/", "__--__") for repo in repos}
+        files = [file for file in files if file.parent.name in partitions]
+    return ds.dataset([str(file) for file in files],
+                      format="parquet",
+                      filesystem=LocalFileSystem(use_mmap=True))
+
+
+def scan_instances(dataset_dir: str,
+                   repos: List[str] = None,
+                   columns: List[str] = None,
+                   batch_size: int = 1024) -> Iterator[Dict]:
+    """
+    Scan the instances of a Parquet dataset in repository and step order, one record batch at a time.
+
+    Args:
+        dataset_dir: The directory of the dataset partitioned by repository.
+        repos: If given, only instances of these repositories are scanned, the predicate is pushed down to the scan.
+        columns: If given, only these columns are read.
+        batch_size: The number of rows per record batch.
+    """
+    dataset = open_dataset(dataset_dir, repos)
+    predicate = pc.field("repo").isin(repos) if repos is not None else None
+    for batch in dataset.to_batches(columns=columns, filter=predicate, batch_size=batch_size):
+        yield from batch.to_pylist()
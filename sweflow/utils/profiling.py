@@ -0,0 +1,230 @@
+"""
+Phase profiling of the pipeline entry points.
+
+Code marks its phases with `profile_phase` (or the `profiled` decorator) and its counters with `count`. Both are
+no-ops until an entry point enables profiling with `--profile`, which writes a JSON report of the wall time and
+peak RSS of every phase, and of the counters, when the process exits. Phases may nest and may run in several
+threads, in which case their wall times add up; phases of worker processes are not recorded.
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+
+import sys
+import time
+import atexit
+import cProfile
+import argparse
+import resource
+import functools
+import threading
+
+from sweflow.utils import json_io
+
+# the fluxllm internals wrapped by `instrument_llm_client`
+LLM_CLIENT_METHODS = ("request", "execute_with_rate_limiting", "make_request_async")
+LLM_CACHE_METHODS = ("is_cached", "hash")
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the profiling options of an entry point.
+    """
+    parser.add_argument("--profile", type=str, default=None, help="Path to a JSON report of the wall time and peak RSS of each phase, and of the counters")
+    parser.add_argument("--profile-phase", type=str, default=None, help="Name of a phase to also profile with cProfile, dumped next to the report as `<report>.<phase>.prof`")
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    Get the peak resident set size in MiB (`ru_maxrss` is in KiB on Linux and in bytes on macOS).
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 3)
+
+
+class Profiler:
+    """
+    Accumulate the wall time, call count and peak RSS of each phase, and the counters, of a process.
+    """
+
+    def __init__(self, name: str, cprofile_phase: str = None):
+        """
+        Initialize the profiler.
+
+        :param name: The name of the entry point.
+        :param cprofile_phase: The name of a phase to profile with cProfile.
+        """
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.phases: Dict[str, Dict] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.cprofile_phase = cprofile_phase
+        self.cprofile = cProfile.Profile() if cprofile_phase is not None else None
+        self.cprofile_active = False
+
+    def record(self, name: str, seconds: float, peak_rss: float = None, rss_growth: float = 0.0):
+        """
+        Record one call of a phase.
+        """
+        with self.lock:
+            phase = self.phases.setdefault(name, {"calls": 0, "wall-time": 0.0, "max-wall-time": 0.0, "peak-rss-mb": 0.0, "rss-growth-mb": 0.0})
+            phase["calls"] += 1
+            phase["wall-time"] += seconds
+            phase["max-wall-time"] = max(phase["max-wall-time"], seconds)
+            if peak_rss is not None:
+                phase["peak-rss-mb"] = max(phase["peak-rss-mb"], peak_rss)
+            phase["rss-growth-mb"] += rss_growth
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase, and track how much it raised the peak RSS of the process.
+        """
+        start_rss = peak_rss_mb()
+        profiling = False
+        if name == self.cprofile_phase:
+            with self.lock:
+                # cProfile only follows one thread, the first one entering the phase
+                profiling, self.cprofile_active = not self.cprofile_active, True
+            if profiling:
+                self.cprofile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            if profiling:
+                self.cprofile.disable()
+                self.cprofile_active = False
+            end_rss = peak_rss_mb()
+            self.record(name, seconds, end_rss, end_rss - start_rss)
+
+    def report(self) -> Dict:
+        phases = {}
+        for name, phase in self.phases.items():
+            phases[name] = {
+                **phase,
+                "wall-time": round(phase["wall-time"], 6),
+                "max-wall-time": round(phase["max-wall-time"], 6),
+                "rss-growth-mb": round(phase["rss-growth-mb"], 3),
+            }
+        return {
+            "entry-point": self.name,
+            "argv": sys.argv[1:],
+            "wall-time": round(time.perf_counter() - self.start_time, 6),
+            "peak-rss-mb": peak_rss_mb(),
+            "peak-children-rss-mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "phases": phases,
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def save(self, output_file: str):
+        """
+        Save the report, and the cProfile statistics of the chosen phase (readable with `pstats` or `snakeviz`).
+        """
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        json_io.dump(self.report(), output_file, pretty=True)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{output_file}.{self.cprofile_phase}.prof")
+
+
+_PROFILER: Optional[Profiler] = None
+
+
+def start_profiling(args: argparse.Namespace, name: str) -> Optional[Profiler]:
+    """
+    Enable profiling for the process if `--profile` is given; the report is saved when the process exits.
+    """
+    global _PROFILER
+    if getattr(args, "profile", None) is None:
+        return None
+    _PROFILER = Profiler(name, args.profile_phase)
+    atexit.register(_PROFILER.save, args.profile)
+    return _PROFILER
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _PROFILER
+
+
+def profile_phase(name: str):
+    """
+    Context manager timing a phase, if profiling is enabled.
+    """
+    return _PROFILER.phase(name) if _PROFILER is not None else nullcontext()
+
+
+def profiled(name: str):
+    """
+    Decorator timing every call of a function as a phase, if profiling is enabled.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return function(*args, **kwargs)
+            with _PROFILER.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    """
+    Increment a counter, if profiling is enabled.
+    """
+    if _PROFILER is not None:
+        _PROFILER.count(name, n)
+
+
+def instrument_llm_client(client):
+    """
+    Record the requests, cache hits, queue time and latency of a fluxllm client, if profiling is enabled.
+
+    The queue time of a request is spent waiting for the rate limiters, its latency waiting for the API. The
+    internals of the client this relies on are checked first, so that another version of fluxllm only leaves the
+    client unprofiled.
+    """
+    if _PROFILER is None:
+        return client
+    if not all(hasattr(client, name) for name in LLM_CLIENT_METHODS) \
+            or not all(hasattr(getattr(client, "cache", None), name) for name in LLM_CACHE_METHODS):
+        print(f"Not profiling the requests of `{type(client).__name__}`, whose fluxllm version is not supported.", flush=True)
+        return client
+
+    profiler = _PROFILER
+    request, execute, make_request = client.request, client.execute_with_rate_limiting, client.make_request_async
+    # the enqueue times of the requests in flight, keyed by the cache hash of the request as fluxllm does
+    queued_at: Dict[str, List[float]] = {}
+
+    def timed_request(requests, *args, **kwargs):
+        profiler.count("llm-requests", len(requests))
+        profiler.count("llm-cache-hits", sum(client.cache.is_cached(item) for item in requests))
+        with profiler.phase("llm-requests"):
+            return request(requests, *args, **kwargs)
+
+    async def timed_execute(item, **kwargs):
+        queued_at.setdefault(client.cache.hash(item), []).append(time.perf_counter())
+        return await execute(item, **kwargs)
+
+    async def timed_make_request(item, **kwargs):
+        start_time = time.perf_counter()
+        key = client.cache.hash(item)
+        times = queued_at.get(key)
+        profiler.record("llm-queue", start_time - (times.pop(0) if times else start_time))
+        if times is not None and not times:
+            del queued_at[key]
+        try:
+            return await make_request(item, **kwargs)
+        finally:
+            profiler.record("llm-latency", time.perf_counter() - start_time)
+
+    client.request = timed_request
+    client.execute_with_rate_limiting = timed_execute
+    client.make_request_async = timed_make_request
+    return client
@@ -1,14 +1,14 @@
-from rich.progress import (
-    Progress,
-    TextColumn,
-    BarColumn,
-    TaskProgressColumn,
-    TimeRemainingColumn,
-    TimeElapsedColumn,
-)
-
-
 def create_progress():
+    # rich is imported on first use, so that entry points start without it
+    from rich.progress import (
+        Progress,
+        TextColumn,
+        BarColumn,
+        TaskProgressColumn,
+        TimeRemainingColumn,
+        TimeElapsedColumn,
+    )
+
     return Progress(
         TextColumn("[bold blue]{task.description}"),
         BarColumn(),
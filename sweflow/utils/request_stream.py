@@ -0,0 +1,141 @@
+"""
+Stream the requests of fluxllm clients from a background thread, so that their responses can be used as they arrive.
+
+`client.request` of fluxllm blocks until a whole batch of requests is answered. A `RequestStream` sends the
+batches of several clients concurrently from one event loop in a background thread, each batch in the order of
+its requests and within the rate limits of its client, and lets the caller wait for some requests of a batch only.
+Responses go to the cache of their client as with `client.request`, and failed requests are retried the same way.
+"""
+from typing import Any, Dict, List, Optional
+
+import time
+import random
+import asyncio
+import threading
+
+from sweflow.utils.profiling import count
+
+
+class RequestStream:
+    """
+    Send batches of requests in a background thread and wait for any of their responses.
+    """
+
+    def __init__(self):
+        """
+        Initialize the stream, add the batches with `add` and send them by entering the stream.
+        """
+        self.batches: List[Dict[str, Any]] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.start_time: Optional[float] = None
+
+    def add(self, client, requests: List[Dict]) -> int:
+        """
+        Add a batch of requests of a fluxllm client, sent in their order.
+
+        Returns:
+            The index of the batch.
+        """
+        if self.thread is not None:
+            raise RuntimeError("Batches cannot be added once the stream is started")
+        self.batches.append({"client": client, "requests": requests, "answered": set(), "wall-time": None})
+        return len(self.batches) - 1
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name="request-stream", daemon=True)
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # on an error, the pending requests are abandoned with the daemon thread instead of waited for
+        if exc_type is None:
+            self.join()
+
+    def _run(self):
+        try:
+            asyncio.run(self._request_all())
+        except BaseException as error:
+            self.error = error
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def _answer(self, batch: int, index: int):
+        """
+        Mark a request as answered, or as given up after its retries.
+        """
+        with self.condition:
+            self.batches[batch]["answered"].add(index)
+            self.condition.notify_all()
+
+    async def _request_all(self):
+        await asyncio.gather(*(self._request_batch(batch) for batch in range(len(self.batches))))
+
+    async def _request_batch(self, batch: int):
+        client, requests = self.batches[batch]["client"], self.batches[batch]["requests"]
+        queue = asyncio.Queue()
+        for index, request in enumerate(requests):
+            if client.cache.is_cached(request):
+                self._answer(batch, index)
+            else:
+                queue.put_nowait((index, request))
+        count("llm-requests", len(requests))
+        count("llm-cache-hits", len(requests) - queue.qsize())
+        failures = [0] * len(requests)
+
+        async def worker():
+            while not queue.empty():
+                index, request = queue.get_nowait()
+                response = await client.execute_with_rate_limiting(request)
+                if response is not None:
+                    await client.save_to_cache_thread_safe(request, response)
+                    self._answer(batch, index)
+                    continue
+                failures[index] += 1
+                if client.max_retries is not None and failures[index] >= client.max_retries:
+                    print(f"Request failed after {client.max_retries} retries. Aborting this request.", flush=True)
+                    self._answer(batch, index)
+                    continue
+                # re-queue the request before backing off, so that the other workers do not stop meanwhile
+                queue.put_nowait((index, request))
+                await asyncio.sleep(random.randint(3, 10))
+
+        await asyncio.gather(*(worker() for _ in range(client.concurrency)))
+        self.batches[batch]["wall-time"] = time.perf_counter() - self.start_time
+
+    def wait(self, batch: int, indices: List[int] = None) -> List:
+        """
+        Wait for some requests of a batch, all of them by default.
+
+        Returns:
+            The responses of the requests, `None` for the failed ones.
+        """
+        if indices is None:
+            indices = range(len(self.batches[batch]["requests"]))
+        indices = list(indices)
+        answered = self.batches[batch]["answered"]
+        with self.condition:
+            self.condition.wait_for(lambda: self.done or all(index in answered for index in indices))
+        if self.error is not None:
+            raise self.error
+        requests = self.batches[batch]["requests"]
+        return self.batches[batch]["client"].collect_responses([requests[index] for index in indices])
+
+    def wall_time(self, batch: int) -> Optional[float]:
+        """
+        Get the time it took to answer a batch since the stream started, in seconds.
+        """
+        return self.batches[batch]["wall-time"]
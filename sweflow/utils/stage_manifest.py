@@ -0,0 +1,165 @@
+"""
+Content-hash manifests of the stages of a pipeline run, to skip the stages whose inputs did not change.
+
+The manifest of a stage records the hashes of its inputs (files, options, models, prompts and the outputs of the
+stages it depends on) and of the files it wrote. A stage whose inputs hash the same as in its manifest, and whose
+output files are still there unchanged, is up to date and need not run again. As the outputs of a stage are the
+inputs of the next ones, a stage whose outputs actually changed invalidates its downstream stages.
+
+Files are hashed once per size and mtime: a file whose size and mtime are the ones recorded in the manifest keeps
+its recorded hash.
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+
+import os
+import hashlib
+import subprocess
+
+from sweflow.utils import json_io
+
+
+def hash_value(value) -> str:
+    """
+    Hash a JSON-serializable value.
+    """
+    return hashlib.sha256(json_io.canonical(value).encode("utf-8")).hexdigest()
+
+
+def _file_record(path: Path, previous: Dict[str, Dict]) -> Dict:
+    stat = path.stat()
+    record = previous.get(str(path))
+    if record is not None and record['size'] == stat.st_size and record['mtime-ns'] == stat.st_mtime_ns:
+        return record
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size, "mtime-ns": stat.st_mtime_ns}
+
+
+def project_fingerprint(project_root: str) -> Optional[str]:
+    """
+    Get the commit of a git project whose working tree is clean, or None for any other project.
+
+    Ignored files (virtual environments, caches, build outputs) do not make the working tree dirty.
+    """
+    try:
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=all"],
+            cwd=project_root, capture_output=True, text=True, check=True,
+        ).stdout
+        if status.strip():
+            return None
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def list_tree_files(root: Path) -> List[Path]:
+    """
+    List the files of a directory, sorted, leaving out the git metadata, the bytecode and, if the directory is a
+    git working tree, the ignored files (caches and test artifacts that are deleted or regenerated without the
+    sources changing).
+    """
+    files = None
+    # a directory inside another working tree may be ignored there as a whole, so only its own rules apply
+    if (root / ".git").exists():
+        try:
+            output = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                cwd=root, capture_output=True, check=True,
+            ).stdout
+            files = {root / os.fsdecode(relpath) for relpath in output.split(b"\0") if relpath}
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    if files is None:
+        files = set(root.rglob("*"))
+    return sorted(
+        path for path in files
+        if path.is_file() and not {".git", "__pycache__"} & set(path.relative_to(root).parts)
+    )
+
+
+def hash_tree(root: str) -> str:
+    """
+    Hash the content of the files of a directory, as listed by `list_tree_files`.
+    """
+    root = Path(root)
+    return hash_value([[str(path.relative_to(root)), _file_record(path, {})['sha256']] for path in list_tree_files(root)])
+
+
+class StageManifest:
+    """
+    The inputs and outputs of a stage, compared with the ones recorded by its previous run.
+    """
+
+    def __init__(self, manifest_dir: str, stage: str):
+        """
+        Initialize the manifest and load the one of the previous run, if any.
+
+        :param manifest_dir: The directory of the manifests, one `<stage>.json` per stage.
+        :param stage: The name of the stage.
+        """
+        self.manifest_file = Path(manifest_dir) / f"{stage}.json"
+        self.stage = stage
+        self.previous = None
+        if self.manifest_file.exists():
+            self.previous = json_io.load(self.manifest_file)
+        self.inputs: Dict[str, str] = {}
+        self.files: Dict[str, Dict] = {}
+
+    def _hash_file(self, path: Path) -> str:
+        previous = self.previous['files'] if self.previous is not None else {}
+        record = _file_record(path, previous)
+        self.files[str(path)] = record
+        return record['sha256']
+
+    def add_value(self, name: str, value):
+        """
+        Add an option, a model name or any other JSON-serializable input.
+        """
+        self.inputs[name] = hash_value(value)
+
+    def add_file(self, name: str, path: str):
+        """
+        Add an input file, or every file of an input directory; a missing path hashes as such.
+        """
+        path = Path(path)
+        if path.is_dir():
+            files = list_tree_files(path)
+            self.inputs[name] = hash_value([[str(child.relative_to(path)), self._hash_file(child)] for child in files])
+        elif path.exists():
+            self.inputs[name] = self._hash_file(path)
+        else:
+            self.inputs[name] = hash_value(None)
+
+    def add_project(self, name: str, project_root: str):
+        """
+        Add a project, by its commit if it is a clean git repository, otherwise by the content of its files.
+        """
+        commit = project_fingerprint(project_root)
+        if commit is not None:
+            self.add_value(name, {"commit": commit})
+        else:
+            self.add_file(name, project_root)
+
+    def is_up_to_date(self) -> bool:
+        """
+        Whether the inputs are the ones of the previous run and its output files are still there unchanged.
+        """
+        if self.previous is None or self.previous['inputs'] != self.inputs:
+            return False
+        for output_file, sha256 in self.previous['outputs'].items():
+            path = Path(output_file)
+            if not path.is_file() or self._hash_file(path) != sha256:
+                return False
+        return True
+
+    def save(self, output_files: List[str]):
+        """
+        Record the inputs and the output files of a run of the stage.
+        """
+        outputs = {str(path): self._hash_file(Path(path)) for path in output_files}
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        json_io.dump({"stage": self.stage, "inputs": self.inputs, "outputs": outputs, "files": self.files}, self.manifest_file, pretty=True)
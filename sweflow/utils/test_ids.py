@@ -0,0 +1,92 @@
+from typing import Any, Dict, Iterator, List
+from pathlib import Path
+
+from sweflow.utils import json_io
+
+PASS_TO_PASS_FORMATS = ("prefix", "expanded")
+
+
+class PassToPassTestIds:
+    """
+    The accumulated pass-to-pass test ids of a development schedule.
+
+    The pass-to-pass test ids of a step are the fail-to-pass test ids of all the steps before it, so
+    they are stored once as an ordered list plus, for every step, the length of its prefix.
+    """
+
+    def __init__(self, test_ids: List[str] = None, prefix_lengths: Dict[int, int] = None, expanded: Dict[int, List[str]] = None):
+        """
+        Initialize the test ids.
+
+        :param test_ids: The ordered list of all accumulated test ids.
+        :param prefix_lengths: The length of the prefix of `test_ids` for each step.
+        :param expanded: Explicit test ids for each step, as loaded from the expanded format.
+        """
+        self.test_ids = test_ids if test_ids is not None else []
+        self.prefix_lengths = prefix_lengths if prefix_lengths is not None else {}
+        self.expanded = expanded
+
+    def add_step(self, step: int, fail_to_pass_test_ids: List[str]):
+        """
+        Record the pass-to-pass test ids of a step, then accumulate its fail-to-pass test ids for the next steps.
+        """
+        self.prefix_lengths[step] = len(self.test_ids)
+        self.test_ids.extend(fail_to_pass_test_ids)
+
+    def steps(self) -> List[int]:
+        return list(self.expanded if self.expanded is not None else self.prefix_lengths)
+
+    def get(self, step: int) -> List[str]:
+        """
+        Get the pass-to-pass test ids of a step.
+        """
+        if self.expanded is not None:
+            return self.expanded[step]
+        return self.test_ids[:self.prefix_lengths[step]]
+
+    def iter_expanded(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the items of the expanded format, one step at a time.
+        """
+        for step in self.steps():
+            yield {"step": step, "pass-to-pass-test-ids": self.get(step)}
+
+    def to_json(self, pass_to_pass_format: str = "expanded") -> Any:
+        """
+        Serialize the test ids.
+
+        :param pass_to_pass_format: `prefix` for the compact layout, `expanded` for the full list of every step
+            (`[{"step": 0, "pass-to-pass-test-ids": [...]}, ...]`).
+        """
+        if pass_to_pass_format == "expanded":
+            return list(self.iter_expanded())
+        if self.expanded is not None:
+            raise ValueError("Test ids loaded from the expanded format cannot be written in the prefix format")
+        return {
+            "format": "prefix",
+            "test-ids": self.test_ids,
+            "steps": [{"step": step, "prefix-length": length} for step, length in self.prefix_lengths.items()],
+        }
+
+    @classmethod
+    def from_json(cls, data: Any) -> "PassToPassTestIds":
+        """
+        Deserialize the test ids from either format.
+        """
+        if isinstance(data, list):
+            return cls(expanded={item['step']: item['pass-to-pass-test-ids'] for item in data})
+        return cls(
+            test_ids=data['test-ids'],
+            prefix_lengths={item['step']: item['prefix-length'] for item in data['steps']},
+        )
+
+    def dump(self, output_file: str, pass_to_pass_format: str = "expanded"):
+        if pass_to_pass_format == "expanded":
+            # written step by step, as the copies of the test ids of every step grow quadratically with the steps
+            json_io.dump_array(self.iter_expanded(), output_file)
+        else:
+            json_io.dump(self.to_json(pass_to_pass_format), output_file)
+
+    @classmethod
+    def load(cls, input_file: str | Path) -> "PassToPassTestIds":
+        return cls.from_json(json_io.load(input_file))
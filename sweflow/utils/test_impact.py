@@ -0,0 +1,64 @@
+from typing import Dict, List, Iterable
+from pathlib import Path
+
+from sweflow.utils import json_io
+
+
+class TestImpactIndex:
+    """
+    Inverted index from core node to the tests whose runtime dependency graph covers it.
+
+    Tests are stored once in an ordered list, and every node maps to the positions of its covering tests.
+    """
+
+    __test__ = False  # not a pytest test class
+
+    def __init__(self, test_ids: List[str] = None, nodes: Dict[str, List[int]] = None):
+        """
+        Initialize the index.
+
+        :param test_ids: The ordered list of indexed test ids.
+        :param nodes: The positions in `test_ids` of the tests covering each node.
+        """
+        self.test_ids = test_ids if test_ids is not None else []
+        self.nodes = nodes if nodes is not None else {}
+
+    @classmethod
+    def build(cls, covered_nodes: Dict[str, Iterable[str]]) -> "TestImpactIndex":
+        """
+        Build the index from the core nodes covered by each test.
+        """
+        test_ids = list(covered_nodes)
+        nodes = {}
+        for position, test_id in enumerate(test_ids):
+            for node in covered_nodes[test_id]:
+                nodes.setdefault(node, []).append(position)
+        return cls(test_ids, {node: nodes[node] for node in sorted(nodes)})
+
+    def nodes_in_files(self, filepaths: Iterable[str]) -> List[str]:
+        """
+        Get the indexed nodes defined in the given files (node ids are `<filepath>:<lineno>:<name>`).
+        """
+        filepaths = set(filepaths)
+        return [node for node in self.nodes if node.split(':', 1)[0] in filepaths]
+
+    def select(self, test_ids: List[str], changed_nodes: Iterable[str]) -> List[str]:
+        """
+        Select the tests impacted by changes to the given nodes, keeping their order.
+
+        Tests missing from the index have no known coverage, so they are always selected.
+        """
+        impacted = set()
+        for node in changed_nodes:
+            impacted.update(self.nodes.get(node, []))
+        impacted_ids = {self.test_ids[position] for position in impacted}
+        indexed_ids = set(self.test_ids)
+        return [test_id for test_id in test_ids if test_id in impacted_ids or test_id not in indexed_ids]
+
+    def dump(self, output_file: str | Path):
+        json_io.dump({"test-ids": self.test_ids, "nodes": self.nodes}, output_file)
+
+    @classmethod
+    def load(cls, input_file: str | Path) -> "TestImpactIndex":
+        data = json_io.load(input_file)
+        return cls(data['test-ids'], data['nodes'])
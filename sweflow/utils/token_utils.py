@@ -1,11 +1,24 @@
-from typing import Dict, List
+from typing import Dict, List, TYPE_CHECKING
+from functools import lru_cache
 
-import tiktoken
+from sweflow.utils.profiling import profiled
+
+if TYPE_CHECKING:
+    import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "o200k_base") -> "tiktoken.Encoding":
+    """Returns the encoder of an encoding, loaded (along with tiktoken) once per process."""
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
 
 
 class TokenCounter:
 
     @classmethod
+    @profiled("token-counting")
     def count_tokens(cls, string: None | str | Dict[str, str] | List[Dict[str, str]], encoding_name: str = "o200k_base") -> int:
         """
         Count the number of tokens in a string, dictionary of strings, or list of dictionaries of strings.
@@ -22,22 +35,47 @@ class TokenCounter:
     @classmethod
     def count_tokens_of_string(cls, string: str, encoding_name: str = "o200k_base") -> int:
         """Returns the number of tokens in a text string."""
-        encoding = tiktoken.get_encoding(encoding_name)
+        encoding = get_encoding(encoding_name)
         num_tokens = len(encoding.encode(string, allowed_special="all"))
         return num_tokens
 
     @classmethod
-    def count_tokens_of_dict_of_strings(cls, strings: Dict[str, str], encoding_name: str = "o200k_base") -> int:
+    def count_tokens_batch(cls, strings: List[str], encoding_name: str = "o200k_base", num_threads: int = 8) -> List[int]:
+        """Returns the number of tokens of each text string, encoded in parallel threads."""
+        encoding = get_encoding(encoding_name)
+        return [len(tokens) for tokens in encoding.encode_batch(strings, num_threads=num_threads, allowed_special="all")]
+
+    @classmethod
+    def count_tokens_of_dict_of_strings(cls, strings: Dict[str, str], encoding_name: str = "o200k_base", num_threads: int = 8) -> int:
         """Returns the number of tokens in a dictionary of text strings."""
-        num_tokens = 0
-        for key, string in strings.items():
-            num_tokens += cls.count_tokens_of_string(string, encoding_name)
-        return num_tokens
+        return sum(cls.count_tokens_batch(list(strings.values()), encoding_name, num_threads))
 
     @classmethod
-    def count_tokens_of_list_of_dicts_of_strings(cls, strings: List[Dict[str, str]], encoding_name: str = "o200k_base") -> int:
+    def count_tokens_of_list_of_dicts_of_strings(cls, strings: List[Dict[str, str]], encoding_name: str = "o200k_base", num_threads: int = 8) -> int:
         """Returns the number of tokens in a list of dictionaries of text strings."""
-        num_tokens = 0
-        for string_dict in strings:
-            num_tokens += cls.count_tokens_of_dict_of_strings(string_dict, encoding_name)
-        return num_tokens
+        values = [string for string_dict in strings for string in string_dict.values()]
+        return sum(cls.count_tokens_batch(values, encoding_name, num_threads))
+
+    @classmethod
+    @profiled("token-counting")
+    def at_least(cls, string: str, n: int, encoding_name: str = "o200k_base") -> bool:
+        """
+        Returns whether a text string has at least `n` tokens, without encoding all of it when possible.
+
+        A token covers at least one byte, so short strings are rejected without encoding. Longer strings
+        are encoded in growing prefixes cut at line boundaries, and the check stops as soon as a prefix
+        reaches `n` tokens.
+        """
+        if n <= 0:
+            return True
+        if len(string) < n and len(string.encode("utf-8")) < n:
+            return False
+
+        encoding = get_encoding(encoding_name)
+        end = 4 * n
+        while end < len(string):
+            cut = string.rfind("\n", 0, end)
+            if cut > 0 and len(encoding.encode(string[:cut], allowed_special="all")) >= n:
+                return True
+            end *= 4
+        return len(encoding.encode(string, allowed_special="all")) >= n
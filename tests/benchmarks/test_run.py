@@ -0,0 +1,22 @@
+from sweflow.benchmarks.run import BASELINE_FILE, BENCHMARKS, compare_with_baseline
+from sweflow.utils import json_io
+
+
+def test_stored_baseline_covers_every_benchmark():
+    baseline = json_io.load(BASELINE_FILE)["results"]
+
+    for scale in ("small", "medium"):
+        assert {item["benchmark"] for item in baseline if item["scale"] == scale} == set(BENCHMARKS)
+
+
+def test_compare_with_baseline():
+    baseline = [{"benchmark": "merge", "scale": "small", "min": 1.0}, {"benchmark": "schedule", "scale": "small", "min": 2.0}]
+    results = [
+        {"benchmark": "merge", "scale": "small", "min": 1.5},
+        {"benchmark": "schedule", "scale": "small", "min": 2.0},
+        {"benchmark": "generate-patch-git", "scale": "small", "min": 0.1},
+    ]
+
+    comparison = compare_with_baseline(results, baseline, max_regression=1.25)
+
+    assert [(item["benchmark"], item["ratio"], item["regressed"]) for item in comparison] == [("merge", 1.5, True), ("schedule", 1.0, False)]
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def make_project(tmp_path):
+    """
+    Write the files of a project, given as a mapping of `filepath -> content`, and return its root.
+    """
+
+    def make_project(files, name="project"):
+        project_root = tmp_path / name
+        for filepath, content in files.items():
+            path = project_root / filepath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+        return str(project_root)
+
+    return make_project
+
+
+@pytest.fixture
+def codebase_repo(tmp_path, make_project):
+    """
+    Build a codebase repository from a project, as `create_codebase` does.
+    """
+    from sweflow.extensions.python.helper import reinit_codebase
+
+    def codebase_repo(files):
+        project_root = make_project(files)
+        return project_root, reinit_codebase(project_root, str(tmp_path / "codebase"))
+
+    return codebase_repo
+
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    """
+    Count tokens with a byte-level encoding, which needs no download, and return the length of every encoded string.
+    """
+    import tiktoken
+
+    from sweflow.utils import token_utils
+
+    encoding = tiktoken.Encoding(
+        "bytes",
+        pat_str=r"""[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    encoded_lengths = []
+
+    class RecordingEncoding:
+        def encode(self, string, **kwargs):
+            encoded_lengths.append(len(string))
+            return encoding.encode(string, **kwargs)
+
+        def encode_batch(self, strings, **kwargs):
+            return encoding.encode_batch(strings, **kwargs)
+
+    monkeypatch.setattr(token_utils, "get_encoding", lambda encoding_name="o200k_base": RecordingEncoding())
+    return encoded_lengths
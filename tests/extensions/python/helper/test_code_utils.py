@@ -0,0 +1,71 @@
+import ast
+
+import pytest
+
+from sweflow.extensions.python.helper import generate_patch, split_lines
+from sweflow.extensions.python.helper.code_utils import estimate_patch_lines, skeletonize_file
+
+FILEPATH = "pkg/mod.py"
+SOURCE = '''import os
+
+
+def target(a, b):
+    """Add."""
+    total = a + b
+    return total
+
+
+def helper(x):
+    return x * 2
+
+
+def stub():
+    ...
+
+
+class K:
+
+    @staticmethod
+    def method():
+
+        def inner():
+            return 1
+        return inner()
+'''
+
+
+def changed_lines(target_core_nodes, dependent_core_nodes):
+    skeleton, reference = skeletonize_file({"filepath": FILEPATH, "content": SOURCE}, target_core_nodes, dependent_core_nodes, {})
+    patch = generate_patch([{"filepath": FILEPATH, "content": skeleton}], [{"filepath": FILEPATH, "content": reference}])
+    return [line for line in split_lines(patch) if line[:1] in ("+", "-") and line[:4] not in ("+++ ", "--- ")]
+
+
+@pytest.mark.parametrize("target_core_nodes, dependent_core_nodes", [
+    ([], []),
+    ([f"{FILEPATH}:4:target"], []),
+    ([f"{FILEPATH}:4:target"], [f"{FILEPATH}:10:helper"]),
+    ([], [f"{FILEPATH}:10:helper"]),
+    # a stub is its own skeleton
+    ([f"{FILEPATH}:14:stub"], []),
+    ([f"{FILEPATH}:20:method"], []),
+    # nested functions are not nodes of their own
+    ([f"{FILEPATH}:23:inner"], []),
+])
+def test_estimate_is_zero_exactly_for_empty_patches(target_core_nodes, dependent_core_nodes):
+    estimate = estimate_patch_lines(ast.parse(SOURCE), FILEPATH, target_core_nodes, dependent_core_nodes)
+    patch_lines = changed_lines(target_core_nodes, dependent_core_nodes)
+
+    assert (estimate == 0) == (not patch_lines)
+    # the estimate counts the removed lines, up to the docstring and the `...` the skeleton puts in their place
+    assert estimate <= len(patch_lines) + 1
+
+
+def test_estimate_counts_the_spans_of_functions():
+    tree = ast.parse(SOURCE)
+
+    # the body of `target`, from its docstring
+    assert estimate_patch_lines(tree, FILEPATH, [f"{FILEPATH}:4:target"], []) == 3
+    # the whole of `helper`
+    assert estimate_patch_lines(tree, FILEPATH, [], [f"{FILEPATH}:10:helper"]) == 2
+    # the body of `method`, nested function included, identified by the line of its decorator
+    assert estimate_patch_lines(tree, FILEPATH, [f"{FILEPATH}:20:method"], []) == 3
@@ -0,0 +1,68 @@
+import os
+import subprocess
+
+import pytest
+
+from sweflow.extensions.python.helper.codebase import compile_excludes, snapshot_codebase
+
+PATTERNS = [
+    "# build outputs",
+    "",
+    "*.log",
+    "!keep.log",
+    "build/",
+    "/docs/*.md",
+    "data/**/raw",
+    "tmp?.py",
+    "cache[0-9]",
+]
+
+
+@pytest.mark.parametrize("relpath, is_dir, excluded", [
+    ("app.log", False, True),
+    ("pkg/deep/app.log", False, True),
+    ("pkg/keep.log", False, False),
+    ("build", True, True),
+    ("pkg/build", True, True),
+    # directory-only patterns leave files alone
+    ("build", False, False),
+    ("docs/index.md", False, True),
+    ("docs/api/index.md", False, False),
+    ("pkg/docs/index.md", False, False),
+    ("data/raw", True, True),
+    ("data/a/b/raw", True, True),
+    ("other/data/raw", True, False),
+    ("tmp1.py", False, True),
+    ("tmp10.py", False, False),
+    ("cache7", True, True),
+    ("cachex", True, False),
+    ("# build outputs", False, False),
+    ("pkg/mod.py", False, False),
+])
+def test_compile_excludes(relpath, is_dir, excluded):
+    assert compile_excludes(PATTERNS)(relpath, is_dir) == excluded
+
+
+def test_last_matching_pattern_wins():
+    assert not compile_excludes(["*.py", "!setup.py"])("setup.py", False)
+    assert compile_excludes(["!setup.py", "*.py"])("setup.py", False)
+
+
+def test_no_patterns_exclude_nothing():
+    assert not compile_excludes([])("anything", True)
+    assert not compile_excludes(None)("anything", False)
+
+
+def test_excludes_leave_the_git_metadata_whole(make_project, tmp_path):
+    project_root = make_project({"pkg/mod.py": "x = 1\n", "pkg/index": "kept out\n", "debug.pack": ""})
+    env = {**os.environ, "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1"}
+    for args in (["init", "-q"], ["add", "pkg/mod.py"], ["-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", "init"], ["gc", "-q"]):
+        subprocess.run(["git", *args], cwd=project_root, env=env, check=True)
+    codebase_dir = tmp_path / "codebase"
+
+    snapshot_codebase(project_root, str(codebase_dir), excludes=["*.pack", "*.idx", "index", "logs/"])
+
+    assert not (codebase_dir / "pkg" / "index").exists() and not (codebase_dir / "debug.pack").exists()
+    assert list((codebase_dir / ".git" / "objects" / "pack").glob("*.pack"))
+    assert (codebase_dir / ".git" / "index").exists() and (codebase_dir / ".git" / "logs").is_dir()
+    subprocess.run(["git", "fsck", "--no-progress"], cwd=codebase_dir, env=env, check=True, capture_output=True)
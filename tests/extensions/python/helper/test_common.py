@@ -0,0 +1,235 @@
+import os
+import subprocess
+
+import pytest
+
+from sweflow.extensions.python.create_codebase import prepare_step
+from sweflow.extensions.python.helper import (
+    apply_patch_to_files,
+    convert_patch_to_replace,
+    generate_patch,
+    generate_patch_from_commits,
+    get_patch_filepaths,
+    list_ignored_files,
+    parse_replace_blocks,
+    split_lines,
+    update_codebase_on_schedule,
+)
+
+SPECIAL_LINES = {
+    "form-feed": "\x0c",
+    "file-separator": "x = '\x1c'",
+    "next-line": "x = '\x85'",
+    "line-separator": "x = '\u2028'",
+}
+
+
+def test_split_lines_only_breaks_on_newlines():
+    assert split_lines("a\n\x0c\nb c\n") == ["a", "\x0c", "b c"]
+    assert split_lines("a\nb") == ["a", "b"]
+    assert split_lines("") == []
+
+
+@pytest.mark.parametrize("special_line", SPECIAL_LINES.values(), ids=SPECIAL_LINES.keys())
+def test_backends_agree_through_replace(codebase_repo, special_line):
+    _, repo = codebase_repo({"pkg/mod.py": "x = 0\n"})
+    skeleton_files = [{"filepath": "pkg/mod.py", "content": f"def f():\n{special_line}\n    pass\n\ny = 1\n"}]
+    reference_files = [{"filepath": "pkg/mod.py", "content": f"def f():\n{special_line}\n    return 1\n\ny = 1\n"}]
+    update_codebase_on_schedule(repo, {"step": 0}, skeleton_files, reference_files)
+
+    git_patch = generate_patch_from_commits(repo.working_dir, "step-0-skeleton", "step-0-reference")
+    difflib_patch = generate_patch(skeleton_files, reference_files)
+
+    # the special line stays one context line of its hunk
+    assert f" {special_line}" in split_lines(git_patch)
+    skeleton = {"pkg/mod.py": skeleton_files[0]["content"]}
+    reference = {"pkg/mod.py": reference_files[0]["content"]}
+    for patch in (git_patch, difflib_patch):
+        assert apply_patch_to_files(skeleton, patch) == reference
+        assert apply_patch_to_files(skeleton, convert_patch_to_replace(patch)) == reference
+
+
+def test_ignored_files_fall_back_to_difflib(codebase_repo, byte_encoding):
+    project_root, repo = codebase_repo({
+        ".gitignore": "generated.py\n",
+        "pkg/__init__.py": "",
+        "pkg/generated.py": "def add(a, b):\n    total = a + b\n    return total\n",
+    })
+    assert list_ignored_files(repo.working_dir, ["pkg/generated.py", "pkg/__init__.py"]) == ["pkg/generated.py"]
+    schedule = {
+        "step": 0,
+        "target-core-nodes": ["pkg/generated.py:1:add"],
+        "dependent-core-nodes": [],
+        "nodes-to-develop": ["pkg/generated.py:1:add"],
+    }
+
+    outputs = prepare_step(project_root, repo, schedule, {}, diff_backend="git")
+
+    # the ignored file is in neither commit, so git alone would see no change
+    assert generate_patch_from_commits(repo.working_dir, "step-0-skeleton", "step-0-reference") == "\n"
+    assert outputs["reference-patch"] == generate_patch(outputs["skeleton-files"], outputs["reference-files"])
+    skeleton = {file["filepath"]: file["content"] for file in outputs["skeleton-files"]}
+    # the skeletonized files lack the final newline that patching adds back
+    reference = {file["filepath"]: file["content"] + "\n" for file in outputs["reference-files"]}
+    assert skeleton != reference
+    assert apply_patch_to_files(skeleton, outputs["reference-patch"]) == reference
+
+
+def test_parse_replace_blocks_accepts_both_layouts():
+    # the layout of `convert_patch_to_replace`, the replace lines after the marker
+    ours = "```replace: a.py\n<<<<<<< SEARCH\nx = 0\n=======\n>>>>>>> REPLACE\nx = 1\n```"
+    # the usual layout, the replace lines before the marker
+    usual = "```replace: a.py\n<<<<<<< SEARCH\nx = 0\n=======\nx = 1\n>>>>>>> REPLACE\n```"
+
+    assert parse_replace_blocks(ours) == parse_replace_blocks(usual) == [("a.py", ["x = 0"], ["x = 1"])]
+
+
+def test_parse_replace_blocks_keeps_markers_inside_blocks():
+    content = "\n".join([
+        "```replace: a.py",
+        "<<<<<<< SEARCH",
+        "```",
+        "=======",
+        "=======",
+        ">>>>>>> REPLACE",
+        "```replace: b.py",
+        "<<<<<<< SEARCH",
+        "=======",
+        ">>>>>>> REPLACE",
+        "y = 2",
+        "<<<<<<< SEARCH",
+        "y = 2",
+        "=======",
+        ">>>>>>> REPLACE",
+        "```",
+    ])
+
+    assert parse_replace_blocks(content) == [
+        ("a.py", ["```"], ["======="]),
+        ("b.py", [], ["y = 2"]),
+        ("b.py", ["y = 2"], []),
+    ]
+
+
+def test_apply_patch_to_files_edits_in_order():
+    files = {"a.py": "x = 0\nz = 0\nx = 0\n", "new.py": None}
+    patch = "\n".join([
+        "```replace: a.py",
+        "<<<<<<< SEARCH",
+        "x = 0",
+        "=======",
+        ">>>>>>> REPLACE",
+        "x = 1",
+        "<<<<<<< SEARCH",
+        "x = 0",
+        "=======",
+        ">>>>>>> REPLACE",
+        "x = 2",
+        "```",
+        "```replace: new.py",
+        "<<<<<<< SEARCH",
+        "=======",
+        ">>>>>>> REPLACE",
+        "created = True",
+        "```",
+    ])
+
+    # the second block matches after the first one
+    assert apply_patch_to_files(files, patch) == {"a.py": "x = 1\nz = 0\nx = 2\n", "new.py": "created = True\n"}
+
+
+def test_apply_patch_to_files_deletes_files_of_unified_diffs():
+    patch = "--- gone.py\n+++ /dev/null\n@@ -1,1 +0,0 @@\n-x = 0\n"
+
+    assert apply_patch_to_files({"gone.py": "x = 0\n"}, patch) == {"gone.py": None}
+
+
+def test_apply_patch_to_files_rejects_missing_search():
+    patch = "```replace: a.py\n<<<<<<< SEARCH\ny = 0\n=======\n>>>>>>> REPLACE\ny = 1\n```"
+
+    with pytest.raises(ValueError):
+        apply_patch_to_files({"a.py": "x = 0\n"}, patch)
+    with pytest.raises(ValueError):
+        apply_patch_to_files({"a.py": None}, patch)
+
+
+def git_diff(repo_dir, old_files, new_files):
+    """
+    Commit the old files, stage the new ones (None deletes a file) and return the plain `git diff` between them.
+    """
+    env = {**os.environ, "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1"}
+
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=repo_dir, env=env, check=True, capture_output=True, text=True).stdout
+
+    def write(files):
+        for filepath, content in files.items():
+            path = repo_dir / filepath
+            if content is None:
+                path.unlink()
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(content)
+
+    repo_dir.mkdir()
+    git("init", "-q")
+    write(old_files)
+    git("add", "-A")
+    git("-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-q", "-m", "old")
+    write(new_files)
+    git("add", "-A")
+    return git("diff", "--cached")
+
+
+def test_git_diffs_apply(tmp_path):
+    old_files = {
+        "m.py": "x = 1\n",
+        # a removed `-- ...` and an added `++ ...` line read as `--- ...` and `+++ ...` in the hunk
+        "queries.sql": "select 1;\n-- drop table t;\nselect 2;\n",
+        "pkg/no_newline.py": "a = 1\nb = 2",
+        "pkg/gone.py": "gone = True\n",
+    }
+    new_files = {
+        "m.py": "x = 2\n",
+        "queries.sql": "select 1;\n++ counter;\nselect 2;\n",
+        "pkg/no_newline.py": "a = 1\nb = 3",
+        "pkg/gone.py": None,
+        "pkg/new.py": "new = True\n",
+    }
+    patch = git_diff(tmp_path / "repo", old_files, new_files)
+    assert "\n--- drop table t;\n+++ counter;\n" in patch
+    assert "\\ No newline at end of file" in patch
+
+    filepaths = get_patch_filepaths(patch)
+
+    assert sorted(filepaths) == sorted(old_files.keys() | new_files.keys())
+    files = {filepath: old_files.get(filepath) for filepath in filepaths}
+    # patched files end with a newline
+    expected = {filepath: content if content is None or content.endswith("\n") else content + "\n" for filepath, content in new_files.items()}
+    assert apply_patch_to_files(files, patch) == expected
+    assert apply_patch_to_files(files, convert_patch_to_replace(patch)) == {**expected, "pkg/gone.py": ""}
+
+
+def test_git_diff_of_a_one_line_edit(tmp_path):
+    patch = git_diff(tmp_path / "repo", {"m.py": "x = 1\n"}, {"m.py": "x = 2\n"})
+
+    assert get_patch_filepaths(patch) == ["m.py"]
+    assert apply_patch_to_files({"m.py": "x = 1\n"}, patch) == {"m.py": "x = 2\n"}
+
+
+def test_git_backend_ignores_config_and_attributes(codebase_repo, tmp_path, monkeypatch):
+    # a user config and repository settings changing the context, the blank lines and the binary detection
+    user_config = tmp_path / "gitconfig"
+    user_config.write_text("[diff]\n\tcontext = 1\n\tsuppressBlankEmpty = true\n\tnoprefix = false\n")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(user_config))
+    _, repo = codebase_repo({".gitattributes": "*.py -diff\n", "pkg/mod.py": "x = 0\n"})
+    with repo.config_writer() as config:
+        config.set_value("diff", "context", "0")
+    content = "def f():\n    a = 1\n\n    b = 2\n\n    c = 3\n\n    return {}\n"
+    skeleton_files = [{"filepath": "pkg/mod.py", "content": content.format("a")}]
+    reference_files = [{"filepath": "pkg/mod.py", "content": content.format("a + b + c")}]
+    update_codebase_on_schedule(repo, {"step": 0}, skeleton_files, reference_files)
+
+    git_patch = generate_patch_from_commits(repo.working_dir, "step-0-skeleton", "step-0-reference")
+
+    assert git_patch == generate_patch(skeleton_files, reference_files)
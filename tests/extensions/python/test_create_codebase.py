@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import argparse
+
+import pytest
+
+from sweflow.extensions.python.create_codebase import add_codebase_arguments, create_codebase
+
+FILES = {
+    "pkg/__init__.py": "",
+    "pkg/mod.py": "def add(a, b):\n    return a + b\n\n\ndef mul(a, b):\n    return a * b\n",
+}
+SCHEDULE = [
+    {"step": step, "target-core-nodes": [node], "dependent-core-nodes": [], "nodes-to-develop": [node], "test-ids": [f"tests/test_mod.py::test_{name}"]}
+    for step, (node, name) in enumerate([("pkg/mod.py:1:add", "add"), ("pkg/mod.py:5:mul", "mul")])
+]
+
+
+@pytest.fixture
+def codebase_args(tmp_path, make_project, byte_encoding):
+    def codebase_args(*options):
+        parser = argparse.ArgumentParser()
+        add_codebase_arguments(parser)
+        args = parser.parse_args(["--work-dir", str(tmp_path / "work"), "--origin-archive", "never", *options])
+        args.project_root = make_project(FILES)
+        args.output_codebase_dir = str(tmp_path / "output-codebase")
+        args.output_dir = str(tmp_path / "output")
+        return args
+
+    return codebase_args
+
+
+def test_resume_from_truncated_checkpoint(codebase_args):
+    args = codebase_args()
+    outputs = create_codebase(args, SCHEDULE, {})
+    checkpoint_file = f"{args.work_dir}/checkpoint.jsonl"
+    with open(checkpoint_file, "rb") as f:
+        first_line, second_line = f.readlines()
+    # interrupted while writing the checkpoint of the last step
+    with open(checkpoint_file, "wb") as f:
+        f.write(first_line + second_line[:len(second_line) // 2])
+
+    resumed_outputs = create_codebase(codebase_args("--resume"), SCHEDULE, {})
+
+    for name in ("skeleton-files", "reference-files", "reference-patches", "step-flags"):
+        assert resumed_outputs[name] == outputs[name]
+    assert resumed_outputs["base-commits"][0] == outputs["base-commits"][0]
+    assert resumed_outputs["pass-to-pass-test-ids"].to_json() == outputs["pass-to-pass-test-ids"].to_json()
+    with open(checkpoint_file, "rb") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_resume_rejects_changed_inputs(codebase_args):
+    create_codebase(codebase_args(), SCHEDULE, {})
+
+    docstrings = {"pkg/mod.py:1:add": {"docstring": "Add two numbers."}}
+    with pytest.raises(ValueError, match="other inputs"):
+        create_codebase(codebase_args("--resume"), SCHEDULE, docstrings)
+    with pytest.raises(ValueError, match="other inputs"):
+        create_codebase(codebase_args("--resume", "--diff-backend", "difflib"), SCHEDULE, {})
+
+
+def test_resume_rejects_changed_project(codebase_args):
+    args = codebase_args()
+    create_codebase(args, SCHEDULE, {})
+    with open(f"{args.project_root}/pkg/extra.py", "w") as f:
+        f.write("y = 1\n")
+
+    # the project is not a git repository, so it is recognized by its files
+    with pytest.raises(ValueError, match="other inputs"):
+        create_codebase(codebase_args("--resume"), SCHEDULE, {})
+
+
+@pytest.mark.parametrize("origin_archive, archived", [("always", True), ("never", False)])
+def test_origin_archive_skips_the_worktree_check(codebase_args, monkeypatch, origin_archive, archived):
+    monkeypatch.setattr(
+        "sweflow.extensions.python.create_codebase.is_worktree_committed", lambda repo: pytest.fail("checked without `auto`")
+    )
+    args = codebase_args("--origin-archive", origin_archive)
+
+    create_codebase(args, SCHEDULE, {})
+
+    assert any(path.name.startswith("codebase.origin") for path in Path(args.output_codebase_dir).iterdir()) == archived
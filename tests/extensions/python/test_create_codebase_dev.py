@@ -0,0 +1,14 @@
+from sweflow.extensions.python.create_codebase_dev import get_step_commit_hashes
+from sweflow.extensions.python.helper import update_codebase_on_schedule
+
+
+def test_step_commit_hashes_with_ambiguous_tags(codebase_repo):
+    _, repo = codebase_repo({"mod.py": "x = 0\n"})
+    commits = update_codebase_on_schedule(repo, {"step": 0}, [{"filepath": "mod.py", "content": "x = 1\n"}], [{"filepath": "mod.py", "content": "x = 2\n"}])
+    # a tag of the same name makes the short name of the branch `heads/step-0-skeleton`
+    repo.create_tag("step-0-skeleton", ref="main")
+
+    assert get_step_commit_hashes(repo.working_dir) == {
+        "step-0-skeleton": commits["base-commit"],
+        "step-0-reference": commits["reference-commit"],
+    }
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from sweflow.extensions.python.evaluate import junit_address, run_tests
+from sweflow.extensions.python.helper import generate_patch_from_commits, update_codebase_on_schedule
+
+TESTS = '''
+import pytest
+
+
+@pytest.mark.parametrize("value", ["a - b", "c"])
+def test_value(value):
+    assert value != "c"
+
+
+class TestGroup:
+
+    def test_pass(self):
+        pass
+
+    @pytest.mark.xfail
+    def test_xfail(self):
+        assert False
+
+    def test_skip(self):
+        pytest.skip("not here")
+'''
+
+
+def test_junit_address():
+    assert junit_address("tests/test_a.py::TestB::test_c[x - y]") == ("tests.test_a.TestB", "test_c[x - y]")
+    assert junit_address("test_a.py::test_b[a::b]") == ("test_a", "test_b[a::b]")
+
+
+def test_run_tests_reports_ids_with_dashes(make_project):
+    project_root = Path(make_project({"tests/test_mod.py": TESTS}))
+    test_ids = [
+        "tests/test_mod.py::test_value[a - b]",
+        "tests/test_mod.py::test_value[c]",
+        "tests/test_mod.py::TestGroup::test_pass",
+        "tests/test_mod.py::TestGroup::test_xfail",
+        "tests/test_mod.py::TestGroup::test_skip",
+    ]
+
+    outcomes, timed_out = run_tests(project_root, test_ids, timeout=60)
+
+    assert not timed_out
+    assert outcomes == {
+        "tests/test_mod.py::test_value[a - b]": "PASSED",
+        "tests/test_mod.py::test_value[c]": "FAILED",
+        "tests/test_mod.py::TestGroup::test_pass": "PASSED",
+        "tests/test_mod.py::TestGroup::test_xfail": "XFAIL",
+        "tests/test_mod.py::TestGroup::test_skip": "SKIPPED",
+    }
+    assert not (project_root.parent / f"{project_root.name}.junit.xml").exists()
+
+
+def test_base_commit_is_the_skeleton_commit(codebase_repo):
+    _, repo = codebase_repo({"mod.py": "x = 0\n"})
+
+    commits = update_codebase_on_schedule(repo, {"step": 0}, [{"filepath": "mod.py", "content": "x = 1\n"}], [{"filepath": "mod.py", "content": "x = 2\n"}])
+
+    # the reference patch applies to the base commit
+    assert commits["base-commit"] == repo.commit("step-0-skeleton").hexsha
+    assert commits["reference-commit"] == repo.commit("step-0-reference").hexsha
+    assert generate_patch_from_commits(repo.working_dir, commits["base-commit"], commits["reference-commit"]) == "--- mod.py\n+++ mod.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n"
@@ -0,0 +1,39 @@
+import sys
+import json
+import subprocess
+
+from sweflow.utils import json_io
+
+TESTS = '''
+from pkg.mod import double
+
+
+def test_double():
+    assert double(2) == 4
+'''
+
+
+def test_tracer_imports_without_pytest():
+    code = "import sys; sys.modules['pytest'] = None; import sweflow.extensions.python.tracer"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_tracer_records_call_relations(make_project, tmp_path):
+    project_root = make_project({
+        "pkg/__init__.py": "",
+        "pkg/mod.py": "def double(x):\n    return add(x, x)\n\n\ndef add(a, b):\n    return a + b\n",
+        "tests/test_mod.py": TESTS,
+    })
+    output_dir = tmp_path / "traces"
+
+    subprocess.run(
+        [sys.executable, "-m", "sweflow.extensions.python.tracer", "--project-root", project_root, "--output-dir", str(output_dir)],
+        check=True, capture_output=True,
+    )
+
+    traces = [json.loads(line) for shard in output_dir.glob("traces-*.jsonl") for line in shard.read_text().splitlines()]
+    assert [trace["test-id"] for trace in traces] == ["tests/test_mod.py::test_double"]
+    assert traces[0]["test-func-id"] == "tests/test_mod.py:5:test_double"
+    relations = {(relation["caller"]["func_name"], relation["callee"]["func_name"]) for relation in traces[0]["call-relations"]}
+    assert relations == {("test_double", "double"), ("double", "add")}
+    assert json_io.load(output_dir / "trace-stats.json")["tests"] == 1
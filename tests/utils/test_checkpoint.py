@@ -0,0 +1,58 @@
+from sweflow.utils.checkpoint import StepCheckpoint
+
+
+def step_record(step, content):
+    return {
+        "step": step,
+        "skeleton-files": [{"filepath": "pkg/mod.py", "content": "def f():\n    ...\n"}],
+        "reference-files": [{"filepath": "pkg/mod.py", "content": content}],
+        "reference-patch": f"patch {step}",
+    }
+
+
+def test_checkpoint_round_trip_shares_blobs(tmp_path):
+    checkpoint = StepCheckpoint(tmp_path / "work" / "checkpoint.jsonl")
+    checkpoint.reset()
+    records = [step_record(0, "def f():\n    return 0\n"), step_record(1, "def f():\n    return '\udcff'\n")]
+    for record in records:
+        checkpoint.append(record)
+    checkpoint.close()
+
+    completed_steps = checkpoint.load()
+
+    assert list(completed_steps) == [0, 1]
+    assert completed_steps[0]["skeleton-files"] == completed_steps[1]["skeleton-files"]
+    assert [checkpoint.restore(completed_steps[step]) for step in (0, 1)] == records
+    # the shared skeleton is stored once
+    assert len([path for path in checkpoint.blob_dir.rglob("*") if path.is_file()]) == 3
+
+
+def test_checkpoint_load_drops_partial_last_line(tmp_path):
+    checkpoint = StepCheckpoint(tmp_path / "checkpoint.jsonl")
+    checkpoint.reset()
+    checkpoint.append(step_record(0, "a\n"))
+    checkpoint.close()
+    complete_size = checkpoint.checkpoint_file.stat().st_size
+    with open(checkpoint.checkpoint_file, "a") as f:
+        f.write('{"step": 1, "skeleton-files": {"pkg/mod.py": "ab')
+
+    assert list(checkpoint.load()) == [0]
+    assert checkpoint.checkpoint_file.stat().st_size == complete_size
+
+    # records appended after the truncation are loaded again
+    checkpoint.append(step_record(1, "b\n"))
+    checkpoint.close()
+    completed_steps = checkpoint.load()
+    assert checkpoint.restore(completed_steps[1]) == step_record(1, "b\n")
+
+
+def test_checkpoint_reset_removes_blobs(tmp_path):
+    checkpoint = StepCheckpoint(tmp_path / "checkpoint.jsonl")
+    checkpoint.reset()
+    checkpoint.append(step_record(0, "a\n"))
+    checkpoint.close()
+
+    checkpoint.reset()
+
+    assert checkpoint.load() == {}
+    assert not checkpoint.blob_dir.exists()
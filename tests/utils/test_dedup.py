@@ -0,0 +1,71 @@
+import numpy as np
+
+from sweflow.utils import json_io
+from sweflow.utils.dedup import find_duplicates, fingerprint_shard, normalize_patch
+
+PATCH = """--- a.sql
++++ a.sql
+@@ -1,3 +1,3 @@
+ select 1;
+--- drop the old table
++++ keep the new table
+ select 2;
+"""
+
+
+def test_normalize_patch_drops_headers_and_line_numbers():
+    moved = PATCH.replace("a.sql", "b.sql").replace("@@ -1,3 +1,3 @@", "@@ -10,3 +12,3 @@")
+    assert normalize_patch(PATCH) == normalize_patch(moved)
+    assert normalize_patch(PATCH) == "@@\n select 1;\n--- drop the old table\n+++ keep the new table\n select 2;"
+
+
+def test_normalize_patch_keeps_hunk_lines_looking_like_headers():
+    other = PATCH.replace("--- drop the old table", "--- drop another table")
+    assert normalize_patch(PATCH) != normalize_patch(other)
+
+
+def test_normalize_patch_reads_hunks_without_counts():
+    patch = "--- a\n+++ a\n@@ -1 +1 @@\n--- x\n+++ y\n--- b\n+++ b\n@@ -5 +5 @@\n-1\n+2\n"
+    assert normalize_patch(patch) == "@@\n--- x\n+++ y\n@@\n-1\n+2"
+
+
+def _fingerprint(instance_id, signature):
+    return (instance_id, None, {"patch": np.array(signature, dtype=np.uint32)})
+
+
+def test_near_duplicates_are_compared_with_every_bucket_member():
+    # all three share the first band, only the last two are similar
+    fingerprints = [
+        _fingerprint("a", [1, 1, 2, 2, 3, 3, 4, 4]),
+        _fingerprint("b", [1, 1, 5, 6, 7, 8, 9, 10]),
+        _fingerprint("c", [1, 1, 5, 0, 7, 0, 9, 0]),
+    ]
+
+    clusters, reasons = find_duplicates(fingerprints, bands=4, threshold=0.6)
+
+    assert clusters.find(0) == 0
+    assert clusters.find(2) == clusters.find(1) == 1
+    assert reasons[2] == {"near-patch"}
+
+
+def test_exact_duplicates_keep_the_first_instance():
+    fingerprints = [("a", "h1", {}), ("b", "h2", {}), ("c", "h1", {})]
+
+    clusters, reasons = find_duplicates(fingerprints)
+
+    assert [clusters.find(index) for index in range(3)] == [0, 1, 0]
+    assert reasons[2] == {"exact-patch"}
+
+
+def test_fingerprint_shard_tolerates_missing_fields(tmp_path):
+    shard = tmp_path / "shard.jsonl"
+    patch = "--- a.py\n+++ a.py\n@@ -1 +1 @@\n-x = 0\n+x = 1\n"
+    shard.write_text("".join(json_io.dumps(item, pretty=False) + "\n" for item in [
+        {"instance_id": "a", "patch": patch, "problem_statement": None},
+        {"instance_id": "b", "patch": patch},
+    ]))
+
+    fingerprints = fingerprint_shard(str(shard), ["patch", "problem_statement"], 8, 5)
+
+    assert [(instance_id, signatures["problem_statement"]) for instance_id, _, signatures in fingerprints] == [("a", None), ("b", None)]
+    assert fingerprints[0][1] == fingerprints[1][1] is not None
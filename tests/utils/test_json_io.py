@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from sweflow.utils import json_io
+
+ITEMS = [
+    {"step": 0, "patch": "line\nwith ] and , inside", "ids": ["a", "b"]},
+    [1, 2.5, None, True],
+    "text with   and \"quotes\"",
+    12345678901234567890,
+    {},
+]
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_array_writer_round_trip(tmp_path, pretty):
+    output_file = tmp_path / "items.json"
+
+    assert json_io.dump_array(iter(ITEMS), output_file, pretty) == len(ITEMS)
+
+    with open(output_file, "r", encoding="utf-8") as f:
+        assert json.load(f) == ITEMS
+    assert list(json_io.iter_array(output_file, chunk_size=7)) == ITEMS
+
+
+def test_array_writer_writes_one_item_per_line(tmp_path):
+    output_file = tmp_path / "items.json"
+    json_io.dump_array(ITEMS, output_file, pretty=False)
+
+    lines = output_file.read_text(encoding="utf-8").split("\n")
+    assert lines[0] == "[" and lines[-1] == "]"
+    assert len(lines) == len(ITEMS) + 2
+
+
+@pytest.mark.parametrize("layout", [
+    lambda items: json.dumps(items),
+    lambda items: json.dumps(items, indent=4),
+    lambda items: "  [ " + " ,\n".join(json.dumps(item) for item in items) + " ]\n",
+    # one item per line, then an item spread over several lines
+    lambda items: "[\n" + ",\n".join(json.dumps(item) for item in items[:-1]) + ",\n" + json.dumps(items[-1], indent=2) + "\n]",
+])
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_iter_array_layouts(tmp_path, layout, chunk_size):
+    input_file = tmp_path / "items.json"
+    input_file.write_text(layout(ITEMS), encoding="utf-8")
+
+    assert list(json_io.iter_array(input_file, chunk_size=chunk_size)) == ITEMS
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_iter_array_large_item(tmp_path, pretty):
+    items = [{"patch": "x" * 300_000, "lines": list(range(20_000))}, 0]
+    input_file = tmp_path / "items.json"
+    json_io.dump_array(items, input_file, pretty)
+
+    assert list(json_io.iter_array(input_file, chunk_size=64)) == items
+
+
+def test_iter_array_empty_and_invalid(tmp_path):
+    empty_file, object_file, truncated_file = tmp_path / "empty.json", tmp_path / "object.json", tmp_path / "truncated.json"
+    json_io.dump_array([], empty_file)
+    object_file.write_text('{"a": 1}')
+    truncated_file.write_text('[\n{"a": 1},\n{"b": ')
+
+    assert list(json_io.iter_array(empty_file)) == []
+    with pytest.raises(ValueError):
+        list(json_io.iter_array(object_file))
+    with pytest.raises(ValueError):
+        list(json_io.iter_array(truncated_file))
+
+
+def test_canonical_sorts_keys():
+    assert json_io.canonical({"b": 1, "a": [2, {"d": 3, "c": 4}]}) == json_io.canonical({"a": [2, {"c": 4, "d": 3}], "b": 1})
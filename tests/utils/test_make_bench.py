@@ -0,0 +1,16 @@
+from sweflow.utils import json_io
+from sweflow.utils.make_bench import BenchWriter, read_repository
+
+
+def test_bench_writer_creates_output_dir_and_index(tmp_path):
+    output_file = tmp_path / "fresh" / "bench.jsonl"
+    items = [{"repo": "a/x", "id": 0}, {"repo": "b/y", "id": 1}, {"repo": "a/x", "id": 2}, {"repo": "a/x", "id": 3}]
+
+    writer = BenchWriter(str(output_file), max_per_repo=2)
+    for item in items:
+        writer.write(item)
+    writer.close()
+
+    assert json_io.load(output_file.with_suffix(".stats.json")) == {"a/x": 2, "b/y": 1}
+    assert [item["id"] for item in read_repository(str(output_file), "a/x")] == [0, 2]
+    assert [item["id"] for item in read_repository(str(output_file), "b/y")] == [1]
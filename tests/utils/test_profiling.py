@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from sweflow.utils import profiling
+from sweflow.utils.profiling import Profiler, instrument_llm_client
+
+
+class FakeCache:
+
+    def hash(self, request):
+        return json.dumps(request, sort_keys=True)
+
+    def is_cached(self, request):
+        return request.get("cached", False)
+
+
+class FakeClient:
+    """
+    A fluxllm client whose requests wait for the rate limiter, then for the API.
+    """
+
+    def __init__(self):
+        self.cache = FakeCache()
+
+    def request(self, requests):
+        async def request_all():
+            return await asyncio.gather(*(self.execute_with_rate_limiting(request) for request in requests))
+
+        return asyncio.run(request_all())
+
+    async def execute_with_rate_limiting(self, request, **kwargs):
+        await asyncio.sleep(0.02)
+        return await self.make_request_async(request, **kwargs)
+
+    async def make_request_async(self, request, **kwargs):
+        await asyncio.sleep(0.01)
+        return f"answer-{request['id']}"
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    profiler = Profiler("test")
+    monkeypatch.setattr(profiling, "_PROFILER", profiler)
+    return profiler
+
+
+def test_instrument_llm_client(profiler):
+    client = instrument_llm_client(FakeClient())
+
+    # the same content twice, as distinct objects
+    assert client.request([{"id": 0}, {"id": 1, "cached": True}, {"id": 0}]) == ["answer-0", "answer-1", "answer-0"]
+
+    assert profiler.counters == {"llm-requests": 3, "llm-cache-hits": 1}
+    assert profiler.phases["llm-queue"]["calls"] == profiler.phases["llm-latency"]["calls"] == 3
+    assert profiler.phases["llm-queue"]["max-wall-time"] >= 0.015
+    assert profiler.phases["llm-requests"]["calls"] == 1
+
+
+def test_unsupported_client_is_left_unprofiled(profiler):
+    client = FakeClient()
+    del client.cache
+
+    assert instrument_llm_client(client) is client
+    assert client.request([{"id": 0}]) == ["answer-0"]
+    assert profiler.counters == {} and profiler.phases == {}
+
+
+def test_instrument_without_profiling(monkeypatch):
+    monkeypatch.setattr(profiling, "_PROFILER", None)
+    client = FakeClient()
+    request = client.request
+
+    assert instrument_llm_client(client).request == request
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pytest
+
+from sweflow.utils.request_stream import RequestStream
+
+
+class FakeCache:
+
+    def __init__(self, cached):
+        self.cached = set(cached)
+
+    def is_cached(self, request):
+        return request["id"] in self.cached
+
+
+class FakeClient:
+    """
+    A fluxllm client answering `answer-<id>`, holding back the requests in `gates` until their event is set.
+    """
+
+    def __init__(self, cached=(), failing=(), gates=None, concurrency=2, max_retries=1):
+        self.cache = FakeCache(cached)
+        self.failing = set(failing)
+        self.gates = gates or {}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.responses = {request_id: f"answer-{request_id}" for request_id in cached}
+        self.executed = []
+
+    async def execute_with_rate_limiting(self, request):
+        self.executed.append(request["id"])
+        gate = self.gates.get(request["id"])
+        if gate is not None:
+            await asyncio.get_running_loop().run_in_executor(None, gate.wait)
+        return None if request["id"] in self.failing else f"answer-{request['id']}"
+
+    async def save_to_cache_thread_safe(self, request, response):
+        self.responses[request["id"]] = response
+
+    def collect_responses(self, requests):
+        return [self.responses.get(request["id"]) for request in requests]
+
+
+def make_requests(*request_ids):
+    return [{"id": request_id} for request_id in request_ids]
+
+
+def test_stream_answers_all_batches():
+    clients = [FakeClient(cached=["a"]), FakeClient(concurrency=1)]
+    stream = RequestStream()
+    batches = [stream.add(clients[0], make_requests("a", "b", "c")), stream.add(clients[1], make_requests("d", "e"))]
+
+    with stream:
+        assert stream.wait(batches[0]) == ["answer-a", "answer-b", "answer-c"]
+        assert stream.wait(batches[1], [1]) == ["answer-e"]
+
+    # cached requests are not sent, the others are sent in their order
+    assert sorted(clients[0].executed) == ["b", "c"]
+    assert clients[1].executed == ["d", "e"]
+    assert all(stream.wall_time(batch) is not None for batch in batches)
+
+
+def test_wait_returns_before_the_rest_of_the_batch():
+    gate = threading.Event()
+    client = FakeClient(gates={"slow": gate})
+    stream = RequestStream()
+    batch = stream.add(client, make_requests("fast", "slow"))
+
+    with stream:
+        assert stream.wait(batch, [0]) == ["answer-fast"]
+        assert stream.wall_time(batch) is None
+        gate.set()
+
+    assert stream.wait(batch) == ["answer-fast", "answer-slow"]
+
+
+def test_failed_requests_are_given_up_after_retries():
+    client = FakeClient(failing=["bad"], max_retries=1)
+    stream = RequestStream()
+    batch = stream.add(client, make_requests("good", "bad"))
+
+    with stream:
+        assert stream.wait(batch) == ["answer-good", None]
+
+
+def test_client_errors_are_raised():
+    class BrokenClient(FakeClient):
+        async def execute_with_rate_limiting(self, request):
+            raise ConnectionError("unreachable")
+
+    stream = RequestStream()
+    batch = stream.add(BrokenClient(), make_requests("a"))
+    stream.start()
+
+    with pytest.raises(ConnectionError):
+        stream.wait(batch)
+    with pytest.raises(ConnectionError):
+        stream.join()
+
+
+def test_batches_cannot_be_added_once_started():
+    stream = RequestStream()
+    with stream:
+        with pytest.raises(RuntimeError):
+            stream.add(FakeClient(), make_requests("a"))
@@ -0,0 +1,78 @@
+import os
+import subprocess
+
+from sweflow.utils.stage_manifest import StageManifest, project_fingerprint
+
+FILES = {
+    ".gitignore": ".venv/\n.pytest_cache/\n*.egg-info/\n",
+    "pkg/__init__.py": "",
+    "pkg/mod.py": "x = 1\n",
+}
+
+
+def git(project_root, *args):
+    env = {**os.environ, "GIT_CONFIG_GLOBAL": os.devnull, "GIT_CONFIG_NOSYSTEM": "1"}
+    command = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args]
+    return subprocess.run(command, cwd=project_root, env=env, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def git_project(make_project):
+    project_root = make_project(FILES)
+    git(project_root, "init", "-q")
+    git(project_root, "add", "-A")
+    git(project_root, "commit", "-q", "-m", "init")
+    return project_root
+
+
+def input_hash(manifest_dir, project_root):
+    manifest = StageManifest(str(manifest_dir), "stage")
+    manifest.add_file("project", project_root)
+    return manifest.inputs["project"]
+
+
+def test_ignored_files_keep_the_project_clean(make_project, tmp_path):
+    project_root = git_project(make_project)
+    for filepath in (".venv/bin/python", ".pytest_cache/v/cache/lastfailed", "pkg.egg-info/PKG-INFO"):
+        os.makedirs(os.path.dirname(os.path.join(project_root, filepath)), exist_ok=True)
+        with open(os.path.join(project_root, filepath), "w") as f:
+            f.write("artifact\n")
+
+    assert project_fingerprint(project_root) == git(project_root, "rev-parse", "HEAD")
+
+    with open(os.path.join(project_root, "notes.txt"), "w") as f:
+        f.write("untracked\n")
+    assert project_fingerprint(project_root) is None
+
+
+def test_tree_hash_leaves_out_ignored_files(make_project, tmp_path):
+    project_root = git_project(make_project)
+    # an untracked file makes the project dirty, so it is hashed by content
+    with open(os.path.join(project_root, "notes.txt"), "w") as f:
+        f.write("untracked\n")
+    initial_hash = input_hash(tmp_path / "manifests", project_root)
+
+    os.makedirs(os.path.join(project_root, ".pytest_cache"))
+    with open(os.path.join(project_root, ".pytest_cache", "lastfailed"), "w") as f:
+        f.write("{}\n")
+    os.makedirs(os.path.join(project_root, "pkg", "__pycache__"))
+    with open(os.path.join(project_root, "pkg", "__pycache__", "mod.cpython-311.pyc"), "wb") as f:
+        f.write(b"\0")
+    assert input_hash(tmp_path / "manifests", project_root) == initial_hash
+
+    with open(os.path.join(project_root, "notes.txt"), "w") as f:
+        f.write("changed\n")
+    assert input_hash(tmp_path / "manifests", project_root) != initial_hash
+
+
+def test_tree_hash_outside_git(make_project, tmp_path):
+    project_root = make_project(FILES)
+    initial_hash = input_hash(tmp_path / "manifests", project_root)
+
+    os.makedirs(os.path.join(project_root, "pkg", "__pycache__"))
+    with open(os.path.join(project_root, "pkg", "__pycache__", "mod.cpython-311.pyc"), "wb") as f:
+        f.write(b"\0")
+    assert input_hash(tmp_path / "manifests", project_root) == initial_hash
+
+    with open(os.path.join(project_root, "pkg", "mod.py"), "w") as f:
+        f.write("x = 2\n")
+    assert input_hash(tmp_path / "manifests", project_root) != initial_hash
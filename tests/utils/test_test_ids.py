@@ -0,0 +1,59 @@
+import pytest
+
+from sweflow.utils.test_ids import PassToPassTestIds
+
+STEPS = {0: ["t::a"], 1: ["t::b", "t::c"], 2: ["t::d"]}
+EXPECTED = {0: [], 1: ["t::a"], 2: ["t::a", "t::b", "t::c"]}
+
+
+def build_test_ids():
+    test_ids = PassToPassTestIds()
+    for step, fail_to_pass_test_ids in STEPS.items():
+        test_ids.add_step(step, fail_to_pass_test_ids)
+    return test_ids
+
+
+def test_add_step_accumulates_previous_steps():
+    test_ids = build_test_ids()
+
+    assert test_ids.steps() == [0, 1, 2]
+    assert {step: test_ids.get(step) for step in test_ids.steps()} == EXPECTED
+
+
+def test_expanded_is_the_default_format(tmp_path):
+    build_test_ids().dump(tmp_path / "pass-to-pass-test-ids.json")
+
+    loaded = PassToPassTestIds.load(tmp_path / "pass-to-pass-test-ids.json")
+
+    assert loaded.expanded == EXPECTED
+    assert build_test_ids().to_json() == [{"step": step, "pass-to-pass-test-ids": ids} for step, ids in EXPECTED.items()]
+
+
+def test_prefix_format_round_trip(tmp_path):
+    build_test_ids().dump(tmp_path / "pass-to-pass-test-ids.json", "prefix")
+
+    loaded = PassToPassTestIds.load(tmp_path / "pass-to-pass-test-ids.json")
+
+    assert loaded.expanded is None
+    assert loaded.test_ids == ["t::a", "t::b", "t::c", "t::d"]
+    assert {step: loaded.get(step) for step in loaded.steps()} == EXPECTED
+    assert loaded.to_json("expanded") == build_test_ids().to_json("expanded")
+
+
+def test_expanded_cannot_be_written_as_prefix():
+    loaded = PassToPassTestIds.from_json(build_test_ids().to_json("expanded"))
+
+    with pytest.raises(ValueError):
+        loaded.to_json("prefix")
+
+
+def test_expanded_is_written_step_by_step(tmp_path, monkeypatch):
+    test_ids = build_test_ids()
+    # the full list of the copies of every step is never built
+    monkeypatch.setattr(PassToPassTestIds, "to_json", lambda self, pass_to_pass_format="expanded": pytest.fail("built in memory"))
+    test_ids.dump(tmp_path / "pass-to-pass-test-ids.json")
+
+    lines = (tmp_path / "pass-to-pass-test-ids.json").read_text().split("\n")
+
+    assert len(lines) == len(STEPS) + 2
+    assert PassToPassTestIds.load(tmp_path / "pass-to-pass-test-ids.json").expanded == EXPECTED
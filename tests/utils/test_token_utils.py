@@ -0,0 +1,29 @@
+import pytest
+
+from sweflow.utils.token_utils import TokenCounter
+
+
+@pytest.mark.parametrize("string", [
+    "",
+    "short",
+    "é" * 6,
+    "word " * 3,
+    "line of code\n" * 50,
+    "x" * 1000,
+    "a = 1\n" + "y" * 500,
+])
+@pytest.mark.parametrize("n", [0, 1, 10, 11, 200])
+def test_at_least_agrees_with_count(byte_encoding, string, n):
+    assert TokenCounter.at_least(string, n) == (TokenCounter.count_tokens_of_string(string) >= n)
+
+
+def test_at_least_skips_short_strings(byte_encoding):
+    assert not TokenCounter.at_least("short", 10)
+    assert byte_encoding == []
+
+
+def test_at_least_encodes_a_prefix_of_long_strings(byte_encoding):
+    string = "line of code\n" * 10_000
+
+    assert TokenCounter.at_least(string, 10)
+    assert byte_encoding and max(byte_encoding) < 100